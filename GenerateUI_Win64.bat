@@ -5,4 +5,5 @@ REM Run me in Anaconda Prompt with the corresponding environment enabled!
 echo Running pyuic5...
 call pyuic5 ui\datmant.ui -o ui\datmant_ui.py
 call pyuic5 ui\color_specs.ui -o ui\color_specs_ui.py
+call pyuic5 ui\summary_table.ui -o ui\summary_table_ui.py
 echo Done.
\ No newline at end of file
@@ -0,0 +1,218 @@
+# Headless benchmark of the QtImageAnnotator hot paths on synthetic orthoframes and masks.
+#
+# Every frame size is measured in a separate child process, so that the reported peak RSS
+# belongs to that size only. The result is a JSON report with per-operation latency distributions.
+#
+# Usage (from the repository root):
+#   python bench/bench_annotator.py --sizes 2048 4096 8192 16384 --output bench_annotator.json
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchutil import (qt_app, send_mouse, send_key, color_conversion_dicts, synthetic_orthoframe,
+                       synthetic_road_mask, synthetic_defect_mask, latency_stats, peak_rss_bytes,
+                       environment_info, write_report)
+
+DEFAULT_SIZES = [2048, 4096, 8192, 16384]
+
+# Same helper color as the GUI uses for the area outside of the road
+HELPER_RGBA = (0, 0, 0, 99)
+
+
+# Scene coordinates of a synthetic brush stroke: a wavy diagonal line of num_points points
+def stroke_points(k, h, w, num_points):
+    t = np.linspace(0.0, 1.0, num_points)
+    x0, y0 = (0.30 + 0.05 * (k % 5)) * w, (0.10 + 0.03 * (k % 7)) * h
+    xs = x0 + 0.20 * w * t + 0.02 * w * np.sin(12 * np.pi * t + k)
+    ys = y0 + 0.60 * h * t
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+def run_single(size, args):
+    app = qt_app()
+
+    from PyQt5.QtCore import Qt, QRectF, QPoint
+    from PyQt5.QtGui import QColor
+    from qimage2ndarray import array2qimage
+    from ui_lib.QtImageAnnotator import QtImageAnnotator, bitmask_qimage
+    from lib.packedmask import PackedMask
+
+    samples = collections.defaultdict(list)
+
+    def timed(name, func, *fargs, **fkwargs):
+        t0 = time.perf_counter()
+        result = func(*fargs, **fkwargs)
+        samples[name].append(time.perf_counter() - t0)
+        return result
+
+    h = w = size
+    rgb2g, g2rgb = color_conversion_dicts()
+
+    annotator = QtImageAnnotator()
+    annotator.d_rgb2gray = rgb2g
+    annotator.d_gray2rgb = g2rgb
+    annotator.resize(args.viewport[0], args.viewport[1])
+    annotator.show()
+    app.processEvents()
+
+    # Synthetic layers, prepared like DATMantGUI.update_annotator_view() does
+    t0 = time.perf_counter()
+    img = synthetic_orthoframe(h, w)
+    road = synthetic_road_mask(h, w)
+    defects = synthetic_defect_mask(h, w, sorted(g2rgb.keys()))
+    road = PackedMask(road)  # Kept alive while the helper, which shares its memory, is used
+    helper = bitmask_qimage(road.bits, w, [QColor(*HELPER_RGBA), QColor(0, 0, 0, 0)])
+    image = array2qimage(img)
+    synth_time = time.perf_counter() - t0
+
+    for _ in range(args.repeats):
+        timed("clearAndSetImageAndMask", annotator.clearAndSetImageAndMask, image, defects, helper,
+              process_gray2rgb=True, direct_mask_paint=True)
+        timed("first_paint", app.processEvents)
+
+    for _ in range(args.repeats):
+        timed("repaint_fit", annotator.viewport().repaint)
+
+    # Mouse moves without a button held, each followed by the repaints they cause
+    def hover_move(x, y):
+        send_mouse(annotator, "move", x, y, buttons=Qt.NoButton)
+        app.processEvents()
+
+    def hover(name, points):
+        for x, y in points:
+            timed(name, hover_move, x, y)
+
+    hover("hover_move", stroke_points(0, h, w, args.stroke_points))
+
+    # A move event and whatever the event loop does before the next one arrives (drawing the stroke, repaints)
+    def stroke_move(x, y):
+        send_mouse(annotator, "move", x, y)
+        app.processEvents()
+
+    # Brush strokes with the first defect color, with move events arriving at --move-rate
+    first_gray = min(g2rgb.keys())
+    annotator.brush_fill_color = QColor("#63" + g2rgb[first_gray].split("#")[1])
+    for k in range(args.strokes):
+        pts = stroke_points(k, h, w, args.stroke_points)
+        timed("stroke_press", send_mouse, annotator, "press", *pts[0])
+        t_stroke = t_next = time.perf_counter()
+        for x, y in pts[1:]:
+            if args.move_rate > 0:
+                t_next += 1.0 / args.move_rate
+                time.sleep(max(0.0, t_next - time.perf_counter()))
+            timed("stroke_move", stroke_move, x, y)
+        timed("stroke_release", send_mouse, annotator, "release", *pts[-1])
+        if args.move_rate > 0:
+            # How much longer the stroke took to draw than the mouse took to make it
+            samples["stroke_lag"].append(time.perf_counter() - t_stroke - (len(pts) - 1) / args.move_rate)
+        timed("stroke_repaint", annotator.viewport().repaint)
+
+    # Fill of an empty area and removal of a painted contour, each followed by undo
+    ys, xs = np.nonzero(defects == first_gray)
+    contour_xy = (float(xs[len(xs) // 2]), float(ys[len(ys) // 2])) if len(xs) else (w / 2.0, h / 2.0)
+    empty_xy = (2.0, 2.0)
+    for _ in range(args.repeats):
+        send_mouse(annotator, "move", *empty_xy, buttons=Qt.NoButton)
+        timed("fillArea", annotator.fillArea)
+        timed("undo", send_key, annotator, Qt.Key_Z, Qt.ControlModifier)
+        send_mouse(annotator, "move", *contour_xy, buttons=Qt.NoButton)
+        timed("fillArea_remove_contour", annotator.fillArea, remove_closed_contour=True)
+        timed("undo", send_key, annotator, Qt.Key_Z, Qt.ControlModifier)
+
+    for _ in range(args.repeats):
+        timed("export_rgb2gray_mask", annotator.export_rgb2gray_mask)
+
+    # Zooming in around the cursor and back out with the keyboard, each followed by the repaint
+    def zoom_key(key):
+        send_key(annotator, key)
+        app.processEvents()
+
+    send_mouse(annotator, "move", w / 2.0, h / 2.0, buttons=Qt.NoButton)
+    for _ in range(args.repeats):
+        timed("zoom_in", zoom_key, Qt.Key_Plus)
+        timed("zoom_out", zoom_key, Qt.Key_Minus)
+
+    # Repaint and pan while zoomed in to 1/8 of the frame
+    annotator.zoomStack.append(QRectF(w * 7 / 16.0, h * 7 / 16.0, w / 8.0, h / 8.0))
+    annotator.updateViewer()
+    app.processEvents()
+    for _ in range(args.repeats):
+        timed("repaint_zoomed", annotator.viewport().repaint)
+    hover("hover_move_zoomed", [(w / 2.0 + w / 64.0 * np.cos(t), h / 2.0 + h / 64.0 * np.sin(t))
+                                for t in np.linspace(0, 2 * np.pi, args.stroke_points)])
+
+    # Panning with the middle button, a few viewport pixels per move. The mouse is given in viewport
+    # coordinates, which map to other scene coordinates as the view pans
+    def pan_move(vx, vy, etype="move"):
+        p = annotator.mapToScene(QPoint(vx, vy))
+        send_mouse(annotator, etype, p.x(), p.y(), button=Qt.MiddleButton, buttons=Qt.MiddleButton)
+        app.processEvents()
+
+    cx, cy = annotator.viewport().width() // 2, annotator.viewport().height() // 2
+    pan_move(cx, cy, "press")
+    for i in range(1, args.stroke_points):
+        timed("pan_move", pan_move, cx + 4 * (i % 20), cy + 3 * (i % 20))
+    send_mouse(annotator, "release", w / 2.0, h / 2.0, button=Qt.MiddleButton, buttons=Qt.NoButton)
+
+    return {"size": [h, w],
+            "synthesis_s": synth_time,
+            "operations": {name: latency_stats(vals) for name, vals in sorted(samples.items())},
+            "peak_rss_bytes": peak_rss_bytes()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless QtImageAnnotator benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="square frame sizes to benchmark (default: %(default)s)")
+    parser.add_argument("--repeats", type=int, default=5, help="repetitions of the whole-frame operations")
+    parser.add_argument("--strokes", type=int, default=20, help="number of synthetic brush strokes")
+    parser.add_argument("--stroke-points", type=int, default=200, help="mouse move events per stroke")
+    parser.add_argument("--move-rate", type=float, default=1000.0,
+                        help="mouse move events per second during strokes, 0 for as fast as possible")
+    parser.add_argument("--viewport", type=int, nargs=2, default=[1280, 800], metavar=("W", "H"),
+                        help="size of the annotator widget")
+    parser.add_argument("--output", default="-", help="JSON report path (default: stdout)")
+    parser.add_argument("--in-process", action="store_true",
+                        help="run all sizes in this process (peak RSS is then cumulative)")
+    parser.add_argument("--single", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process mode: benchmark one size and print the result
+    if args.single is not None:
+        print(json.dumps(run_single(args.single, args)))
+        return
+
+    results = []
+    for size in args.sizes:
+        print("Benchmarking " + str(size) + "x" + str(size) + "...", file=sys.stderr)
+        if args.in_process:
+            results.append(run_single(size, args))
+            continue
+
+        cmd = [sys.executable, os.path.abspath(__file__), "--single", str(size),
+               "--repeats", str(args.repeats), "--strokes", str(args.strokes),
+               "--stroke-points", str(args.stroke_points), "--move-rate", str(args.move_rate),
+               "--viewport", str(args.viewport[0]), str(args.viewport[1])]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE)
+        if proc.returncode != 0:
+            results.append({"size": [size, size], "error": "benchmark process exited with code " +
+                                                           str(proc.returncode)})
+        else:
+            results.append(json.loads(proc.stdout.decode("utf-8").strip().splitlines()[-1]))
+
+    write_report({"benchmark": "qtimageannotator",
+                  "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "environment": environment_info(),
+                  "parameters": {"repeats": args.repeats, "strokes": args.strokes,
+                                 "stroke_points": args.stroke_points, "viewport": args.viewport},
+                  "results": results}, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# Benchmark of the TK shapefile pipeline (lib.tkmask) on synthetic shapefiles and frames.
+#
+# A synthetic drive is generated: a row of frames (.vrt + .mask.png) along a straight road and
+# defects_polygon/line/point shapefiles with the requested number of defects scattered over it.
+# Then the TK layer is generated for every frame of the directory, the way DATMantGUI.load_image()
+# does it, and per-frame latency and batch throughput are reported as JSON.
+#
+# Usage (from the repository root):
+#   python bench/bench_tkmask.py --defects 1000 10000 100000 1000000 --frames 20 --output bench_tkmask.json
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import cv2
+import shapefile
+from qimage2ndarray import raw_view
+
+from benchutil import (read_color_defs, synthetic_road_mask, latency_stats, peak_rss_bytes,
+                       environment_info, write_report)
+from lib import tracing
+from lib.tkmask import generate_tk_defects_layer, SHAPETYPES
+
+DEFAULT_DEFECT_COUNTS = [1000, 10000, 100000, 1000000]
+
+# Synthetic geometry: frames are laid out along the x axis in a projected (metric) coordinate system
+GEO_X0 = 650000.0
+GEO_Y0 = 6470000.0
+PIXEL_SIZE = 0.0025  # meters per pixel
+
+# Defect types by how tkmask draws them (indices into SHAPETYPES)
+LINE_TYPES = [0, 1, 2, 3, 4]
+POLYGON_TYPES = [5, 6, 7]
+POINT_TYPES = [8]
+
+
+def frame_name(k):
+    return "frame_%05d" % k
+
+
+# Same mapping as DATMantGUI.add_colors_to_list() builds; shape types without a color spec get gray
+def tk_color_defs():
+    tk2rgb = {}
+    for col in read_color_defs():
+        for ks in col["COLOR_ABBR_ET"].split(","):
+            tk2rgb[ks.strip()] = col["COLOR_HEXRGB_TK"]
+    for st in SHAPETYPES:
+        tk2rgb.setdefault(st, "#dddddd")
+    return tk2rgb
+
+
+def write_vrt(path, k, h, w):
+    x0 = GEO_X0 + k * w * PIXEL_SIZE
+    # NB! tkmask.runvrt() expects the two spaces that GDAL writes after the opening tag
+    gt = "  %.10e,  %.10e,  0.0000000000e+00,  %.10e,  0.0000000000e+00, %.10e" % (x0, PIXEL_SIZE, GEO_Y0,
+                                                                                   -PIXEL_SIZE)
+    with open(path, "w") as f:
+        f.write('<VRTDataset rasterXSize="%d" rasterYSize="%d">\n' % (w, h))
+        f.write('  <GeoTransform>' + gt + '</GeoTransform>\n')
+        f.write('</VRTDataset>\n')
+
+
+# Write num_defects defects spread over the extent of num_frames frames into the three shapefiles
+def write_shapefiles(shp_dir, num_defects, num_frames, h, w, seed=0):
+    rs = np.random.RandomState(seed)
+    width_m = num_frames * w * PIXEL_SIZE
+    height_m = h * PIXEL_SIZE
+
+    # Defect size in meters
+    size_m = 200 * PIXEL_SIZE
+
+    writers = {}
+    for name, stype in (("defects_polygon", shapefile.POLYGON),
+                        ("defects_line", shapefile.POLYLINE),
+                        ("defects_point", shapefile.POINT)):
+        wr = shapefile.Writer(os.path.join(shp_dir, name), shapeType=stype)
+        wr.field("ID", "N", 10)
+        wr.field("DRIVE", "C", 20)
+        wr.field("TYYP", "C", 10)  # tkmask reads the defect type from the third field
+        writers[name] = wr
+
+    xs = GEO_X0 + rs.uniform(0, width_m, num_defects)
+    ys = GEO_Y0 - rs.uniform(0, height_m, num_defects)
+    kinds = rs.randint(0, 3, num_defects)
+    for i in range(num_defects):
+        x, y = float(xs[i]), float(ys[i])
+        if kinds[i] == 0:
+            tyyp = SHAPETYPES[POLYGON_TYPES[i % len(POLYGON_TYPES)]]
+            ring = [[x, y], [x + size_m, y], [x + size_m, y - size_m], [x, y - size_m], [x, y]]
+            writers["defects_polygon"].poly([ring])
+            writers["defects_polygon"].record(i, "bench", tyyp)
+        elif kinds[i] == 1:
+            tyyp = SHAPETYPES[LINE_TYPES[i % len(LINE_TYPES)]]
+            writers["defects_line"].line([[[x, y], [x + size_m, y - size_m / 2], [x + 2 * size_m, y]]])
+            writers["defects_line"].record(i, "bench", tyyp)
+        else:
+            tyyp = SHAPETYPES[POINT_TYPES[0]]
+            writers["defects_point"].point(x, y)
+            writers["defects_point"].record(i, "bench", tyyp)
+
+    for wr in writers.values():
+        wr.close()
+
+
+# Synthetic drive: frames in img_dir, shapefiles in img_dir/shp
+def generate_dataset(root, num_defects, num_frames, h, w):
+    img_dir = os.path.join(root, "frames")
+    shp_dir = os.path.join(root, "shp")
+    os.makedirs(img_dir, exist_ok=True)
+    os.makedirs(shp_dir, exist_ok=True)
+
+    road = synthetic_road_mask(h, w)
+    for k in range(num_frames):
+        cv2.imwrite(os.path.join(img_dir, frame_name(k) + ".mask.png"), road)
+        write_vrt(os.path.join(img_dir, frame_name(k) + ".vrt"), k, h, w)
+
+    write_shapefiles(shp_dir, num_defects, num_frames, h, w)
+    return img_dir, shp_dir
+
+
+def run_batch(img_dir, shp_dir, colordefs):
+    # Same path conventions as the GUI: trailing separators on both directories
+    img_path = img_dir + os.sep
+    shp_path = shp_dir + os.sep
+
+    names = sorted(f[:-len(".vrt")] for f in os.listdir(img_dir) if f.endswith(".vrt"))
+    per_frame = []
+    drawn = 0
+    t_batch = time.perf_counter()
+    for name in names:
+        t0 = time.perf_counter()
+        layer = generate_tk_defects_layer(img_path, shp_path, name, colordefs)
+        per_frame.append(time.perf_counter() - t0)
+        drawn += int(np.count_nonzero(raw_view(layer)))
+    batch_time = time.perf_counter() - t_batch
+
+    return {"frames": len(names),
+            "batch_s": batch_time,
+            "frames_per_s": len(names) / batch_time if batch_time > 0 else None,
+            "per_frame": latency_stats(per_frame),
+            "drawn_pixels": drawn}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TK shapefile pipeline benchmark")
+    parser.add_argument("--defects", type=int, nargs="+", default=DEFAULT_DEFECT_COUNTS,
+                        help="total defect counts in the synthetic shapefiles (default: %(default)s)")
+    parser.add_argument("--frames", type=int, default=20, help="frames in the synthetic drive")
+    parser.add_argument("--frame-size", type=int, nargs=2, default=[4096, 4096], metavar=("W", "H"),
+                        help="frame size in pixels")
+    parser.add_argument("--workdir", default=None,
+                        help="where to generate the synthetic data (default: a temporary folder)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated data")
+    parser.add_argument("--output", default="-", help="JSON report path (default: stdout)")
+    args = parser.parse_args()
+
+    w, h = args.frame_size
+    colordefs = tk_color_defs()
+    root = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix="datm_bench_tk_")
+
+    # Collect the tkmask internal spans (getdefects, runvrt, ...) as well
+    tracing.enable()
+
+    results = []
+    try:
+        for num_defects in args.defects:
+            print("Benchmarking " + str(num_defects) + " defects over " + str(args.frames) + " frames...",
+                  file=sys.stderr)
+            data_root = os.path.join(root, "defects_" + str(num_defects))
+            t0 = time.perf_counter()
+            img_dir, shp_dir = generate_dataset(data_root, num_defects, args.frames, h, w)
+            gen_time = time.perf_counter() - t0
+
+            tracing.clear()
+            res = run_batch(img_dir, shp_dir, colordefs)
+            res["defects"] = num_defects
+            res["generation_s"] = gen_time
+            res["spans"] = tracing.summary()
+            results.append(res)
+
+            if not args.keep:
+                shutil.rmtree(data_root)
+    finally:
+        if not args.keep and args.workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    write_report({"benchmark": "tkmask",
+                  "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "environment": environment_info(),
+                  "parameters": {"frames": args.frames, "frame_size": [w, h]},
+                  "peak_rss_bytes": peak_rss_bytes(),
+                  "results": results}, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+# Shared helpers for the benchmark and soak scripts in this folder.
+# Importing this module also puts the repository root on sys.path so that lib and ui_lib can be imported.
+import os
+import sys
+import csv
+import json
+import math
+import platform
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+import cv2
+
+COLOR_DEF_PATH = os.path.join(REPO_ROOT, "defs", "color_defs.csv")
+
+
+# Run Qt without a display. Must be called before the QApplication is created
+def use_offscreen_qt():
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+# Color specification as a list of dicts, same content as the GUI reads from defs/color_defs.csv
+def read_color_defs(path=COLOR_DEF_PATH):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f, delimiter=";"))
+
+
+# Conversion dicts as set up by DATMantGUI.add_colors_to_list(): (rgb2gray, gray2rgb)
+def color_conversion_dicts(cspec=None):
+    if cspec is None:
+        cspec = read_color_defs()
+    rgb2g = {}
+    g2rgb = {}
+    for col in cspec:
+        rgb_val = col["COLOR_HEXRGB_DATMANT"].lower()
+        g_val = int(col["COLOR_GSCALE_MAPPING"])
+        g2rgb[g_val] = rgb_val
+        rgb2g[rgb_val] = g_val
+    return rgb2g, g2rgb
+
+
+# QApplication for headless runs (created on first use)
+def qt_app():
+    use_offscreen_qt()
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance()
+    if app is None:
+        app = QApplication([sys.argv[0]])
+    return app
+
+
+# Deliver a synthetic mouse event at scene coordinates (x, y) to a QGraphicsView, the way Qt would
+# deliver a real one (through the viewport). etype is "press", "move", "release" or "dblclick".
+def send_mouse(view, etype, x, y, button=None, buttons=None, modifiers=None):
+    from PyQt5.QtCore import Qt, QEvent, QPointF
+    from PyQt5.QtGui import QMouseEvent
+    from PyQt5.QtWidgets import QApplication
+
+    types = {"press": QEvent.MouseButtonPress,
+             "move": QEvent.MouseMove,
+             "release": QEvent.MouseButtonRelease,
+             "dblclick": QEvent.MouseButtonDblClick}
+    button = Qt.LeftButton if button is None else button
+    if buttons is None:
+        buttons = Qt.NoButton if etype == "release" else Qt.LeftButton
+    if etype == "move":
+        button = Qt.NoButton
+    modifiers = Qt.NoModifier if modifiers is None else modifiers
+
+    pos = QPointF(view.mapFromScene(QPointF(x, y)))
+    QApplication.sendEvent(view.viewport(), QMouseEvent(types[etype], pos, button, buttons, modifiers))
+
+
+# Deliver a synthetic mouse wheel event at scene coordinates (x, y) to a QGraphicsView
+def send_wheel(view, x, y, angle_delta, buttons=None, modifiers=None):
+    from PyQt5.QtCore import Qt, QPoint, QPointF
+    from PyQt5.QtGui import QWheelEvent
+    from PyQt5.QtWidgets import QApplication
+
+    buttons = Qt.NoButton if buttons is None else buttons
+    modifiers = Qt.NoModifier if modifiers is None else modifiers
+    pos = QPointF(view.mapFromScene(QPointF(x, y)))
+    gpos = QPointF(view.viewport().mapToGlobal(pos.toPoint()))
+    try:
+        event = QWheelEvent(pos, gpos, QPoint(0, 0), QPoint(0, angle_delta), buttons, modifiers,
+                            Qt.NoScrollPhase, False)
+    except TypeError:
+        # Older Qt 5 versions only have the constructor with the Qt 4 style delta
+        event = QWheelEvent(pos, gpos, QPoint(0, 0), QPoint(0, angle_delta), angle_delta, Qt.Vertical,
+                            buttons, modifiers)
+    QApplication.sendEvent(view.viewport(), event)
+
+
+# Deliver a synthetic key press and/or release to a widget
+def send_key(widget, key, modifiers=None, press=True, release=True, auto_repeat=False):
+    from PyQt5.QtCore import Qt, QEvent
+    from PyQt5.QtGui import QKeyEvent
+    from PyQt5.QtWidgets import QApplication
+
+    modifiers = Qt.NoModifier if modifiers is None else modifiers
+    if press:
+        QApplication.sendEvent(widget, QKeyEvent(QEvent.KeyPress, key, modifiers, "", auto_repeat))
+    if release:
+        QApplication.sendEvent(widget, QKeyEvent(QEvent.KeyRelease, key, modifiers, "", auto_repeat))
+
+
+# Synthetic orthoframe: a fixed noise block tiled over the frame plus a gradient, so that it
+# compresses and renders roughly like a real photo rather than like a flat color
+def synthetic_orthoframe(h, w, seed=0):
+    rs = np.random.RandomState(seed)
+    block = rs.randint(0, 64, (256, 256, 3)).astype(np.uint8)
+    img = np.tile(block, (int(math.ceil(h / 256)), int(math.ceil(w / 256)), 1))[:h, :w]
+    ramp = np.linspace(64, 160, w, dtype=np.float32).astype(np.uint8)
+    img += ramp[None, :, None]
+    return np.ascontiguousarray(img)
+
+
+# Synthetic road mask: a slanted band through the middle of the frame (255 = road, 0 = off road)
+def synthetic_road_mask(h, w):
+    mask = np.zeros((h, w), np.uint8)
+    band = np.array([[int(0.30 * w), 0], [int(0.65 * w), 0],
+                     [int(0.70 * w), h - 1], [int(0.35 * w), h - 1]], np.int32)
+    cv2.fillPoly(mask, [band], 255)
+    return mask
+
+
+# Synthetic grayscale defect mask with blobs and cracks of the given class values
+def synthetic_defect_mask(h, w, grays, num_defects=40, seed=0):
+    rs = np.random.RandomState(seed)
+    mask = np.zeros((h, w), np.uint8)
+    grays = list(grays)
+    scale = max(h, w) / 4096.0
+    for k in range(num_defects):
+        g = int(grays[k % len(grays)])
+        x, y = int(rs.randint(0, w)), int(rs.randint(0, h))
+        if k % 2:
+            cv2.circle(mask, (x, y), int(rs.randint(20, 80) * scale) + 1, g, -1)
+        else:
+            x2 = int(np.clip(x + rs.randint(-400, 400) * scale, 0, w - 1))
+            y2 = int(np.clip(y + rs.randint(-400, 400) * scale, 0, h - 1))
+            cv2.line(mask, (x, y), (x2, y2), g, int(20 * scale) + 1)
+    return mask
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(math.ceil(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+# Latency distribution (in milliseconds) of a list of durations given in seconds
+def latency_stats(samples):
+    vals = sorted(s * 1000.0 for s in samples)
+    if not vals:
+        return {"count": 0}
+    return {"count": len(vals),
+            "mean_ms": sum(vals) / len(vals),
+            "min_ms": vals[0],
+            "p50_ms": percentile(vals, 50),
+            "p95_ms": percentile(vals, 95),
+            "p99_ms": percentile(vals, 99),
+            "max_ms": vals[-1]}
+
+
+# Current resident set size of this process in bytes (None if it cannot be determined)
+def current_rss_bytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Peak resident set size of this process in bytes (None if it cannot be determined)
+def peak_rss_bytes():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        mi = psutil.Process().memory_info()
+        return getattr(mi, "peak_wset", mi.rss)
+    except ImportError:
+        return None
+
+
+def environment_info():
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__}
+
+
+# Write a JSON report to the given path, or to stdout if path is None or "-"
+def write_report(report, path=None):
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if path is None or path == "-":
+        print(text)
+    else:
+        with open(path, "w") as f:
+            f.write(text)
@@ -0,0 +1,163 @@
+# Replay a recorded input session (see ui_lib/QtInputRecorder.py) in a headless QtImageAnnotator
+# and report the latency of every replayed event, grouped by event type, as JSON.
+#
+# Each event is delivered like Qt delivers real input and the time is measured until all resulting
+# work, including repainting, has been processed. Recordings are made in the tool with
+# View->Record input session, or with QtImageAnnotator.startRecording()/stopRecording().
+#
+# Usage (from the repository root):
+#   python bench/replay_session.py session.npz --frame C:/Data/drive/frame_00123.jpg --output replay.json
+# Without --frame, a synthetic frame of the recorded size is used.
+import argparse
+import collections
+import os
+import sys
+import time
+
+import numpy as np
+import cv2
+
+from benchutil import (qt_app, send_mouse, send_wheel, send_key, read_color_defs, color_conversion_dicts,
+                       synthetic_orthoframe, synthetic_road_mask, synthetic_defect_mask, latency_stats,
+                       peak_rss_bytes, environment_info, write_report)
+from ui_lib.QtInputRecorder import (load_recording, EVENT_NAMES, EVENT_FRAME, EVENT_MOUSE_PRESS,
+                                    EVENT_MOUSE_RELEASE, EVENT_MOUSE_MOVE, EVENT_MOUSE_DOUBLE_CLICK,
+                                    EVENT_WHEEL, EVENT_KEY_PRESS, EVENT_KEY_RELEASE)
+from lib.packedmask import PackedMask
+
+MOUSE_EVENT_TYPES = {EVENT_MOUSE_PRESS: "press",
+                     EVENT_MOUSE_RELEASE: "release",
+                     EVENT_MOUSE_MOVE: "move",
+                     EVENT_MOUSE_DOUBLE_CLICK: "dblclick"}
+
+# Same helper color as the GUI uses for the area outside of the road
+HELPER_RGBA = (0, 0, 0, 99)
+
+
+# Image, grayscale defect mask and packed road mask of the helper layer for the replay, prepared like
+# the GUI does
+def load_frame_layers(frame_path, shape, grays):
+    from qimage2ndarray import array2qimage
+
+    if frame_path is not None:
+        base = os.path.splitext(frame_path)[0]
+        img = cv2.cvtColor(cv2.imread(frame_path), cv2.COLOR_BGR2RGB)
+        h, w = img.shape[:2]
+        road = cv2.imread(base + ".mask.png", cv2.IMREAD_GRAYSCALE)
+        if road is not None:
+            from lib.annotmask import get_sqround_mask
+            road = get_sqround_mask(road)
+        else:
+            road = 255 * np.ones((h, w), np.uint8)
+        defects = cv2.imread(base + ".defect.mask.png", cv2.IMREAD_GRAYSCALE)
+        if defects is None:
+            defects = np.zeros((h, w), np.uint8)
+    else:
+        h, w = shape
+        img = synthetic_orthoframe(h, w)
+        road = synthetic_road_mask(h, w)
+        defects = synthetic_defect_mask(h, w, grays)
+
+    return array2qimage(img), defects, PackedMask(road)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded input session in a headless annotator")
+    parser.add_argument("recording", help="recording file (.npz)")
+    parser.add_argument("--frame", default=None,
+                        help="orthoframe (.jpg) to replay on; its .mask.png and .defect.mask.png are used if present")
+    parser.add_argument("--realtime", action="store_true",
+                        help="keep the recorded timing between events instead of replaying as fast as possible")
+    parser.add_argument("--output", default="-", help="JSON report path (default: stdout)")
+    args = parser.parse_args()
+
+    events, meta = load_recording(args.recording)
+    app = qt_app()
+
+    from PyQt5.QtCore import Qt, QRectF
+    from PyQt5.QtGui import QColor
+    from ui_lib.QtImageAnnotator import QtImageAnnotator, bitmask_qimage
+
+    cspec = read_color_defs()
+    rgb2g, g2rgb = color_conversion_dicts(cspec)
+    annotator = QtImageAnnotator()
+    annotator.d_rgb2gray = rgb2g
+    annotator.d_gray2rgb = g2rgb
+
+    # Brush colors as selected in the GUI with the number keys 1..9; the first one is the default
+    brush_colors = {Qt.Key_1 + k: QColor("#63" + col["COLOR_HEXRGB_DATMANT"].split("#")[1])
+                    for k, col in enumerate(cspec[:9])}
+    annotator.brush_fill_color = brush_colors[Qt.Key_1]
+    vw, vh = meta.get("viewport", [1280, 800])
+    annotator.resize(vw, vh)
+    annotator.show()
+    app.processEvents()
+
+    # Recorded frame size is stored with the frame events
+    frames = events[events["type"] == EVENT_FRAME]
+    shape = (int(frames[0]["y"]), int(frames[0]["x"])) if len(frames) else (4096, 4096)
+    image, defects, road = load_frame_layers(args.frame, shape, sorted(g2rgb.keys()))
+    helper = bitmask_qimage(road.bits, road.shape[1], [QColor(*HELPER_RGBA), QColor(0, 0, 0, 0)])
+
+    def set_frame():
+        annotator.clearAndSetImageAndMask(image, defects, helper, process_gray2rgb=True, direct_mask_paint=True)
+
+    annotator.zoomStack = [QRectF(*r) for r in meta.get("zoom_stack", [])]
+    set_frame()
+    app.processEvents()
+
+    # The initial frame event only marks the state at the start of the recording
+    if len(events) and events[0]["type"] == EVENT_FRAME:
+        events = events[1:]
+
+    print("Replaying " + str(len(events)) + " events...", file=sys.stderr)
+
+    samples = collections.defaultdict(list)
+    t_start = time.perf_counter()
+    for ev in events:
+        etype = int(ev["type"])
+        if args.realtime:
+            delay = t_start + float(ev["t"]) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        buttons = Qt.MouseButtons(int(ev["buttons"]))
+        modifiers = Qt.KeyboardModifiers(int(ev["modifiers"]))
+        x, y = float(ev["x"]), float(ev["y"])
+
+        t0 = time.perf_counter()
+        if etype in MOUSE_EVENT_TYPES:
+            send_mouse(annotator, MOUSE_EVENT_TYPES[etype], x, y, button=Qt.MouseButton(int(ev["button"])),
+                       buttons=buttons, modifiers=modifiers)
+        elif etype == EVENT_WHEEL:
+            send_wheel(annotator, x, y, int(ev["key"]), buttons=buttons, modifiers=modifiers)
+        elif etype in (EVENT_KEY_PRESS, EVENT_KEY_RELEASE):
+            # The GUI switches the defect color on number keys; there is no GUI here, so do it directly
+            if etype == EVENT_KEY_PRESS and int(ev["key"]) in brush_colors:
+                annotator.brush_fill_color = brush_colors[int(ev["key"])]
+            send_key(annotator, int(ev["key"]), modifiers, press=(etype == EVENT_KEY_PRESS),
+                     release=(etype == EVENT_KEY_RELEASE), auto_repeat=bool(ev["auto_repeat"]))
+        elif etype == EVENT_FRAME:
+            set_frame()
+        app.processEvents()
+        samples[EVENT_NAMES[etype]].append(time.perf_counter() - t0)
+    replay_time = time.perf_counter() - t_start
+
+    all_samples = [s for vals in samples.values() for s in vals]
+    write_report({"benchmark": "replay_session",
+                  "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "environment": environment_info(),
+                  "recording": os.path.basename(args.recording),
+                  "recording_metadata": meta,
+                  "frame": args.frame,
+                  "frame_size": [image.height(), image.width()],
+                  "realtime": args.realtime,
+                  "events": len(events),
+                  "replay_s": replay_time,
+                  "all_events": latency_stats(all_samples),
+                  "by_type": {name: latency_stats(vals) for name, vals in sorted(samples.items())},
+                  "peak_rss_bytes": peak_rss_bytes()}, args.output)
+
+
+if __name__ == '__main__':
+    main()
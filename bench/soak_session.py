@@ -0,0 +1,165 @@
+# Long-session soak test of the full GUI: loads, paints, saves and advances through many synthetic
+# frames via DATMantGUI.load_next_image() under the offscreen Qt platform, sampling RSS and Python
+# object counts after every frame. Exits with code 1 if memory keeps growing beyond the thresholds.
+#
+# Usage (from the repository root):
+#   python bench/soak_session.py --frames 1000 --size 2048 --output soak.json
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import cv2
+
+from benchutil import (REPO_ROOT, qt_app, send_mouse, synthetic_orthoframe, synthetic_road_mask,
+                       current_rss_bytes, peak_rss_bytes, environment_info, write_report)
+
+MB = 1024 * 1024
+
+
+def frame_name(k):
+    return "frame_%05d" % k
+
+
+# Frames with a road mask each; the image content is shared, as only the load/save cycle matters here
+def generate_frames(img_dir, num_frames, size):
+    img = cv2.cvtColor(synthetic_orthoframe(size, size), cv2.COLOR_RGB2BGR)
+    road = synthetic_road_mask(size, size)
+    ok, jpg = cv2.imencode(".jpg", img)
+    ok, png = cv2.imencode(".png", road)
+    for k in range(num_frames):
+        with open(os.path.join(img_dir, frame_name(k) + ".jpg"), "wb") as f:
+            f.write(jpg.tobytes())
+        with open(os.path.join(img_dir, frame_name(k) + ".mask.png"), "wb") as f:
+            f.write(png.tobytes())
+
+
+# A few brush strokes over the middle of the frame
+def paint_strokes(annotator, k, num_strokes, size):
+    for s in range(num_strokes):
+        y = size * (0.2 + 0.6 * ((k + s) % 10) / 10.0)
+        xs = np.linspace(0.35 * size, 0.65 * size, 30)
+        send_mouse(annotator, "press", float(xs[0]), y)
+        for x in xs[1:]:
+            send_mouse(annotator, "move", float(x), y)
+        send_mouse(annotator, "release", float(xs[-1]), y)
+
+
+# Least squares slope of the samples, per frame
+def growth_per_frame(values):
+    if len(values) < 2:
+        return 0.0
+    return float(np.polyfit(np.arange(len(values)), np.asarray(values, np.float64), 1)[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-session soak test of the load/paint/save cycle")
+    parser.add_argument("--frames", type=int, default=1000, help="number of frames to go through")
+    parser.add_argument("--size", type=int, default=2048, help="square frame size in pixels")
+    parser.add_argument("--strokes", type=int, default=3, help="brush strokes painted per frame")
+    parser.add_argument("--warmup", type=int, default=20, help="frames excluded from the growth analysis")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=256.0,
+                        help="fail if RSS grows by more than this after the warmup")
+    parser.add_argument("--max-rss-slope-kb", type=float, default=64.0,
+                        help="fail if RSS grows faster than this many KB per frame after the warmup")
+    parser.add_argument("--max-object-growth", type=int, default=20000,
+                        help="fail if the Python object count grows by more than this after the warmup")
+    parser.add_argument("--workdir", default=None, help="where to generate the frames (default: temporary)")
+    parser.add_argument("--output", default="-", help="JSON report path (default: stdout)")
+    args = parser.parse_args()
+
+    if args.frames < args.warmup + 2:
+        parser.error("--frames must exceed --warmup by at least 2")
+
+    root = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix="datm_soak_")
+    img_dir = os.path.join(root, "frames")
+    os.makedirs(img_dir, exist_ok=True)
+    print("Generating " + str(args.frames) + " frames in " + img_dir + "...", file=sys.stderr)
+    generate_frames(img_dir, args.frames, args.size)
+
+    app = qt_app()
+
+    # The GUI reads its definitions relative to the repository root
+    os.chdir(REPO_ROOT)
+    import datmant
+
+    gui = datmant.DATMantGUI()
+    gui.app = app
+    gui.config_path = root + os.sep  # Keep the user's configuration out of this
+    gui.show()
+
+    gui.txtImageDir.setText(img_dir)
+    gui.check_paths()
+    gui.get_image_files()
+    gui.connect_image_load_on_list_index_change(True)
+    gui.load_image()
+    app.processEvents()
+
+    rss = []
+    objects = []
+    frame_times = []
+    t_start = time.perf_counter()
+    try:
+        # The last frame is not advanced from, as that brings up a modal message box
+        for k in range(args.frames - 1):
+            t0 = time.perf_counter()
+            paint_strokes(gui.annotator, k, args.strokes, args.size)
+            gui.load_next_image()
+            app.processEvents()
+            frame_times.append(time.perf_counter() - t0)
+
+            gc.collect()
+            rss.append(current_rss_bytes() or 0)
+            objects.append(len(gc.get_objects()))
+
+            if (k + 1) % 50 == 0:
+                print("%d frames, RSS %.1f MB, %d objects" % (k + 1, rss[-1] / MB, objects[-1]), file=sys.stderr)
+
+        # What the layers of the last frame take, as accounted by the GUI (View->Memory usage)
+        layer_bytes = dict(gui.memory_report())
+    finally:
+        gui.close()
+        if args.workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    rss_after = rss[args.warmup:]
+    obj_after = objects[args.warmup:]
+    rss_growth = rss_after[-1] - rss_after[0]
+    rss_slope = growth_per_frame(rss_after)
+    obj_growth = obj_after[-1] - obj_after[0]
+
+    failures = []
+    if rss_growth > args.max_rss_growth_mb * MB:
+        failures.append("RSS grew by %.1f MB after warmup (limit %.1f MB)" % (rss_growth / MB, args.max_rss_growth_mb))
+    if rss_slope > args.max_rss_slope_kb * 1024:
+        failures.append("RSS grows by %.1f KB per frame (limit %.1f KB)" % (rss_slope / 1024, args.max_rss_slope_kb))
+    if obj_growth > args.max_object_growth:
+        failures.append("Python object count grew by %d after warmup (limit %d)" % (obj_growth, args.max_object_growth))
+
+    write_report({"benchmark": "soak_session",
+                  "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "environment": environment_info(),
+                  "parameters": vars(args),
+                  "duration_s": time.perf_counter() - t_start,
+                  "frame_s_mean": float(np.mean(frame_times)),
+                  "rss_bytes": rss,
+                  "python_objects": objects,
+                  "rss_growth_bytes": rss_growth,
+                  "rss_growth_per_frame_bytes": rss_slope,
+                  "object_growth": obj_growth,
+                  "peak_rss_bytes": peak_rss_bytes(),
+                  "layer_bytes": layer_bytes,
+                  "failures": failures,
+                  "passed": not failures}, args.output)
+
+    for f in failures:
+        print("FAIL: " + f, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
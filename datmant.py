@@ -1,28 +1,32 @@
+# Time origin of the startup profile (see --profile-startup)
+import time
+STARTUP_T0 = time.perf_counter()
+
 # Import GUI specific items
 from PyQt5 import QtGui, QtWidgets, QtCore
 from PyQt5.QtWidgets import QGraphicsView
 import sys
 import traceback
 import os
+import csv
 import numpy as np
-import cv2
-from qimage2ndarray import array2qimage
 
-from lib.tkmask import generate_tk_defects_layer
-from lib.annotmask import get_sqround_mask  # New mask generation facility (original mask needed)
+# NB! Heavy modules (OpenCV, the shapefile reader and the lib modules that use them) are
+# imported where they are first needed, so that the main window can be shown as early as possible
+from lib.logsink import BufferedLogSink, LOG_FLUSH_INTERVAL_MS, LOG_MAX_LINES_PER_FLUSH
+from lib.packedmask import PackedMask
+from lib import tracing
 
 # Specific UI features
 from PyQt5.QtWidgets import QSplashScreen, QMessageBox, QGraphicsScene, QFileDialog, QTableWidgetItem
 from PyQt5.QtGui import QPixmap, QImage, QColor, QIcon
 from PyQt5.QtCore import Qt, QRectF, QSize
 
-from ui import datmant_ui, color_specs_ui
+from ui import datmant_ui, color_specs_ui, summary_table_ui
 import configparser
-import time
 import datetime
 import subprocess
-
-import pandas as pd
+import multiprocessing
 
 # Overall constants
 PUBLISHER = "AlphaControlLab"
@@ -34,6 +38,13 @@ BRUSH_DIAMETER_MIN = 40
 BRUSH_DIAMETER_MAX = 100
 BRUSH_DIAMETER_DEFAULT = 40
 
+# Background defect prediction
+PREDICTION_POLL_INTERVAL_MS = 500  # How often finished predictions are picked up
+PREDICTION_LOOKAHEAD = 3  # Images after the current one that are predicted first
+
+# Modules whose import is deferred until after the main window is shown; reported by --profile-startup
+STARTUP_DEFERRED_MODULES = ["cv2", "shapefile", "sqlite3", "pandas", "qimage2ndarray"]
+
 # Colors
 MARK_COLOR_MASK = QColor(255,0,0,99)
 MARK_COLOR_DEFECT_DEFAULT = QColor(0, 0, 255, 99)
@@ -51,6 +62,14 @@ class DATMantGUIColorSpec(QtWidgets.QMainWindow):
         self.ui.setupUi(self)
 
 
+# Summary table window
+class DATMantGUISummaryTable(QtWidgets.QMainWindow):
+    def __init__(self, parent=None):
+        super(DATMantGUISummaryTable, self).__init__(parent)
+        self.ui = summary_table_ui.Ui_SummaryTableUI()
+        self.ui.setupUi(self)
+
+
 # Main UI class with all methods
 class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
     # Applications states in status bar
@@ -71,10 +90,14 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
     # Mask file extension. If it changes in the future, it is easier to swap it here
     MASK_FILE_EXTENSION_PATTERN = ".mask.png"
 
+    # Compact copy of the defect mask (run-length encoding and polygons per class, see lib/maskcodec.py)
+    DEFECT_ANNOTATION_EXTENSION_PATTERN = ".defect.rle.json"
+
     # Config file
     config_path = None  # Path to config file
     config_data = None  # The actual configuration
     CONFIG_NAME = "datmant_config.ini"  # Name of the config file
+    LOG_FILE_NAME = "datmant.log"  # Name of the log file, stored next to the config file
 
     has_image = None
     img_shape = None
@@ -106,18 +129,22 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
 
     # Immutable items
     current_image = None  # Original image
-    current_mask = None  # Original mask
-    current_helper = None  # Helper mask
+    current_mask = None  # Original mask (PackedMask)
+    current_helper = None  # Helper mask (PackedMask)
     current_tk = None  # Defects mareked by TK
 
     # User-updatable items
-    current_defects = None  # Defects mask
-    current_updated_mask = None  # Updated mask
+    current_defects = None  # Defects mask. While marking defects, the annotator holds it (see update_annotator_view)
+    current_updated_mask = None  # Updated mask (PackedMask)
 
     # Image name
     current_img = None
     current_img_as_listed = None
 
+    # Application log: lines are buffered in the sink and moved to the console by a timer
+    log_sink = None
+    log_timer = None
+
     # Internal vars
     initializing = False
     app = None
@@ -130,6 +157,17 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
         super(DATMantGUI, self).__init__(parent)
         self.setupUi(self)
 
+        # Set up the buffered application log before anything gets logged
+        self.log_sink = BufferedLogSink()
+        self.log_timer = QtCore.QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(LOG_FLUSH_INTERVAL_MS)
+
+        # Background defect prediction, started from the Edit menu
+        self.predictor = None
+        self.predictor_timer = QtCore.QTimer(self)
+        self.predictor_timer.timeout.connect(self.update_predictions)
+
         from ui_lib.QtImageAnnotator import QtImageAnnotator
         self.annotator = QtImageAnnotator()
 
@@ -156,6 +194,8 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
 
         # Set up second window
         self.color_ui = DATMantGUIColorSpec(self)
+        self.stats_ui = DATMantGUISummaryTable(self)
+        self.memory_ui = DATMantGUISummaryTable(self)
 
         # Update button states
         self.update_button_states()
@@ -183,12 +223,23 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
         # TODO: TEMP: For buttons, use .clicked.connect(self.*), for menu actions .triggered.connect(self.*),
         # TODO: TEMP: for checkboxes use .stateChanged, and for spinners .valueChanged
         self.actionLog.triggered.connect(self.update_show_log)
+        self.actionLog_to_file.triggered.connect(self.update_log_to_file)
+
+        # Performance tracing (can also be enabled at startup through the DATMANT_TRACE environment variable)
+        self.actionPerformance_tracing.setChecked(tracing.is_enabled())
+        self.actionPerformance_tracing.triggered.connect(self.update_performance_tracing)
+        self.actionExport_performance_trace.triggered.connect(self.export_performance_trace)
+        self.actionRecord_input_session.triggered.connect(self.update_input_recording)
         self.actionColor_definitions.triggered.connect(self.open_color_definition_help)
+        self.actionAnnotation_statistics.triggered.connect(self.open_annotation_statistics)
+        self.actionMemory_usage.triggered.connect(self.open_memory_usage)
         self.actionProcess_original_mask.triggered.connect(self.process_mask)
-        self.actionSave_current_annotations.triggered.connect(self.save_masks)
+        # The checked state is not passed on: save_masks() is wrapped for tracing, which hides its signature from PyQt
+        self.actionSave_current_annotations.triggered.connect(lambda checked=False: self.save_masks())
 
         # Reload AI-generated mask, if present in the directory
         self.actionAIMask.triggered.connect(self.load_AI_mask)
+        self.actionPredict_defects.triggered.connect(self.update_background_prediction)
 
         # Button assignment
         self.annotator.mouseWheelRotated.connect(self.accept_brush_diameter_change)
@@ -249,9 +300,101 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
 
         self.color_ui.show()
 
+    # Per class totals of the saved annotations of the current directory, from its statistics database
+    # (see lib/maskstats.py). Frames annotated before the database existed can be added with
+    # python -m lib.maskstats DIRECTORY
+    def open_annotation_statistics(self):
+        from lib.maskstats import StatsDB
+
+        if not self.dir_has_images:
+            self.log("Cannot show annotation statistics: no images loaded")
+            return
+
+        with StatsDB(self.txtImageDir.text()) as db:
+            frames, pixels, road, defects, regions = db.totals()
+            totals = {code: (nframes, npixels, nregions) for code, nframes, npixels, nregions in db.class_totals()}
+
+        # Known classes first, in the order of the color specifications, then any other values found
+        classes = [(int(col["COLOR_GSCALE_MAPPING"]), col["COLOR_NAME_EN"], col["COLOR_HEXRGB_DATMANT"])
+                   for col in (self.cspec or [])]
+        known = [code for code, name, color in classes]
+        classes += [(code, "Unknown (" + str(code) + ")", None) for code in sorted(totals) if code not in known]
+
+        t = self.stats_ui.ui.tabSummary
+        t.setSortingEnabled(False)
+        t.clear()
+        t.setRowCount(len(classes))
+        t.setColumnCount(5)
+        t.setHorizontalHeaderLabels(["Defect class", "Frames", "Pixels", "Regions", "% of road"])
+        t.setColumnWidth(0, 200)
+
+        for row, (code, name, color) in enumerate(classes):
+            nframes, npixels, nregions = totals.get(code, (0, 0, 0))
+            t.setItem(row, 0, QTableWidgetItem(name))
+            if color is not None:
+                t.item(row, 0).setBackground(QColor(color))
+                t.item(row, 0).setForeground(self.get_best_fg_for_bg(QColor(color)))
+            for col, value in enumerate([nframes, npixels, nregions], 1):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, value)
+                t.setItem(row, col, item)
+            item = QTableWidgetItem()
+            item.setData(Qt.DisplayRole, round(100.0 * npixels / road, 3) if road else 0.0)
+            t.setItem(row, 4, item)
+        t.setSortingEnabled(True)
+
+        self.stats_ui.ui.lblSummary.setText(str(frames) + " of " + str(self.lstImages.count()) +
+                                            " images annotated in " + self.txtImageDir.text() + ": " +
+                                            str(defects) + " defect pixels in " + str(regions) + " regions")
+        self.stats_ui.setWindowTitle("Annotation statistics")
+        self.stats_ui.show()
+
+    # Memory taken by the layers of the current image: those kept here, then those of the annotator.
+    # Returns [(name, bytes)]
+    def memory_report(self):
+        from ui_lib.QtImageAnnotator import pixmap_bytes
+
+        report = [("Image (decoded)", pixmap_bytes(self.current_image)),
+                  ("TK defects layer", pixmap_bytes(self.current_tk))]
+        for name, mask in [("Road mask (original), packed", self.current_mask),
+                           ("Road helper, packed", self.current_helper),
+                           ("Road mask (updated), packed", self.current_updated_mask)]:
+            report.append((name, mask.nbytes if mask is not None else 0))
+
+        # Exported from the annotator when leaving the defect marking mode or saving
+        report.append(("Defect mask", self.current_defects.nbytes if self.current_defects is not None else 0))
+
+        return report + self.annotator.memory_report()
+
+    def open_memory_usage(self):
+        report = self.memory_report()
+
+        t = self.memory_ui.ui.tabSummary
+        t.setSortingEnabled(False)
+        t.clear()
+        t.setRowCount(len(report))
+        t.setColumnCount(3)
+        t.setHorizontalHeaderLabels(["Layer", "Bytes", "MB"])
+        t.setColumnWidth(0, 250)
+
+        for row, (name, nbytes) in enumerate(report):
+            t.setItem(row, 0, QTableWidgetItem(name))
+            for col, value in enumerate([nbytes, round(nbytes / 1048576.0, 2)], 1):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, value)
+                t.setItem(row, col, item)
+        t.setSortingEnabled(True)
+
+        total = sum(nbytes for name, nbytes in report)
+        self.memory_ui.ui.lblSummary.setText("%.1f MB in the layers and undo states of %s" %
+                                             (total / 1048576.0, self.current_img or "no image"))
+        self.memory_ui.setWindowTitle("Memory usage")
+        self.memory_ui.show()
+
     def connect_image_load_on_list_index_change(self, state):
         if state:
-            self.lstImages.currentIndexChanged.connect(self.load_image)
+            # The index is not passed on: load_image() is wrapped for tracing, which hides its signature from PyQt
+            self.lstImages.currentIndexChanged.connect(lambda index: self.load_image())
         else:
             self.lstImages.disconnect()
 
@@ -289,7 +432,7 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
         if self.annotation_mode is self.ANNOTATION_MODE_MARKING_DEFECTS:
             self.current_defects = img_new
         elif self.annotation_mode is self.ANNOTATION_MODE_MARKING_MASK:
-            self.current_updated_mask = 255-img_new
+            self.current_updated_mask = PackedMask(255-img_new)
         self.update_annotator_view()
         self.annotator.setFocus()
 
@@ -303,8 +446,8 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
         the_mask = self.get_updated_mask()
         if self.annotation_mode is self.ANNOTATION_MODE_MARKING_DEFECTS:
             self.current_defects = the_mask
-        else:
-            self.current_updated_mask = the_mask
+        elif the_mask is not None:
+            self.current_updated_mask = PackedMask(the_mask)
 
     # Change annotation mode
     def annotation_mode_switch(self):
@@ -382,30 +525,37 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
 
             return the_new_mask
 
+    @tracing.traced("update_annotator_view")
     def update_annotator_view(self):
 
         # If there is no image, there's nothing to clear
         if self.current_image is None:
             return
 
+        from ui_lib.QtImageAnnotator import bitmask_qimage
+
+        # The binary layers are drawn straight from the packed masks, in the color of their 0 pixels
+        transparent = QColor(0, 0, 0, 0)
+
         if self.annotation_mode is self.ANNOTATION_MODE_MARKING_DEFECTS:
             h, w = self.current_image.rect().height(), self.current_image.rect().width()
 
-            helper = np.zeros((h,w,4), dtype=np.uint8)
-            helper[self.current_helper == 0] = list(HELPER_COLOR.getRgb())
+            helper = bitmask_qimage(self.current_helper.bits, w, [HELPER_COLOR, transparent])
 
             self.annotator.clearAndSetImageAndMask(self.current_image,
                                                    self.current_defects,
-                                                   array2qimage(helper),
-                                                   aux_helper=(array2qimage(self.current_tk) if self.current_tk is not None else None),
+                                                   helper,
+                                                   aux_helper=self.current_tk,
                                                    process_gray2rgb=True,
                                                    direct_mask_paint=True)
+
+            # The annotator paints on its own copy, which is exported again when the mask is needed
+            self.current_defects = None
         else:
 
             # Remember, the mask must be inverted here, but saved properly
             h, w = self.current_image.rect().height(), self.current_image.rect().width()
-            mask = 255 * np.zeros((h, w, 4), dtype=np.uint8)
-            mask[self.current_updated_mask == 0] = list(MARK_COLOR_MASK.getRgb())
+            mask = bitmask_qimage(self.current_updated_mask.bits, w, [MARK_COLOR_MASK, transparent])
 
             self.annotator.clearAndSetImageAndMask(self.current_image,
                                                    mask)
@@ -423,14 +573,16 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
         self.load_image()
 
     # Loads the image
+    @tracing.traced("load_image")
     def load_image(self):
+        import cv2
+        from lib.tkmask import generate_tk_defects_layer
+        from lib.annotmask import get_sqround_mask  # New mask generation facility (original mask needed)
+        from lib.maskcodec import load_annotations
 
         if not self.initializing and self.dir_has_images:
             self.status_bar_message("loading")
 
-            # Process events
-            self.app.processEvents()
-
             # Get the image from the list
             img_name = self.lstImages.currentText()
             img_name_no_ext = img_name.split(".")[0]
@@ -439,21 +591,26 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
             self.current_img = img_name_no_ext
             self.current_img_as_listed = img_name
 
+            # Predictions of the images about to be annotated are made first
+            self.prioritize_predictions()
+
             # Start loading the image
             self.log("Loading image " + img_name_no_ext)
 
             # Load the image
             try:
                 self.log("Drawing defect marks on original image...")
-                self.current_image = QImage(img_path + ".jpg")
+                with tracing.span("jpeg_decode"):
+                    self.current_image = QImage(img_path + ".jpg")
                 img_tk = generate_tk_defects_layer(self.txtImageDir.text(), self.txtShpDir.text(),
                                                     img_name_no_ext, self.tk_colors)
                 self.current_tk = img_tk
             except Exception as e:
                 self.actionLoad_marked_image.setChecked(False)
                 self.log("Could not find or load the shapefile data. Will load only the image.")
-                self.current_image = QImage(img_path + ".jpg")
-                self.curent_tk = None
+                with tracing.span("jpeg_decode"):
+                    self.current_image = QImage(img_path + ".jpg")
+                self.current_tk = None
 
 
             # Shape of the image
@@ -463,8 +620,10 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
 
             # Load the mask and generate the "helper" mask
             try:
-                self.current_mask = cv2.imread(img_path + self.MASK_FILE_EXTENSION_PATTERN, cv2.IMREAD_GRAYSCALE)
-                self.current_helper = get_sqround_mask(self.current_mask)
+                with tracing.span("mask_read"):
+                    mask = cv2.imread(img_path + self.MASK_FILE_EXTENSION_PATTERN, cv2.IMREAD_GRAYSCALE)
+                self.current_helper = PackedMask(get_sqround_mask(mask))
+                self.current_mask = PackedMask(mask)
             except:
                 print("Cannot find the mask file. Please make sure FILENAME.mask.png " +
                       "files exist in the folder for every image")
@@ -476,13 +635,14 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
             self.annotation_mode_default()
 
             # Mask v2 just contains a copy of the default mask
-            img_m = self.current_mask.copy()
+            img_m = mask
 
             # Add some useful information
             at_least_something = False
             if os.path.isfile(img_path + ".cut.mask_v2.png"):
                 # Image has updated defect mask, need to load it instead
-                img_m = cv2.imread(img_path + ".cut.mask_v2.png", cv2.IMREAD_GRAYSCALE)
+                with tracing.span("mask_read"):
+                    img_m = cv2.imread(img_path + ".cut.mask_v2.png", cv2.IMREAD_GRAYSCALE)
                 self.log("Detected updated mask, loading it instead of base mask")
                 self.txtImageHasDefectMask.setText("YES")
                 at_least_something = True
@@ -492,12 +652,25 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
             # No defect marks by default
             img_d = np.zeros(self.img_shape, dtype=np.uint8)
             if os.path.isfile(img_path + ".defect.mask.png"):
-                # We need to open the mask
-                img_d = cv2.imread(img_path + ".defect.mask.png", cv2.IMREAD_GRAYSCALE)
+                # We need to open the mask. The compact copy is much faster to rasterise than the PNG is
+                # to decode, and is used unless the PNG was changed after it was written
+                ann_path = img_path + self.DEFECT_ANNOTATION_EXTENSION_PATTERN
+                img_d = None
+                if os.path.isfile(ann_path) and \
+                        os.path.getmtime(ann_path) >= os.path.getmtime(img_path + ".defect.mask.png"):
+                    try:
+                        with tracing.span("mask_read"):
+                            img_d = load_annotations(ann_path)
+                    except Exception as e:
+                        self.log("Could not read " + ann_path + " (" + str(e) + "), loading the defect mask instead")
+                if img_d is None:
+                    with tracing.span("mask_read"):
+                        img_d = cv2.imread(img_path + ".defect.mask.png", cv2.IMREAD_GRAYSCALE)
                 # And blend in the colors of the overlay
                 self.txtImageStatus.setText("MANUALLY PROCESSED, defect mask found in directory")
             elif os.path.isfile(img_path + ".predicted_defects.png"):
-                img_d = cv2.imread(img_path + ".predicted_defects.png", cv2.IMREAD_GRAYSCALE)
+                with tracing.span("mask_read"):
+                    img_d = cv2.imread(img_path + ".predicted_defects.png", cv2.IMREAD_GRAYSCALE)
                 self.txtImageStatus.setText("AUTO PROCESSED, defect mask found in directory")
             elif at_least_something:
                 self.txtImageStatus.setText("SEEN BEFORE, but there is no defect mask")
@@ -510,9 +683,9 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
             else:
                 self.actionAIMask.setEnabled(False)
 
-            # Now we set up the mutable images. NB! They are not COPIES, but references here
+            # Now we set up the mutable images. NB! The defects are not a COPY, but a reference here
             self.current_defects = img_d
-            self.current_updated_mask = img_m
+            self.current_updated_mask = PackedMask(img_m)
 
             # Once all that is done, we need to update the actual image working area
             self.update_annotator_view()
@@ -524,6 +697,8 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
             self.log("Done loading image")
 
     def load_AI_mask(self):
+        import cv2
+
         # Additional check just in case
         img_name = self.lstImages.currentText()
         img_name_no_ext = img_name.split(".")[0]
@@ -539,6 +714,70 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
             # For now also print it to CMD, maybe remove later
             print("Cannot load the auto-generated image: either file missing eror wrong mode selected.")
 
+    # Start or stop predicting the defects of the images in the working directory
+    def update_background_prediction(self):
+        if self.actionPredict_defects.isChecked():
+            self.start_background_prediction()
+        else:
+            self.stop_background_prediction()
+            self.log("Stopped background defect prediction")
+
+    def start_background_prediction(self):
+        from lib.predictor import PredictionScheduler
+
+        self.stop_background_prediction()
+        if not self.dir_has_images:
+            self.actionPredict_defects.setChecked(False)
+            return
+
+        predictor = self.config_data['MenuOptions']['Predictor']
+        workers = int(self.config_data['MenuOptions']['PredictorWorkers'])
+        # The images about to be annotated are handed to the processes first
+        upcoming = self.upcoming_images()
+        frames = upcoming + [self.lstImages.itemText(i) for i in range(self.lstImages.count())
+                             if self.lstImages.itemText(i) not in upcoming]
+        self.predictor = PredictionScheduler(self.txtImageDir.text().rstrip("\\/"), frames, predictor, workers,
+                                             on_progress=self.log_prediction_progress)
+        self.log("Predicting defects for " + str(self.predictor.total) + " of " + str(len(frames)) +
+                 " images with " + predictor + " in " + str(workers) + " background processes")
+        self.predictor_timer.start(PREDICTION_POLL_INTERVAL_MS)
+
+    def stop_background_prediction(self):
+        self.predictor_timer.stop()
+        if self.predictor is not None:
+            self.predictor.close()
+            self.predictor = None
+
+    # Called from a background thread of the predictor
+    def log_prediction_progress(self, done, total, frame, result):
+        if isinstance(result, Exception):
+            self.log("Could not predict defects for image " + frame + ": " + str(result))
+        else:
+            self.log("Predicted defects for image " + frame + " (" + str(done) + "/" + str(total) + ")")
+
+    # The current image and the next few
+    def upcoming_images(self):
+        cur_index = max(self.lstImages.currentIndex(), 0)
+        last_index = min(cur_index + PREDICTION_LOOKAHEAD + 1, self.lstImages.count())
+        return [self.lstImages.itemText(i) for i in range(cur_index, last_index)]
+
+    # Move the upcoming images to the front of the prediction queue
+    def prioritize_predictions(self):
+        if self.predictor is not None:
+            self.predictor.prioritize(self.upcoming_images())
+
+    # Pick up the finished predictions. The AUTO mask can be loaded once the current image has one
+    def update_predictions(self):
+        if self.predictor is None:
+            return
+        for frame, result in self.predictor.finished():
+            if frame == self.current_img and not isinstance(result, Exception):
+                self.actionAIMask.setEnabled(True)
+                self.log("Predicted defects are available for the current image")
+        if self.predictor.is_done():
+            self.predictor_timer.stop()
+            self.log("Background defect prediction finished, " + str(self.predictor.failed) + " images failed")
+
     def load_prev_image(self):
         total_items = self.lstImages.count()
         if total_items == 0:
@@ -567,31 +806,100 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
         self.save_masks()
         self.lstImages.setCurrentIndex(cur_index + 1)
 
+    @tracing.traced("save_masks")
     def save_masks(self):
+        import cv2
+        from lib.maskcodec import save_annotations
+        from lib.maskstats import compute_mask_stats, StatsDB
 
         # Update the current mask
         self.update_mask_from_current_mode()
 
         save_dir = self.txtImageDir.text()
+        road = self.current_updated_mask.unpack()
         save_path_defects = save_dir + self.current_img + ".defect.mask.png"
         save_path_masks = save_dir + self.current_img + ".cut.mask_v2.png"
 
-        cv2.imwrite(save_path_defects, self.current_defects)
+        with tracing.span("mask_write"):
+            cv2.imwrite(save_path_defects, self.current_defects)
+            save_annotations(save_dir + self.current_img + self.DEFECT_ANNOTATION_EXTENSION_PATTERN,
+                             self.current_defects)
         self.log("Saved defect annotations for image " + self.current_img)
 
-        cv2.imwrite(save_path_masks, self.current_updated_mask)
+        with tracing.span("mask_write"):
+            cv2.imwrite(save_path_masks, road)
         self.log("Saved updated mask for image " + self.current_img)
 
-    # In-GUI console log
+        # Keep the statistics of the directory up to date, so that they never need the masks to be read
+        try:
+            with tracing.span("mask_stats"):
+                stats = compute_mask_stats(self.current_defects, road)
+                with StatsDB(save_dir) as db:
+                    db.upsert_frame(self.current_img, stats)
+        except Exception as e:
+            self.log("Could not update the annotation statistics: " + str(e))
+
+    # In-GUI console log. The line is only buffered here; it reaches the console on the next
+    # log timer tick (see flush_log). This is safe to call from worker threads.
     def log(self, line):
         # Get the time stamp
         ts = datetime.datetime.fromtimestamp(time.time()).strftime('[%Y-%m-%d %H:%M:%S] ')
-        self.txtConsole.moveCursor(QtGui.QTextCursor.End)
-        self.txtConsole.insertPlainText(ts + line + os.linesep)
+        self.log_sink.write(ts + line)
+
+    # Move buffered log lines to the console, at most LOG_MAX_LINES_PER_FLUSH lines per call
+    def flush_log(self, max_lines=LOG_MAX_LINES_PER_FLUSH):
+        lines = self.log_sink.drain(max_lines)
+        if lines:
+            self.txtConsole.moveCursor(QtGui.QTextCursor.End)
+            self.txtConsole.insertPlainText(os.linesep.join(lines) + os.linesep)
+
+    def update_performance_tracing(self):
+        if self.actionPerformance_tracing.isChecked():
+            tracing.enable()
+            self.log("Performance tracing enabled")
+        else:
+            tracing.disable()
+            self.log("Performance tracing disabled")
 
-        # Only do this if app is already referenced in the GUI (TODO: a more elegant solution?)
-        if self.app is not None:
-            self.app.processEvents()
+    # Write the recorded spans as a Chrome trace and a per-operation summary, and log the summary
+    def export_performance_trace(self):
+        if not tracing.events():
+            self.log("No performance trace recorded yet. Enable View->Performance tracing first.")
+            return
+
+        fn, _ = QFileDialog.getSaveFileName(self, "Export performance trace", "datmant_trace.json",
+                                            "Chrome trace files (*.json)")
+        if fn:
+            tracing.export_all(fn)
+            self.log("Exported performance trace to " + fn + " and summary to " + tracing.summary_path_for(fn))
+            for line in tracing.format_summary().split(os.linesep):
+                self.log(line)
+
+    # Start or stop recording the annotator input (for replaying it with bench/replay_session.py)
+    def update_input_recording(self):
+        if self.actionRecord_input_session.isChecked():
+            fn, _ = QFileDialog.getSaveFileName(self, "Record input session", "datmant_session.npz",
+                                                "Input recordings (*.npz)")
+            if not fn:
+                self.actionRecord_input_session.setChecked(False)
+                return
+            self.annotator.startRecording(fn, {"frame": self.current_img, "image_dir": self.txtImageDir.text()})
+            self.log("Recording input session to " + fn)
+        else:
+            recorder = self.annotator.stopRecording()
+            if recorder is not None:
+                self.log("Saved input session with " + str(len(recorder)) + " events to " + recorder.path)
+        self.annotator.setFocus()
+
+    def check_log_to_file(self):
+        if self.actionLog_to_file.isChecked():
+            self.log_sink.set_log_file(self.config_path + self.LOG_FILE_NAME)
+        else:
+            self.log_sink.set_log_file(None)
+
+    def update_log_to_file(self):
+        self.check_log_to_file()
+        self.store_menu_options_to_config()
 
     def check_show_log(self):
         if self.actionLog.isChecked():
@@ -647,6 +955,12 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
             else:
                 self.actionLog.setChecked(False)
 
+            if self.config_data['MenuOptions']['LogToFile'] == '1':
+                self.actionLog_to_file.setChecked(True)
+            else:
+                self.actionLog_to_file.setChecked(False)
+            self.check_log_to_file()
+
             if self.config_data['MenuOptions']['ProcessMask'] == '1':
                 self.actionProcess_original_mask.setChecked(True)
             else:
@@ -677,6 +991,7 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
 
     @staticmethod
     def config_defaults():
+        from lib.predictor import DEFAULT_PREDICTOR, DEFAULT_WORKERS
 
         # Dictionary
         config_defaults = {}
@@ -684,9 +999,12 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
         # The defaults
         config_defaults['MenuOptions'] = \
             {'ShowLog': '0',
+             'LogToFile': '0',
              'ProcessMask': '1',
              'ImageDirectory': '',
-             'ShapefileDirectory': ''}
+             'ShapefileDirectory': '',
+             'Predictor': DEFAULT_PREDICTOR,
+             'PredictorWorkers': str(DEFAULT_WORKERS)}
 
         return config_defaults
 
@@ -748,13 +1066,19 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
             if self.actionLog.isChecked():
                 the_log = '1'
             self.config_data['MenuOptions']['ShowLog'] = the_log
+
+            # Log file
+            the_log_to_file = '0'
+            if self.actionLog_to_file.isChecked():
+                the_log_to_file = '1'
+            self.config_data['MenuOptions']['LogToFile'] = the_log_to_file
             self.config_save()
 
-    # Show different messages in status bar
+    # Show different messages in status bar. Only the status bar is repainted here, so that the
+    # message shows up immediately without processing any pending input events
     def status_bar_message(self, msgid):
         self.statusbar.showMessage(self.APP_STATUS_STATES[msgid])
-        if self.app is not None:
-            self.app.processEvents()
+        self.statusbar.repaint()
 
     # Locate the shapefile directory
     def browse_shp_dir(self):
@@ -802,6 +1126,10 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
 
             self.get_image_files()
 
+            # Predictions are made for the images of the new directory
+            if self.actionPredict_defects.isChecked():
+                self.start_background_prediction()
+
             # Disable the index change event, load image, reenable it
             self.connect_image_load_on_list_index_change(False)
             self.load_image()
@@ -837,14 +1165,25 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
             fg = QColor("#000000")  # Need black
         return fg
 
+    def closeEvent(self, event):
+        # Do not hand any more images to the predictor processes
+        self.stop_background_prediction()
+
+        # Write out whatever is still buffered in the log
+        self.log_timer.stop()
+        self.flush_log(None)
+        self.log_sink.close()
+        super(DATMantGUI, self).closeEvent(event)
+
     def update_button_states(self):  # TODO: Reserved for future use
         return
 
     def read_defect_color_defs(self):  # Read the defect color definitions from the corresponding file
         # Read the file
-        cspec = pd.read_csv(COLOR_DEF_PATH,
-                            delimiter=";", encoding='utf-8')
-        cspec_list = cspec.to_dict('records')
+        with open(COLOR_DEF_PATH, "r", encoding="utf-8-sig", newline="") as f:
+            cspec_list = list(csv.DictReader(f, delimiter=";"))
+        for col in cspec_list:
+            col["COLOR_GSCALE_MAPPING"] = int(col["COLOR_GSCALE_MAPPING"])
 
         # Store the list
         self.cspec = cspec_list
@@ -938,25 +1277,60 @@ class DATMantGUI(QtWidgets.QMainWindow, datmant_ui.Ui_DATMantMainWindow):
                     self.lstDefectsAndColors.setCurrentIndex(8)
 
 
+# Report of --profile-startup: milestones since datmant.py started executing, deferred modules that were
+# nevertheless loaded before the main window was shown, and the traced startup operations
+def print_startup_profile(milestones, loaded_before_window):
+    print("Startup profile (ms since datmant.py started executing):")
+    for name, t in milestones:
+        print("  %-30s %8.1f" % (name, (t - STARTUP_T0) * 1000))
+    print("Deferred modules loaded before the main window was shown: " + (", ".join(loaded_before_window) or "none"))
+    print(tracing.format_summary())
+    print("Per-module import times: python -X importtime datmant.py --profile-startup")
+
+
 def main():
+    # Performance tracing requested through the environment
+    tracing.enable_from_env()
+
+    # Startup profiling: the startup is traced and reported once the first image is loaded, then the app exits
+    profile_startup = "--profile-startup" in sys.argv
+    if profile_startup:
+        sys.argv.remove("--profile-startup")
+        tracing.enable()
+    milestones = [("imports done", time.perf_counter())]
+
     # Prepare and launch the GUI
-    app = QtWidgets.QApplication(sys.argv)
-    app.setWindowIcon(QtGui.QIcon('res/A.ico'))
-    dialog = DATMantGUI()
-    dialog.setWindowTitle(APP_TITLE + " - " + APP_VERSION) # Window title
-    dialog.app = app  # Store the reference
-    dialog.show()
+    with tracing.span("startup_main_window"):
+        app = QtWidgets.QApplication(sys.argv)
+        app.setWindowIcon(QtGui.QIcon('res/A.ico'))
+        dialog = DATMantGUI()
+        dialog.setWindowTitle(APP_TITLE + " - " + APP_VERSION) # Window title
+        dialog.app = app  # Store the reference
+        dialog.show()
+
+        # Paint the window before the config and the first image are loaded
+        app.processEvents()
+    milestones.append(("main window shown", time.perf_counter()))
+    loaded_before_window = [m for m in STARTUP_DEFERRED_MODULES if m in sys.modules]
 
     # Now we have to load the app configuration file
-    dialog.config_load()
+    with tracing.span("startup_config_load"):
+        dialog.config_load()
 
     # After loading the config file, we need to set up relevant UI elements
-    dialog.UI_config()
-    dialog.app.processEvents()
+    with tracing.span("startup_ui_config"):
+        dialog.UI_config()
+        dialog.app.processEvents()
+    milestones.append(("first image loaded", time.perf_counter()))
 
     # Now we also save the config file
     dialog.config_save()
 
+    if profile_startup:
+        print_startup_profile(milestones, loaded_before_window)
+        dialog.close()
+        return
+
     # And proceed with execution
     app.exec_()
 
@@ -965,4 +1339,6 @@ def main():
 if __name__ == '__main__':
     # Set the exception hook
     sys.excepthook = traceback.print_exception
+    # Needed by the predictor process pool in the frozen executable
+    multiprocessing.freeze_support()
     main()
@@ -1,9 +1,11 @@
 import cv2
 import numpy as np
+from lib.tracing import traced
 
 MID_POINT = (2048, 2048)
 
 # Expected shape: (h,w,1)
+@traced("get_sqround_mask")
 def get_sqround_mask(mask):
 
     ### mask generation part
@@ -0,0 +1,96 @@
+import collections
+import threading
+import logging
+import logging.handlers
+
+# How often the GUI should drain the sink and how many lines it may append per drain.
+# Together these bound the cost of logging for the GUI thread irrespective of the log rate.
+LOG_FLUSH_INTERVAL_MS = 250
+LOG_MAX_LINES_PER_FLUSH = 200
+
+# Lines kept in memory while waiting to be drained. Older lines are dropped if the GUI cannot keep up
+LOG_MAX_BUFFERED_LINES = 10000
+
+# Rotating log file parameters
+LOG_FILE_MAX_BYTES = 2 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 3
+
+
+# Buffered, thread-safe log sink. Producers (GUI code or worker threads) only append lines to an
+# in-memory buffer, so logging never blocks on widgets or disk and never touches the event loop.
+# The consumer (a GUI timer) drains the buffer at a bounded rate and forwards the lines to the
+# widget; the same lines are optionally written to a rotating log file.
+class BufferedLogSink:
+
+    def __init__(self, max_buffered=LOG_MAX_BUFFERED_LINES):
+        self._lines = collections.deque()
+        self._max_buffered = max_buffered
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+        # File output is optional and is set up with set_log_file()
+        self._file_logger = None
+        self._file_handler = None
+
+    # Append a line to the buffer. Safe to call from any thread
+    def write(self, line):
+        with self._lock:
+            if len(self._lines) >= self._max_buffered:
+                self._lines.popleft()
+                self._dropped += 1
+            self._lines.append(line)
+
+    # Take up to max_lines lines out of the buffer (all of them if max_lines is None).
+    # Drained lines are also written to the log file, if one is configured.
+    def drain(self, max_lines=None):
+        with self._lock:
+            n = len(self._lines) if max_lines is None else min(max_lines, len(self._lines))
+            lines = [self._lines.popleft() for _ in range(n)]
+            dropped = self._dropped
+            self._dropped = 0
+
+        if dropped > 0:
+            lines.insert(0, "[... " + str(dropped) + " log lines dropped ...]")
+
+        if self._file_logger is not None:
+            for line in lines:
+                self._file_logger.info(line)
+
+        return lines
+
+    def pending(self):
+        with self._lock:
+            return len(self._lines)
+
+    # Enable (path is given) or disable (path is None) the rotating log file
+    def set_log_file(self, path, max_bytes=LOG_FILE_MAX_BYTES, backup_count=LOG_FILE_BACKUP_COUNT):
+        self._close_log_file()
+
+        if path is None:
+            return
+
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes,
+                                                       backupCount=backup_count, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+
+        # Dedicated logger, so that the application log does not leak into the root logger
+        logger = logging.getLogger("datmant.log." + str(id(self)))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+
+        self._file_handler = handler
+        self._file_logger = logger
+
+    def _close_log_file(self):
+        if self._file_handler is not None:
+            self._file_logger.removeHandler(self._file_handler)
+            self._file_handler.close()
+        self._file_handler = None
+        self._file_logger = None
+
+    # Drain whatever is left and close the log file
+    def close(self):
+        lines = self.drain()
+        self._close_log_file()
+        return lines
@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+
+import cv2
+import numpy as np
+from lib.tracing import traced
+
+# Compact export of grayscale defect masks: for every class (grayscale value) present in the mask, its
+# pixels are stored as COCO-style run-length encoding and as simplified outer polygons. The RLE is exact
+# and is what the masks are rasterised back from; the polygons are for downstream tools that want the
+# shapes (e.g. COCO "segmentation" entries) and are approximate.
+#
+# RLE follows the COCO convention: runs over the mask flattened in column-major order, alternating
+# background and class pixels and starting with background, {"size": [h, w], "counts": ...}. Counts are
+# stored in the compressed string form of the COCO API (pycocotools.mask can decode them), and a plain
+# list of run lengths is accepted as well.
+
+ANNOTATION_FORMAT_VERSION = 1
+POLYGON_EPSILON = 1.0  # Max deviation of the simplified polygons from the region outlines, in pixels
+
+
+# Runs of equal values of a uint8 mask in column-major order: (starts, lengths, values)
+def _runs(mask):
+    flat = cv2.transpose(mask).ravel()
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    starts = np.concatenate([[0], change])
+    lengths = np.diff(np.concatenate([starts, [flat.size]]))
+    return starts, lengths, flat[starts]
+
+
+# RLE counts of the runs of one class: gaps before each run followed by the run, and the tail
+def _class_counts(starts, lengths, total):
+    ends = starts + lengths
+    gaps = starts - np.concatenate([[0], ends[:-1]])
+    counts = np.empty(2 * len(starts), np.int64)
+    counts[0::2] = gaps
+    counts[1::2] = lengths
+    if len(ends) == 0 or ends[-1] < total:
+        counts = np.concatenate([counts, [total - (ends[-1] if len(ends) else 0)]])
+    return counts
+
+
+# COCO compressed counts: each count from the third on is stored as the difference to the count two
+# places before it, in 5-bit groups (low first) with a continuation bit, as characters from "0"
+def _counts_to_string(counts):
+    counts = np.asarray(counts, np.int64)
+    x = counts.copy()
+    x[3:] = counts[3:] - counts[1:-2]
+    chars = []
+    active = np.ones(len(x), bool)
+    while active.any():
+        c = x & 0x1f
+        x = x >> 5
+        more = np.where(c & 0x10, x != -1, x != 0) & active
+        chars.append(np.where(active, c + 48 + more * 0x20, 0))
+        active = more
+    chars = np.stack(chars, axis=1).ravel() if chars else np.zeros(0, np.int64)
+    return chars[chars != 0].astype(np.uint8).tobytes().decode("ascii")
+
+
+def _counts_from_string(s):
+    c = np.frombuffer(s.encode("ascii"), np.uint8).astype(np.int64) - 48
+    if len(c) == 0:
+        return np.zeros(0, np.int64)
+    last = (c & 0x20) == 0
+    first = np.concatenate([[True], last[:-1]])
+    value = np.cumsum(first) - 1
+    group = np.arange(len(c)) - np.flatnonzero(first)[value]
+    x = np.zeros(int(value[-1]) + 1, np.int64)
+    np.add.at(x, value, (c & 0x1f) << (5 * group))
+    # Negative differences are sign-extended from the last group
+    neg = (c[last] & 0x10) != 0
+    x[neg] -= np.left_shift(1, 5 * (group[last][neg] + 1))
+    counts = x.copy()
+    counts[1::2] = np.cumsum(x[1::2])
+    counts[2::2] = np.cumsum(x[2::2])
+    return counts
+
+
+def _rle_counts(rle):
+    if isinstance(rle["counts"], str):
+        return _counts_from_string(rle["counts"])
+    return np.asarray(rle["counts"], np.int64)
+
+
+# COCO-style RLE of a binary mask (nonzero pixels)
+def encode_rle(mask):
+    h, w = mask.shape
+    starts, lengths, values = _runs((mask != 0).view(np.uint8))
+    fg = values != 0
+    return {"size": [h, w], "counts": _counts_to_string(_class_counts(starts[fg], lengths[fg], h * w))}
+
+
+# Binary mask from its RLE, with value for the pixels of the mask
+def decode_rle(rle, value=1):
+    return decode_annotations({"size": rle["size"], "classes": [{"code": value, "rle": rle}]})
+
+
+# Simplified outer polygons of a binary mask as COCO-style flat [x0, y0, x1, y1, ...] lists.
+# offset is added to the coordinates, for masks cut from a larger image
+def mask_polygons(mask, epsilon=POLYGON_EPSILON, offset=(0, 0)):
+    contours = cv2.findContours((mask != 0).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                offset=offset)[-2]
+    polys = []
+    for c in contours:
+        p = cv2.approxPolyDP(c, epsilon, True)
+        if len(p) >= 3:
+            polys.append(p.reshape(-1).tolist())
+    return polys
+
+
+# Bounding box (x0, y0, x1, y1), inclusive, of runs in column-major order in an image of height h
+def _runs_bbox(starts, lengths, h):
+    ends = starts + lengths - 1
+    col0, col1 = starts // h, ends // h
+    wraps = col1 > col0
+    y0 = np.where(wraps, 0, starts % h).min()
+    y1 = np.where(wraps, h - 1, ends % h).max()
+    return int(col0.min()), int(y0), int(col1.max()), int(y1)
+
+
+# Annotation record of a grayscale defect mask: size and, for each class value present,
+# its RLE, pixel count and polygons. All classes are run-length encoded in one pass over the mask,
+# and the polygons of a class are traced only within its bounding box
+@traced("encode_annotations")
+def encode_annotations(mask, polygons=True):
+    h, w = mask.shape
+    starts, lengths, values = _runs(mask)
+    classes = []
+    for code in np.unique(values):
+        if code == 0:
+            continue
+        sel = values == code
+        counts = _class_counts(starts[sel], lengths[sel], h * w)
+        entry = {"code": int(code), "area": int(lengths[sel].sum()),
+                 "rle": {"size": [h, w], "counts": _counts_to_string(counts)}}
+        if polygons:
+            x0, y0, x1, y1 = _runs_bbox(starts[sel], lengths[sel], h)
+            entry["bbox"] = [x0, y0, x1 - x0 + 1, y1 - y0 + 1]
+            entry["polygons"] = mask_polygons(mask[y0:y1 + 1, x0:x1 + 1] == code, offset=(x0, y0))
+        classes.append(entry)
+    return {"version": ANNOTATION_FORMAT_VERSION, "size": [h, w], "classes": classes}
+
+
+# Grayscale defect mask rasterised back from encode_annotations() output. The runs of all classes
+# are merged and expanded at once
+@traced("decode_annotations")
+def decode_annotations(ann):
+    h, w = ann["size"]
+    starts, lengths, codes = [np.zeros(0, np.int64)], [np.zeros(0, np.int64)], [np.zeros(0, np.int64)]
+    for entry in ann["classes"]:
+        counts = _rle_counts(entry["rle"])
+        n = len(counts) // 2
+        starts.append(np.cumsum(counts)[0:2 * n:2])
+        lengths.append(counts[1:2 * n:2])
+        codes.append(np.full(n, entry["code"], np.int64))
+    starts, lengths, codes = np.concatenate(starts), np.concatenate(lengths), np.concatenate(codes)
+    order = np.argsort(starts, kind="mergesort")
+    starts, lengths, codes = starts[order], lengths[order], codes[order]
+
+    # Background before each run, the run, and the background after the last one
+    ends = starts + lengths
+    seq = np.empty(2 * len(starts) + 1, np.int64)
+    seq[0:-1:2] = starts - np.concatenate([[0], ends[:-1]])
+    seq[1::2] = lengths
+    seq[-1] = h * w - (ends[-1] if len(ends) else 0)
+    vals = np.zeros(len(seq), np.uint8)
+    vals[1::2] = codes
+
+    return cv2.transpose(np.repeat(vals, seq).reshape(w, h))
+
+
+# Written under a temporary name first: the GUI prefers the annotation file over a defect mask that is
+# older, so an interrupted write must not leave a truncated one behind
+def save_annotations(path, mask, polygons=True):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(encode_annotations(mask, polygons), f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def load_annotations(path):
+    with open(path, "r") as f:
+        return decode_annotations(json.load(f))
+
+
+# Export the annotation files of the defect masks in a folder that do not have an up to date one:
+# python -m lib.maskcodec FOLDER [MASK_EXTENSION ANNOTATION_EXTENSION]
+if __name__ == "__main__":
+    folder = sys.argv[1]
+    mask_ext, ann_ext = sys.argv[2:4] if len(sys.argv) > 3 else (".defect.mask.png", ".defect.rle.json")
+    for f in sorted(os.listdir(folder)):
+        if not f.endswith(mask_ext):
+            continue
+        src = folder + os.sep + f
+        dst = folder + os.sep + f[:-len(mask_ext)] + ann_ext
+        if os.path.isfile(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+            continue
+        save_annotations(dst, cv2.imread(src, cv2.IMREAD_GRAYSCALE))
+        print(f + " -> " + os.path.basename(dst) + " (" + str(os.path.getsize(dst)) + " of "
+              + str(os.path.getsize(src)) + " bytes)")
@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+import sqlite3
+
+import cv2
+import numpy as np
+from lib.tracing import traced
+
+# Per-frame statistics of the defect masks of an image directory, kept in a small SQLite database in
+# that directory and updated every time the masks of a frame are saved. Dataset-level questions (how
+# many pixels or regions of a class, in which frames) are then answered without reading any masks.
+#
+# Regions are the 8-connected components of the defect pixels of all classes together. A class is
+# counted in every region it has pixels in.
+
+STATS_DB_NAME = "datmant_stats.sqlite"
+
+_SCHEMA = ["CREATE TABLE IF NOT EXISTS frames (frame TEXT PRIMARY KEY, width INTEGER, height INTEGER, "
+           "road_pixels INTEGER, defect_pixels INTEGER, regions INTEGER, updated REAL)",
+           "CREATE TABLE IF NOT EXISTS classes (frame TEXT, code INTEGER, pixels INTEGER, regions INTEGER, "
+           "x INTEGER, y INTEGER, w INTEGER, h INTEGER, PRIMARY KEY (frame, code))",
+           "CREATE INDEX IF NOT EXISTS classes_code ON classes (code)"]
+
+
+# Statistics of a grayscale defect mask (and optionally the road mask) from one connected components pass
+# over the defect pixels and bincounts over the defect pixels only, which are few in a typical mask.
+# Returns {"width", "height", "road_pixels", "defect_pixels", "regions",
+#          "classes": {code: {"pixels", "regions", "bbox": (x, y, w, h)}}}
+@traced("compute_mask_stats")
+def compute_mask_stats(defects, road=None):
+    h, w = defects.shape
+    n, labels = cv2.connectedComponents((defects != 0).astype(np.uint8), connectivity=8)
+
+    idx = np.flatnonzero(defects)
+    codes = defects.ravel()[idx]
+    hist = np.bincount(codes, minlength=256)
+    # Regions of every class, from the distinct (region << 8 | class) pairs that occur. Noisy masks can have
+    # tens of thousands of regions, so no region x class table is made
+    pairs = np.unique((labels.ravel()[idx].astype(np.int64) << 8) | codes)
+    class_regions = np.bincount(pairs & 0xff, minlength=256)
+
+    classes = {}
+    for code in np.flatnonzero(hist):
+        at = idx[codes == code]
+        ys, xs = at // w, at % w
+        x0, y0 = int(xs.min()), int(ys.min())
+        classes[int(code)] = {"pixels": int(hist[code]), "regions": int(class_regions[code]),
+                              "bbox": (x0, y0, int(xs.max()) - x0 + 1, int(ys.max()) - y0 + 1)}
+
+    return {"width": w, "height": h,
+            "road_pixels": int(cv2.countNonZero(road)) if road is not None else None,
+            "defect_pixels": len(idx), "regions": n - 1, "classes": classes}
+
+
+# Statistics database of an image directory. Can be used as a context manager, which commits on exit
+class StatsDB:
+
+    def __init__(self, folder, name=STATS_DB_NAME):
+        self.path = os.path.join(folder, name)
+        self.conn = sqlite3.connect(self.path)
+        for stmt in _SCHEMA:
+            self.conn.execute(stmt)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.conn.commit()
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    # Insert or replace the statistics of a frame (as returned by compute_mask_stats)
+    def upsert_frame(self, frame, stats):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (frame, stats["width"], stats["height"], stats["road_pixels"],
+                               stats["defect_pixels"], stats["regions"], time.time()))
+            self.conn.execute("DELETE FROM classes WHERE frame = ?", (frame,))
+            self.conn.executemany("INSERT INTO classes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                  [(frame, code, c["pixels"], c["regions"]) + tuple(c["bbox"])
+                                   for code, c in stats["classes"].items()])
+
+    def remove_frame(self, frame):
+        with self.conn:
+            self.conn.execute("DELETE FROM frames WHERE frame = ?", (frame,))
+            self.conn.execute("DELETE FROM classes WHERE frame = ?", (frame,))
+
+    def frames(self):
+        return [r[0] for r in self.conn.execute("SELECT frame FROM frames ORDER BY frame")]
+
+    # Statistics of one frame in the format of compute_mask_stats(), or None if it is not in the database
+    def frame_stats(self, frame):
+        row = self.conn.execute("SELECT width, height, road_pixels, defect_pixels, regions FROM frames "
+                                "WHERE frame = ?", (frame,)).fetchone()
+        if row is None:
+            return None
+        classes = {code: {"pixels": p, "regions": r, "bbox": (x, y, w, h)} for code, p, r, x, y, w, h in
+                   self.conn.execute("SELECT code, pixels, regions, x, y, w, h FROM classes WHERE frame = ?",
+                                     (frame,))}
+        return dict(zip(["width", "height", "road_pixels", "defect_pixels", "regions"], row), classes=classes)
+
+    # Totals per class over all frames: [(code, frames, pixels, regions)]
+    def class_totals(self):
+        return self.conn.execute("SELECT code, COUNT(*), SUM(pixels), SUM(regions) FROM classes "
+                                 "GROUP BY code ORDER BY code").fetchall()
+
+    # Totals over all frames: (frames, pixels, road pixels, defect pixels, regions)
+    def totals(self):
+        return self.conn.execute("SELECT COUNT(*), COALESCE(SUM(width * height), 0), COALESCE(SUM(road_pixels), 0), "
+                                 "COALESCE(SUM(defect_pixels), 0), COALESCE(SUM(regions), 0) "
+                                 "FROM frames").fetchone()
+
+    # Frames having at least min_pixels of a class: [(frame, pixels, regions)], largest first
+    def frames_with_class(self, code, min_pixels=1):
+        return self.conn.execute("SELECT frame, pixels, regions FROM classes WHERE code = ? AND pixels >= ? "
+                                 "ORDER BY pixels DESC", (code, min_pixels)).fetchall()
+
+
+# Add the frames of a directory whose statistics are missing or older than their defect masks,
+# by reading the masks once. Returns the number of frames added
+def index_folder(folder, defect_ext=".defect.mask.png", road_ext=".cut.mask_v2.png"):
+    added = 0
+    with StatsDB(folder) as db:
+        updated = dict(db.conn.execute("SELECT frame, updated FROM frames"))
+        for f in sorted(os.listdir(folder)):
+            if not f.endswith(defect_ext):
+                continue
+            frame = f[:-len(defect_ext)]
+            path = os.path.join(folder, f)
+            if frame in updated and updated[frame] >= os.path.getmtime(path):
+                continue
+            road_path = os.path.join(folder, frame + road_ext)
+            road = cv2.imread(road_path, cv2.IMREAD_GRAYSCALE) if os.path.isfile(road_path) else None
+            db.upsert_frame(frame, compute_mask_stats(cv2.imread(path, cv2.IMREAD_GRAYSCALE), road))
+            added += 1
+    return added
+
+
+# Index the given directories as needed and print the class totals of each:
+# python -m lib.maskstats FOLDER [FOLDER ...]
+if __name__ == "__main__":
+    for folder in sys.argv[1:]:
+        added = index_folder(folder)
+        with StatsDB(folder) as db:
+            frames, pixels, road, defects, regions = db.totals()
+            print(folder + ": " + str(frames) + " frames (" + str(added) + " indexed now), "
+                  + str(defects) + " defect pixels in " + str(regions) + " regions")
+            for code, nframes, npixels, nregions in db.class_totals():
+                print("  class %3d: %d frames, %d pixels, %d regions" % (code, nframes, npixels, nregions))
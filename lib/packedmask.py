@@ -0,0 +1,34 @@
+import numpy as np
+
+# Binary masks kept with one bit per pixel, 8 times smaller than as uint8 arrays. Used for the road
+# masks of the current frame, which are only read when the view is rebuilt or the masks are saved.
+#
+# The bits are packed most significant bit first (as np.packbits does) in rows padded to 32 bits. This
+# is the layout of QImage.Format_Mono, so a packed mask can be drawn as it is (see bitmask_qimage in
+# ui_lib/QtImageAnnotator.py).
+
+
+class PackedMask:
+
+    # Packs the nonzero pixels of a (h, w) array
+    def __init__(self, mask):
+        h, w = mask.shape
+        self.shape = (h, w)
+        packed = np.packbits(mask != 0, axis=1)
+        bytes_per_line = -(-w // 32) * 4
+        if packed.shape[1] == bytes_per_line:
+            self.bits = packed
+        else:
+            self.bits = np.zeros((h, bytes_per_line), np.uint8)
+            self.bits[:, :packed.shape[1]] = packed
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    # The mask as a (h, w) uint8 array with value for the set pixels and 0 elsewhere
+    def unpack(self, value=255):
+        mask = np.unpackbits(self.bits, axis=1)[:, :self.shape[1]]
+        if value != 1:
+            mask *= np.uint8(value)
+        return np.ascontiguousarray(mask)
@@ -0,0 +1,217 @@
+import os
+import sys
+import time
+import heapq
+import argparse
+import importlib
+import itertools
+import threading
+import collections
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+# Background prediction of defect masks (FILENAME.predicted_defects.png) for the orthoframes of a directory.
+#
+# A predictor is any Python callable that takes an orthoframe as an (h, w, 3) RGB uint8 array and returns
+# an (h, w) uint8 class mask with the grayscale values of defs/color_defs.csv (0 where there is no defect).
+# It is named as "module:callable" so that the worker processes can import it; if the name refers to a
+# class, it is instantiated once per worker process, which is where a model would be loaded.
+#
+# PredictionScheduler runs the predictor over the frames in a process pool. Only a few frames per worker
+# are handed to the pool at a time, the rest wait in a priority queue, so that frames about to be opened
+# in the annotator can be moved to the front at any time (see prioritize()).
+
+PREDICTION_EXTENSION = ".predicted_defects.png"
+IMAGE_EXTENSION = ".jpg"
+DEFAULT_PREDICTOR = "lib.predictor:dummy_predictor"
+DEFAULT_WORKERS = 2
+IN_FLIGHT_PER_WORKER = 2  # Frames handed to the pool ahead of time, per worker
+
+# Dummy predictor parameters: thin dark structures are marked as "undefined" defects
+DUMMY_CLASS = 255
+DUMMY_KERNEL = 15
+DUMMY_THRESHOLD = 40
+
+# Predictors of this (worker) process by name, loaded on first use
+_predictors = {}
+
+
+def load_predictor(spec):
+    if spec not in _predictors:
+        module, _, name = spec.partition(":")
+        obj = getattr(importlib.import_module(module), name)
+        _predictors[spec] = obj() if isinstance(obj, type) else obj
+    return _predictors[spec]
+
+
+# Predict the defects of one frame and write them out. Runs in the worker processes
+def predict_frame(spec, image_path, out_path):
+    t0 = time.perf_counter()
+    img = cv2.imread(image_path)
+    if img is None:
+        raise IOError("Cannot read " + image_path)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    mask = np.asarray(load_predictor(spec)(img))
+    if mask.shape != img.shape[:2]:
+        raise ValueError("Predictor " + spec + " returned a mask of shape " + str(mask.shape) +
+                         " for an image of shape " + str(img.shape[:2]))
+
+    # The GUI may look for the file at any time, so it only appears once complete
+    tmp_path = out_path[:-len(".png")] + ".tmp.png"
+    if not cv2.imwrite(tmp_path, mask.astype(np.uint8)):
+        raise IOError("Cannot write " + tmp_path)
+    os.replace(tmp_path, out_path)
+    return time.perf_counter() - t0
+
+
+# Marks thin dark structures (cracks, joints) found with a black-hat filter. Only meant for testing
+def dummy_predictor(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (DUMMY_KERNEL, DUMMY_KERNEL))
+    hat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, kernel)
+    mask = ((hat > DUMMY_THRESHOLD) & (gray > 0)).astype(np.uint8) * np.uint8(DUMMY_CLASS)
+    return cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+
+
+# Runs a predictor over frames (names without extension) of a folder in a pool of worker processes.
+# Frames with a prediction newer than the image are skipped unless overwrite is set.
+# on_progress(done, total, frame, seconds or exception) is called from a background thread after each frame
+class PredictionScheduler:
+
+    def __init__(self, folder, frames, predictor=DEFAULT_PREDICTOR, workers=DEFAULT_WORKERS, overwrite=False,
+                 on_progress=None):
+        self.folder = folder
+        self.predictor = predictor
+        self.on_progress = on_progress
+        self.max_in_flight = max(1, workers) * IN_FLIGHT_PER_WORKER
+
+        self._lock = threading.RLock()
+        self._heap = []
+        self._queued = {}  # Frame -> its current key in the heap; other heap entries of the frame are stale
+        self._in_flight = set()
+        self._boost = 0
+        self._seq = itertools.count()
+        self._finished = collections.deque()
+        self._all_done = threading.Event()
+        self._closed = False
+
+        todo = [f for f in frames if overwrite or not self.is_current(f)]
+        self.total = len(todo)
+        self.done = 0
+        self.failed = 0
+        if not todo:
+            self._all_done.set()
+
+        self._executor = ProcessPoolExecutor(max(1, workers))
+        with self._lock:
+            for i, frame in enumerate(todo):
+                self._push(frame, (0, i))
+            self._fill()
+
+    def image_path(self, frame):
+        return self.folder + os.sep + frame + IMAGE_EXTENSION
+
+    def prediction_path(self, frame):
+        return self.folder + os.sep + frame + PREDICTION_EXTENSION
+
+    # Whether the frame has a prediction newer than the image
+    def is_current(self, frame):
+        out = self.prediction_path(frame)
+        return os.path.isfile(out) and os.path.getmtime(out) >= os.path.getmtime(self.image_path(frame))
+
+    def _push(self, frame, priority):
+        key = priority + (next(self._seq),)
+        self._queued[frame] = key
+        heapq.heappush(self._heap, (key, frame))
+
+    # Hand frames to the pool until max_in_flight are there
+    def _fill(self):
+        while not self._closed and self._heap and len(self._in_flight) < self.max_in_flight:
+            key, frame = heapq.heappop(self._heap)
+            if self._queued.get(frame) != key:
+                continue
+            del self._queued[frame]
+            self._in_flight.add(frame)
+            future = self._executor.submit(predict_frame, self.predictor, self.image_path(frame),
+                                           self.prediction_path(frame))
+            future.add_done_callback(partial(self._frame_done, frame))
+
+    def _frame_done(self, frame, future):
+        with self._lock:
+            self._in_flight.discard(frame)
+            if future.cancelled():
+                return
+            error = future.exception()
+            result = error if error is not None else future.result()
+            self.done += 1
+            if error is not None:
+                self.failed += 1
+            self._finished.append((frame, result))
+            if self.done == self.total:
+                self._all_done.set()
+            self._fill()
+        if self.on_progress is not None:
+            self.on_progress(self.done, self.total, frame, result)
+
+    # Move the frames to the front of the queue, the first one first. Frames that are already being
+    # predicted or done are not affected. A later call takes precedence over the earlier ones
+    def prioritize(self, frames):
+        with self._lock:
+            self._boost -= 1
+            for i, frame in enumerate(frames):
+                if frame in self._queued:
+                    self._push(frame, (self._boost, i))
+            self._fill()
+
+    # Frames finished since the last call: [(frame, seconds or exception)]
+    def finished(self):
+        out = []
+        while self._finished:
+            out.append(self._finished.popleft())
+        return out
+
+    def is_done(self):
+        return self._all_done.is_set()
+
+    def wait(self, timeout=None):
+        return self._all_done.wait(timeout)
+
+    # Stop handing out frames. The few frames already in the pool are finished in the background
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._heap = []
+            self._queued = {}
+        self._executor.shutdown(wait=False)
+
+
+# Predict the defects of all orthoframes in a directory:
+# python -m lib.predictor DIRECTORY [--predictor module:callable] [--workers N] [--overwrite]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict " + PREDICTION_EXTENSION + " files for the "
+                                                 "orthoframes of a directory")
+    parser.add_argument("directory")
+    parser.add_argument("--predictor", default=DEFAULT_PREDICTOR,
+                        help="module:callable taking an RGB image and returning a class mask (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="number of worker processes")
+    parser.add_argument("--overwrite", action="store_true", help="also predict frames that have a prediction")
+    args = parser.parse_args()
+
+    def report(done, total, frame, result):
+        status = ("%.2f s" % result) if not isinstance(result, Exception) else ("FAILED: " + str(result))
+        print("[%d/%d] %s: %s" % (done, total, frame, status), flush=True)
+
+    frames = sorted(f[:-len(IMAGE_EXTENSION)] for f in os.listdir(args.directory) if f.endswith(IMAGE_EXTENSION))
+    scheduler = PredictionScheduler(args.directory.rstrip("\\/"), frames, args.predictor, args.workers,
+                                    args.overwrite, report)
+    print(str(len(frames) - scheduler.total) + " of " + str(len(frames)) + " frames have a prediction, "
+          + str(scheduler.total) + " to predict with " + args.predictor)
+    try:
+        scheduler.wait()
+    finally:
+        scheduler.close()
+    sys.exit(1 if scheduler.failed else 0)
@@ -2,7 +2,8 @@ import cv2
 import numpy as np
 import shapefile
 import os
-from PyQt5.QtGui import QColor
+from PyQt5.QtGui import QColor, QImage
+from lib.tracing import traced
 
 SHAPETYPES = ['KPIKIPR', 'KVUUK', 'PAIK_J', 'POIKPR', 'SERV', 'VORK', 'PAIK', 'MUREN', 'AUK']
 
@@ -58,7 +59,9 @@ def filimage(path, shpath, fname):
 
     return img2
 
-# Produces tehnokeskuse defect mask as the helper layer
+# Produces tehnokeskuse defect mask as the helper layer: an Indexed8 QImage (one byte per pixel) where
+# index 0 is transparent and index i + 1 has the color of SHAPETYPES[i]
+@traced("generate_tk_defects_layer")
 def generate_tk_defects_layer(path, shpath, fname, colordefs):
 
     # The shape file is assumed to be one directory up than the orthophotos
@@ -69,7 +72,7 @@ def generate_tk_defects_layer(path, shpath, fname, colordefs):
 
     # Need to generate an empty transparent image
     h, w = mask.shape[:2]
-    img = np.zeros((h,w,4), 'uint8')
+    img = np.zeros((h,w), 'uint8')
 
     # read the vrt parameters
     koord = runvrt(path + fname + '.vrt')
@@ -81,27 +84,32 @@ def generate_tk_defects_layer(path, shpath, fname, colordefs):
 
     pnts, tyyp = getdefects(shpath, xmin, xmax, ymin, ymax, koord)
 
+    colors = [0] * (len(SHAPETYPES) + 1)
     for i in range(0, len(tyyp)):
 
         pp = np.asarray(pnts[i], dtype=np.int32)
 
-        col = colordefs[SHAPETYPES[tyyp[i]]]
-        rgb = list(QColor(col).getRgb())[:-1]
-        rgb.append(99)
+        index = tyyp[i] + 1
+        col = QColor(colordefs[SHAPETYPES[tyyp[i]]])
+        col.setAlpha(99)
+        colors[index] = col.rgba()
 
         if tyyp[i] < 5:  # joondefektid
-            cv2.polylines(img, [pp], False, rgb, 40)
+            cv2.polylines(img, [pp], False, index, 40)
         if 4 < tyyp[i] < 8:  # pinddefektid
-            cv2.fillPoly(img, [pp], rgb)
+            cv2.fillPoly(img, [pp], index)
         if tyyp[i] == 8:
-            cv2.circle(img, pnts[i][0], 50, rgb, 25)
+            cv2.circle(img, pnts[i][0], 50, index, 25)
 
     # Mask away pixels
-    img[mask==0] = (0, 0, 0, 0)
+    img[mask==0] = 0
 
-    return img
+    layer = QImage(img.data, w, h, img.strides[0], QImage.Format_Indexed8).copy()
+    layer.setColorTable(colors)
+    return layer
 
 
+@traced("getdefects")
 def getdefects(path, xmin, xmax, ymin, ymax, koord):
     deflist = ['defects_polygon', 'defects_line', 'defects_point']
 
@@ -151,6 +159,7 @@ def getdefects(path, xmin, xmax, ymin, ymax, koord):
     return points, rike
 
 
+@traced("runvrt")
 def runvrt(fname):
     vrtfile = open(fname, 'r')
     for line in vrtfile:
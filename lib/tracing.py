@@ -0,0 +1,165 @@
+import os
+import math
+import time
+import json
+import atexit
+import threading
+import functools
+import collections
+
+# Setting this environment variable to a file path enables tracing at startup; the Chrome trace
+# is then written to that path on exit, and the per-operation summary next to it
+TRACE_ENV_VAR = "DATMANT_TRACE"
+
+# Upper bound on stored spans so that long sessions cannot grow the trace without limit
+MAX_TRACE_EVENTS = 1000000
+
+_enabled = False
+_events = collections.deque(maxlen=MAX_TRACE_EVENTS)  # (name, start_ns, duration_ns, thread_id)
+_epoch_ns = time.perf_counter_ns()
+
+
+# Returned by span() while tracing is disabled: entering and leaving it does nothing
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name):
+        self.name = name
+        self.t0 = 0
+
+    def __enter__(self):
+        self.t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        t1 = time.perf_counter_ns()
+        _events.append((self.name, self.t0, t1 - self.t0, threading.get_ident()))
+        return False
+
+
+# Timing span for use in a with statement. Costs a global lookup and a shared no-op object when disabled
+def span(name):
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+# Decorator version of span(); the span is named after the function unless a name is given
+def traced(name=None):
+    def decorator(func):
+        label = name if name is not None else func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def clear():
+    _events.clear()
+
+
+# Snapshot of the recorded spans
+def events():
+    return list(_events)
+
+
+# Nearest-rank percentile of an already sorted list
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(math.ceil(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+# Per-operation statistics in milliseconds: {name: {count, total, p50, p95, max}}
+def summary():
+    durations = collections.defaultdict(list)
+    for name, _, dur, _ in events():
+        durations[name].append(dur / 1e6)
+
+    stats = {}
+    for name, vals in durations.items():
+        vals.sort()
+        stats[name] = {"count": len(vals),
+                       "total_ms": sum(vals),
+                       "p50_ms": _percentile(vals, 50),
+                       "p95_ms": _percentile(vals, 95),
+                       "max_ms": vals[-1]}
+    return stats
+
+
+# Human readable version of summary(), slowest operations (by total time) first
+def format_summary(stats=None):
+    if stats is None:
+        stats = summary()
+    lines = ["%-40s %8s %10s %10s %10s %10s" % ("operation", "count", "total ms", "p50 ms", "p95 ms", "max ms")]
+    for name, s in sorted(stats.items(), key=lambda kv: -kv[1]["total_ms"]):
+        lines.append("%-40s %8d %10.1f %10.2f %10.2f %10.2f" % (name, s["count"], s["total_ms"],
+                                                                s["p50_ms"], s["p95_ms"], s["max_ms"]))
+    return os.linesep.join(lines)
+
+
+# Write the recorded spans in Chrome trace-event format (load in chrome://tracing or Perfetto)
+def export_chrome_trace(path):
+    pid = os.getpid()
+    trace_events = [{"name": name, "cat": "datmant", "ph": "X", "pid": pid, "tid": tid,
+                     "ts": (t0 - _epoch_ns) / 1000.0, "dur": dur / 1000.0}
+                    for name, t0, dur, tid in events()]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+
+def export_summary(path):
+    with open(path, "w") as f:
+        json.dump(summary(), f, indent=2, sort_keys=True)
+
+
+# Companion summary file for a given trace file: trace.json -> trace.summary.json
+def summary_path_for(trace_path):
+    return os.path.splitext(trace_path)[0] + ".summary.json"
+
+
+def export_all(trace_path):
+    export_chrome_trace(trace_path)
+    export_summary(summary_path_for(trace_path))
+
+
+# Enable tracing if TRACE_ENV_VAR is set, and arrange for the results to be written on exit
+def enable_from_env():
+    trace_path = os.environ.get(TRACE_ENV_VAR, "")
+    if trace_path:
+        enable()
+        atexit.register(export_all, trace_path)
+    return trace_path
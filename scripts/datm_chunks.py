@@ -0,0 +1,88 @@
+# Tile-chunked array store for the prepped sources (datm_srcprep.py --format chunked)
+#
+# An HxW(xC) array is stored as a .npy file of shape (ny, nx, ch, cw(, C)), that is, chunk by chunk,
+# zero padded at the right and bottom. The files are opened memory-mapped, so reading a rectangle
+# only touches the chunks it overlaps and worker processes share the pages through the OS cache.
+# Frame and chunk sizes of all files in a folder are kept in an index file next to them.
+
+import os
+import json
+from functools import lru_cache
+
+import numpy as np
+
+CHUNK_INDEX = "chunks_index.json"
+CHUNK_EXT = ".chunks.npy"
+
+# Default chunk size (width, height)
+CHUNK_WH = (256, 256)
+
+
+# Write arr chunked into path; returns its index entry
+def write_chunked(path, arr, chunkwh=CHUNK_WH):
+    cw, ch = chunkwh
+    h, w = arr.shape[:2]
+    ny, nx = -(-h // ch), -(-w // cw)
+
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=arr.dtype, shape=(ny, nx, ch, cw) + arr.shape[2:])
+    for cy in range(ny):
+        for cx in range(nx):
+            blk = arr[cy * ch:(cy + 1) * ch, cx * cw:(cx + 1) * cw]
+            if blk.shape[:2] != (ch, cw):
+                out[cy, cx] = 0
+            out[cy, cx, :blk.shape[0], :blk.shape[1]] = blk
+    out.flush()
+    del out
+
+    return {"file": os.path.basename(path), "shape": list(arr.shape), "chunk": [ch, cw]}
+
+
+# Read-only view of a chunked array. Supports arr[y0:y1, x0:x1] like the original array
+class ChunkedArray:
+
+    def __init__(self, path, shape, chunk):
+        self.data = np.load(path, mmap_mode="r")
+        self.shape = tuple(shape)
+        self.chunk = tuple(chunk)
+        self.dtype = self.data.dtype
+
+    # Assemble the rectangle from the chunks it overlaps
+    def read(self, x, y, w, h):
+        ch, cw = self.chunk
+        h = min(h, self.shape[0] - y)
+        w = min(w, self.shape[1] - x)
+        out = np.empty((h, w) + self.shape[2:], self.dtype)
+        for cy in range(y // ch, (y + h - 1) // ch + 1):
+            y0, y1 = max(y, cy * ch), min(y + h, (cy + 1) * ch)
+            for cx in range(x // cw, (x + w - 1) // cw + 1):
+                x0, x1 = max(x, cx * cw), min(x + w, (cx + 1) * cw)
+                out[y0 - y:y1 - y, x0 - x:x1 - x] = self.data[cy, cx, y0 - cy * ch:y1 - cy * ch,
+                                                              x0 - cx * cw:x1 - cx * cw]
+        return out
+
+    def read_all(self):
+        return self.read(0, 0, self.shape[1], self.shape[0])
+
+    def __getitem__(self, key):
+        ys, xs = key
+        y0, y1, _ = ys.indices(self.shape[0])
+        x0, x1, _ = xs.indices(self.shape[1])
+        return self.read(x0, y0, x1 - x0, y1 - y0)
+
+
+def write_index(folder, entries):
+    with open(folder + os.sep + CHUNK_INDEX, "w") as f:
+        json.dump(entries, f, indent=1)
+
+
+# {frame name: {array name: index entry}}. Read once per process
+@lru_cache(maxsize=8)
+def read_index(folder):
+    with open(folder + os.sep + CHUNK_INDEX, "r") as f:
+        return json.load(f)
+
+
+# Dict of ChunkedArrays (e.g. "img", "masks") of a frame
+def open_chunked_frame(folder, name):
+    return {k: ChunkedArray(folder + os.sep + e["file"], e["shape"], e["chunk"])
+            for k, e in read_index(folder)[name].items()}
@@ -0,0 +1,98 @@
+# Manifest of a dataset output folder, for incremental and resumable rebuilds of the dataset scripts
+#
+# The manifest is kept in the .manifest folder inside the output folder: params.json holds the parameters
+# the folder was built with, and there is one <frame>.json per processed frame with the signatures of its
+# input files (mtime and size, optionally an MD5 hash), the output files it produced and any rows it
+# contributes to the index files. A frame file is written only after all outputs of the frame are, so
+# an interrupted run continues with the frames it had not finished.
+
+import os
+import json
+import hashlib
+import shutil
+
+MANIFEST_DIR = ".manifest"
+PARAMS_FILE = "params.json"
+
+
+# Signature of the input files of a frame: {file name: [mtime, size(, md5)]}; missing files are left out
+def input_signature(paths, hash_inputs=False):
+    sig = {}
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        st = os.stat(path)
+        entry = [st.st_mtime_ns, st.st_size]
+        if hash_inputs:
+            md5 = hashlib.md5()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    md5.update(block)
+            entry.append(md5.hexdigest())
+        sig[os.path.basename(path)] = entry
+    return sig
+
+
+# Write JSON so that the file is either the old or the new version, even if the process is killed
+def save_json_atomic(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+class DatasetManifest:
+
+    def __init__(self, folder, params, hash_inputs=False):
+        self.folder = folder
+        self.params = params
+        self.hash_inputs = hash_inputs
+        self.dir = folder + os.sep + MANIFEST_DIR
+
+    # Whether the folder was built (possibly partially) with the same parameters
+    def matches(self):
+        try:
+            with open(self.dir + os.sep + PARAMS_FILE, "r") as f:
+                return json.load(f) == json.loads(json.dumps(self.params))
+        except (OSError, ValueError):
+            return False
+
+    # Start from an empty folder. NB! Removes everything in it
+    def reset(self):
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder)
+        os.makedirs(self.dir)
+        save_json_atomic(self.dir + os.sep + PARAMS_FILE, self.params)
+
+    def frames(self):
+        return sorted(f[:-len(".json")] for f in os.listdir(self.dir) if f.endswith(".json") and f != PARAMS_FILE)
+
+    def entry(self, frame):
+        try:
+            with open(self.dir + os.sep + frame + ".json", "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # The frame was processed from inputs with this signature and all its outputs are there
+    def is_current(self, frame, signature):
+        entry = self.entry(frame)
+        if entry is None or entry["inputs"] != json.loads(json.dumps(signature)):
+            return False
+        return all(os.path.isfile(self.folder + os.sep + out) for out in entry["outputs"])
+
+    # outputs are paths relative to the folder; data is anything else to keep for the frame
+    def record(self, frame, signature, outputs, **data):
+        entry = {"inputs": signature, "outputs": list(outputs)}
+        entry.update(data)
+        save_json_atomic(self.dir + os.sep + frame + ".json", entry)
+
+    # Delete the outputs of a frame and forget it
+    def remove(self, frame):
+        entry = self.entry(frame)
+        if entry is not None:
+            for out in entry["outputs"]:
+                if os.path.isfile(self.folder + os.sep + out):
+                    os.remove(self.folder + os.sep + out)
+        if os.path.isfile(self.dir + os.sep + frame + ".json"):
+            os.remove(self.dir + os.sep + frame + ".json")
@@ -1,149 +1,147 @@
 # This script uses the prepped src files and outputs PNG files into the directory of choice having two classes
 # defect_0 and defect_1 according to the threshold settings.
+#
+# Frames can be processed in parallel: python datm_png_create.py --workers 8
+# The output does not depend on the number of workers.
+# Reruns only process the frames that are new or have changed, and continue an interrupted run (see
+# datm_manifest.py); --clean rebuilds everything.
+# With --output shards, the segments are written into a few large shard files instead (see datm_shards.py).
+# With --output index, no segments are written, only an index of all of them (see datm_tileindex.py).
+# With --labels multiclass, segments are labelled with the defect classes of defs/color_defs.csv instead
+# (see select_class_segments in datm_tiles.py).
+#
+# With --source raw, the segments are cut directly from the annotated frames in PRE_SRC_FOLDER:
+# the image and masks are read and combined in memory like datm_srcprep.py does, so no
+# intermediate files are needed. The result is the same as with datm_srcprep.py followed by this script.
+# With --source chunked, the tile-chunked output of datm_srcprep.py --format chunked is read from
+# SRC_FOLDER: only the mask is read in full, image data is read for the segments written out.
 
-import cv2
 import numpy as np
-import math
-import shutil
 import os
-from tqdm import tqdm
-import random
-import time
+import argparse
+from functools import partial
 
-# Make nondefect segment generation repeatable
-random.seed(2323)
+from datm_tiles import (seg_preparse_image, seg_occupancy, frame_rng, ORIG_IMG, CUT_MASK_V1, CUT_MASK_V2, DEFECT_MASK,
+                        read_frame, build_label_mask, unpack_masks, write_png_tiles, read_class_defs,
+                        parse_class_thresholds, select_class_segments, class_segments_output,
+                        add_dataset_arguments, write_dataset)
+from datm_chunks import CHUNK_EXT, read_index, open_chunked_frame
 
 # SRC folders etc.
 SRC_FOLDER = "C:\\Data\\ReachU-3DGIS\\defect-detection-ext-paper\\20190414_083725_LD5_PREPPED_SRC" # No trailing slash
+PRE_SRC_FOLDER = "C:\\Data\\ReachU-3DGIS\\defect-detection-ext-paper\\20190414_083725_LD5" # For --source raw
 PNG_FOLDER = "C:\\Data\\ReachU-3DGIS\\defect-detection-ext-paper\\20190414_083725_LD5_PNG"
 THR_IMAGE = 1.0 # Only consider pure segments without any mask
 THR_DEFECT = 0.05 # if NN% of segment pixels are marked as defect, use the segment as defect
 SEG_WH = (224, 224) # Segment size
 
-# This returns the original masks
-def unpack_masks(orig_mask):
-    img_mask = np.zeros(orig_mask.shape, np.uint8)
-    def_mask = np.zeros(orig_mask.shape, np.uint8)
-
-    # Perhaps this can be done more efficiently, but it's still quite fast, so no problem
-    img_mask[np.where((orig_mask == [255, 0, 0]).all(axis=2) |
-                      (orig_mask == [0,255,0]).all(axis=2))] = [255, 255, 255]
-    def_mask[np.where((orig_mask == [255, 0, 0]).all(axis=2))] = [255, 255, 255]
-
-    # Masks must be grayscale as well
-    img_mask = cv2.cvtColor(img_mask, cv2.COLOR_BGR2GRAY)
-    def_mask = cv2.cvtColor(def_mask, cv2.COLOR_BGR2GRAY)
-
-    return (img_mask, def_mask)
-
-# Percent of nonblack pixels in given rectangle
-def seg_get_nonblack_pixel_percentage(mask, ctuple):
-    x, y, w, h = ctuple
-    seg = mask[y:y + h, x:x + w]
-    return cv2.countNonZero(seg) / (w * h)
-
-def seg_preparse_image(mask, segwh, thr):
-
-    seg_width, seg_height = segwh
-    h, w = mask.shape
-    if seg_width > w or seg_height > h:
-        print("Segment size is larger than the image: cannot proceed")
-        return
-
-    # Number of segments per line and row
-    numSegsX = int(math.floor(w / seg_width))
-    numSegsY = int(math.floor(h / seg_height))
-
-    # Segment list
-    seg_list = []
-
-    # Segmentation should be done in four steps:
-    # 1. Top to bottom, left to right
-    # 2. Rightmost boundary: take all segments from the right-end pixel along the vertical (top to bottom)
-    # 3. Bottommost boundary: take all segments from the bottom-end pixel along the horizontal (left to right)
-    # 4. Final segment: the last segment located in the bottom right.
-    # Unless masked, these regions will be overrepresented slightly.
-
-    # Step 1
-    for sy in range(numSegsY):
-        for sx in range(numSegsX):
-            px, py, pw, ph = (sx * seg_width, sy * seg_height, seg_width, seg_height)
-            if seg_get_nonblack_pixel_percentage(mask, (px, py, pw, ph)) >= thr:
-                seg_list.append((px, py, pw, ph))
-
-    # Step 2
-    for sy in range(numSegsY):
-        px, py, pw, ph = (w - seg_width, sy * seg_height, seg_width, seg_height)
-        if seg_get_nonblack_pixel_percentage(mask, (px, py, pw, ph)) >= thr:
-            seg_list.append((px, py, pw, ph))
-
-    # Step 3
-    for sx in range(numSegsX):
-        px, py, pw, ph = (sx * seg_width, h - seg_height, seg_width, seg_height)
-        if seg_get_nonblack_pixel_percentage(mask, (px, py, pw, ph)) >= thr:
-            seg_list.append((px, py, pw, ph))
-
-    # Step 4
-    px, py, pw, ph = (w - seg_width, h - seg_height, seg_width, seg_height)
-    if seg_get_nonblack_pixel_percentage(mask, (px, py, pw, ph)) >= thr:
-        seg_list.append((px, py, pw, ph))
-
-    return seg_list
+# Defect classes for --labels multiclass
+CLASSES = read_class_defs()
+
+# Input files of a frame
+def frame_inputs(now_file_ne, source="prepped"):
+    if source == "raw":
+        return [PRE_SRC_FOLDER + os.sep + now_file_ne + ext
+                for ext in (ORIG_IMG, CUT_MASK_V1, CUT_MASK_V2, DEFECT_MASK)]
+    elif source == "chunked":
+        return [SRC_FOLDER + os.sep + now_file_ne + ext + CHUNK_EXT for ext in (".img", ".masks")]
+    else:
+        return [SRC_FOLDER + os.sep + now_file_ne + ext for ext in (".img.npy", ".masks.npy")]
+
+# Reads, tiles and writes out one frame. Returns the number of defect and nondefect segments and
+# the written files, or for output="shards" or "index", the segments or their index rows instead
+def process_frame(now_file_ne, source="prepped", output="png", labels="binary", class_thr=None):
+
+    # Make nondefect segment generation repeatable
+    rng = frame_rng(now_file_ne)
+
+    # Load the files
+    # The image is not needed for the index
+    if source == "raw":
+        img, mask, dmask = read_frame(PRE_SRC_FOLDER, now_file_ne, image=(output != "index"))
+        msk = build_label_mask(mask, dmask)
+    elif source == "chunked":
+        # Segments are read from the memory-mapped image as they are written out
+        arrs = open_chunked_frame(SRC_FOLDER, now_file_ne)
+        img = arrs["img"]
+        msk = arrs["masks"].read_all()
+    else:
+        img = np.load(SRC_FOLDER + os.sep + now_file_ne + ".img.npy") if output != "index" else None
+        msk = np.load(SRC_FOLDER + os.sep + now_file_ne + ".masks.npy")
 
-##### SCRIPT BEGINS HERE #####
+    if labels == "multiclass":
+        # Class histograms of all segments at once from the label mask
+        if msk.ndim != 2:
+            raise RuntimeError("Frame " + now_file_ne + " was prepped with RGB masks which have no defect classes. "
+                               "Please run datm_srcprep.py again.")
+        selected = select_class_segments(msk, SEG_WH, THR_IMAGE, CLASSES, class_thr, rng, sample=(output != "index"))
+        return class_segments_output(now_file_ne, img, selected, output, PNG_FOLDER)
+
+    # Unpack masks
+    im_msk, df_msk = unpack_masks(msk)
+
+    # Now we compile the list of all segments
+    segs = seg_preparse_image(im_msk, SEG_WH, THR_IMAGE)
+
+    # We now need to determine which segments contain defects and which do not
+    # All segments are scored at once from a summed-area table of the defect mask
+    occ = seg_occupancy(df_msk, segs)
+    is_def = occ >= THR_DEFECT
+    segs_no_def = [seg for seg, d in zip(segs, is_def) if not d]
+    segs_yes_def = [seg for seg, d in zip(segs, is_def) if d]
+
+    if output == "index":
+        # All segments are listed with their fractions, sampling is left to the user of the index
+        road = seg_occupancy(im_msk, segs)
+        rows = [(seg, r, d, "defect_1" if isd else "defect_0") for seg, r, d, isd in zip(segs, road, occ, is_def)]
+        return (len(segs_yes_def), len(segs_no_def)), (rows, None)
+
+    # Now that we know where the defects are, we can write them out to the folders
+    num_defects = len(segs_yes_def)
+    tiles = []
+
+    # Store defects
+    for k in range(num_defects):
+        px, py, pw, ph = segs_yes_def[k]
+        now_seg = img[py:py+ph, px:px+pw]
+        tiles.append(("defect_1", k, segs_yes_def[k], now_seg))
+
+    # Store random non-defects
+    for k in range(num_defects):
+        i = rng.choice(range(len(segs_no_def)))
+        px, py, pw, ph = segs_no_def[i]
+        now_seg = img[py:py+ph, px:px+pw]
+        tiles.append(("defect_0", k, segs_no_def[i], now_seg))
+
+    if output == "shards":
+        return (num_defects, num_defects), (tiles, None)
+
+    return (num_defects, num_defects), (write_png_tiles(PNG_FOLDER, now_file_ne, tiles), None)
 
-# Create the new dir as needed
-if os.path.exists(PNG_FOLDER):
-    shutil.rmtree(PNG_FOLDER)
-    os.makedirs(PNG_FOLDER)
-    os.mkdir(PNG_FOLDER + os.sep + "defect_0")
-    os.mkdir(PNG_FOLDER + os.sep + "defect_1")
-else:
-    os.makedirs(PNG_FOLDER)
-    os.mkdir(PNG_FOLDER + os.sep + "defect_0")
-    os.mkdir(PNG_FOLDER + os.sep + "defect_1")
-
-# Get all files
-all_files = os.listdir(SRC_FOLDER)
-for k in tqdm(range(len(all_files))):
-    now_file = all_files[k]
-    now_file_ne = now_file.split(".")[0]
-    # We process images according to .img.npy and load the masks automatically
-    if ".img.npy" in now_file:
-        # Load the files
-        img = np.load(SRC_FOLDER + os.sep + now_file_ne + ".img.npy")
-        msk = np.load(SRC_FOLDER + os.sep + now_file_ne + ".masks.npy")
+##### SCRIPT BEGINS HERE #####
 
-        # Unpack masks: time consuming operation. Can we make this faster?
-        im_msk, df_msk = unpack_masks(msk)
-
-        # Now we compile the list of all segments
-        segs = seg_preparse_image(im_msk, SEG_WH, THR_IMAGE)
-
-        # We now need to determine which segments contain defects and which do not
-        # So we create more lists
-        segs_no_def = []
-        segs_yes_def = []
-        for seg in segs:
-            if seg_get_nonblack_pixel_percentage(df_msk, seg) >= THR_DEFECT:
-                segs_yes_def.append(seg)
-            else:
-                segs_no_def.append(seg)
-
-        # Now that we know where the defects are, we can write them out to the folders
-        num_defects = len(segs_yes_def)
-
-        # Store defects
-        for k in range(num_defects):
-            px, py, pw, ph = segs_yes_def[k]
-            now_seg = img[py:py+pw, px:px+pw]
-            cv2.imwrite(PNG_FOLDER + os.sep + "defect_1" + os.sep
-                        + now_file_ne + ("_%04d" % k) + ".png", now_seg)
-
-        # Store random non-defects
-        for k in range(num_defects):
-            i = random.choice(range(len(segs_no_def)))
-            px, py, pw, ph = segs_no_def[i]
-            now_seg = img[py:py+pw, px:px+pw]
-            cv2.imwrite(PNG_FOLDER + os.sep + "defect_0" + os.sep
-                        + now_file_ne + ("_%04d" % k) + ".png", now_seg)
\ No newline at end of file
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Cut the prepped source files into defect_0/defect_1 PNG segments")
+    parser.add_argument("--source", choices=["prepped", "chunked", "raw"], default="prepped",
+                        help="read the datm_srcprep.py output (--format npy or chunked) from SRC_FOLDER, "
+                             "or the annotated frames from PRE_SRC_FOLDER")
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+
+    if args.source == "raw":
+        # Annotated frames are the ones having a defect mask
+        all_files = os.listdir(PRE_SRC_FOLDER)
+        frames = sorted(f.split(".")[0] for f in all_files if DEFECT_MASK in f)
+    elif args.source == "chunked":
+        frames = sorted(read_index(SRC_FOLDER))
+    else:
+        # We process images according to .img.npy and load the masks automatically
+        all_files = os.listdir(SRC_FOLDER)
+        frames = sorted(f.split(".")[0] for f in all_files if ".img.npy" in f)
+
+    class_thr = parse_class_thresholds(args.class_thr, CLASSES, THR_DEFECT)
+    func = partial(process_frame, source=args.source, output=args.output, labels=args.labels, class_thr=class_thr)
+    params = {"script": "datm_png_create", "source": args.source, "seg_wh": list(SEG_WH), "thr_image": THR_IMAGE,
+              "thr_defect": THR_DEFECT, "class_thr": list(class_thr)}
+    write_dataset(func, frames, args, PNG_FOLDER, params, partial(frame_inputs, source=args.source))
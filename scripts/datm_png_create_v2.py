@@ -1,13 +1,12 @@
-import cv2
-import numpy as np
 import os
-from tqdm import tqdm
-import shutil
-import math
-import random
+import argparse
+from functools import partial
 
-# Make nondefect segment generation repeatable
-random.seed(2323)
+from datm_tiles import (seg_preparse_image, seg_occupancy, frame_rng, ORIG_IMG, CUT_MASK_V1, CUT_MASK_V2, DEFECT_MASK,
+                        read_image, read_frame, build_label_mask, unpack_masks, write_png_tiles, read_class_defs,
+                        parse_class_thresholds, select_class_segments, class_segments_output,
+                        add_dataset_arguments, write_dataset)
+from datm_satcache import load_frame_sats
 
 # Path to where the images with .defect.mask.png and .cut.mask_v2.png are stored
 # NB! DO NOT, I repeat, DO NOT choose POST_SRC_FOLDER the same as PRE_SRC_FOLDER
@@ -16,144 +15,105 @@ random.seed(2323)
 PRE_SRC_FOLDER = "C:\\Data\\ReachU-3DGIS\\defect-detection-ext-paper\\20190414_083725_LD5"
 PNG_FOLDER = "C:\\Data\\ReachU-3DGIS\\defect-detection-ext-paper\\20190414_083725_LD5_PNG" # NEW FOLDER!
 
-# Some file naming conventions
-ORIG_IMG = ".jpg"
-CUT_MASK_V1 = ".cut.mask.png"
-CUT_MASK_V2 = ".cut.mask_v2.png"
-DEFECT_MASK = ".defect.mask.png"
-
 THR_IMAGE = 1.0 # Only consider pure segments without any mask
 THR_DEFECT = 0.05 # if NN% of segment pixels are marked as defect, use the segment as defect
 SEG_WH = (224, 224) # Segment size
 
-# Percent of nonblack pixels in given rectangle
-def seg_get_nonblack_pixel_percentage(mask, ctuple):
-    x, y, w, h = ctuple
-    seg = mask[y:y + h, x:x + w]
-    return cv2.countNonZero(seg) / (w * h)
-
-def seg_preparse_image(mask, segwh, thr):
-
-    seg_width, seg_height = segwh
-    h, w = mask.shape
-    if seg_width > w or seg_height > h:
-        print("Segment size is larger than the image: cannot proceed")
-        return
-
-    # Number of segments per line and row
-    numSegsX = int(math.floor(w / seg_width))
-    numSegsY = int(math.floor(h / seg_height))
-
-    # Segment list
-    seg_list = []
-
-    # Segmentation should be done in four steps:
-    # 1. Top to bottom, left to right
-    # 2. Rightmost boundary: take all segments from the right-end pixel along the vertical (top to bottom)
-    # 3. Bottommost boundary: take all segments from the bottom-end pixel along the horizontal (left to right)
-    # 4. Final segment: the last segment located in the bottom right.
-    # Unless masked, these regions will be overrepresented slightly.
-
-    # Step 1
-    for sy in range(numSegsY):
-        for sx in range(numSegsX):
-            px, py, pw, ph = (sx * seg_width, sy * seg_height, seg_width, seg_height)
-            if seg_get_nonblack_pixel_percentage(mask, (px, py, pw, ph)) >= thr:
-                seg_list.append((px, py, pw, ph))
-
-    # Step 2
-    for sy in range(numSegsY):
-        px, py, pw, ph = (w - seg_width, sy * seg_height, seg_width, seg_height)
-        if seg_get_nonblack_pixel_percentage(mask, (px, py, pw, ph)) >= thr:
-            seg_list.append((px, py, pw, ph))
-
-    # Step 3
-    for sx in range(numSegsX):
-        px, py, pw, ph = (sx * seg_width, h - seg_height, seg_width, seg_height)
-        if seg_get_nonblack_pixel_percentage(mask, (px, py, pw, ph)) >= thr:
-            seg_list.append((px, py, pw, ph))
-
-    # Step 4
-    px, py, pw, ph = (w - seg_width, h - seg_height, seg_width, seg_height)
-    if seg_get_nonblack_pixel_percentage(mask, (px, py, pw, ph)) >= thr:
-        seg_list.append((px, py, pw, ph))
-
-    return seg_list
+# Defect classes for --labels multiclass
+CLASSES = read_class_defs()
 
-##### SCRIPT BEGINS HERE
+# Input files of a frame
+def frame_inputs(myfile):
+    return [PRE_SRC_FOLDER + os.sep + myfile + ext for ext in (ORIG_IMG, CUT_MASK_V1, CUT_MASK_V2, DEFECT_MASK)]
 
-# Create the new dir as needed
-if os.path.exists(PNG_FOLDER):
-    shutil.rmtree(PNG_FOLDER)
-    os.makedirs(PNG_FOLDER)
-    os.mkdir(PNG_FOLDER + os.sep + "defect_0")
-    os.mkdir(PNG_FOLDER + os.sep + "defect_1")
-else:
-    os.makedirs(PNG_FOLDER)
-    os.mkdir(PNG_FOLDER + os.sep + "defect_0")
-    os.mkdir(PNG_FOLDER + os.sep + "defect_1")
-
-# Files for prescreening
-all_prescr_files = os.listdir(PRE_SRC_FOLDER)
-
-files_with_defects_noext = []
-for fil in all_prescr_files:
-    if DEFECT_MASK in fil:
-        files_with_defects_noext.append(fil.split(".")[0])
-
-# Now we start processing
-for n in tqdm(range(len(files_with_defects_noext))):
-    # File name
-    myfile = files_with_defects_noext[n]
-
-    # Load the original image
-    img = cv2.imread(PRE_SRC_FOLDER + os.sep + myfile + ORIG_IMG)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-    # Check which mask to load
-    mask = None
-    if os.path.isfile(PRE_SRC_FOLDER + os.sep + myfile + CUT_MASK_V2):
-        mask = cv2.imread(PRE_SRC_FOLDER + os.sep + myfile + CUT_MASK_V2)
-    else:
-        mask = cv2.imread(PRE_SRC_FOLDER + os.sep + myfile + CUT_MASK_V1)
+# Reads, tiles and writes out one frame. Returns the number of defect and nondefect segments and
+# the written files, or for output="shards" or "index", the segments or their index rows instead.
+# With sat_cache, the segments are selected from the cached summed-area tables of the frame
+# (see datm_satcache.py). Either way, the image is only decoded if there are segments to write
+def process_frame(myfile, output="png", labels="binary", class_thr=None, sat_cache=False):
 
-    # Load the defect mask
-    dmask = cv2.imread(PRE_SRC_FOLDER + os.sep + myfile + DEFECT_MASK)
+    # Make nondefect segment generation repeatable
+    rng = frame_rng(myfile)
 
-    # First, clip defect mask to actual mask
-    dmask[np.where((mask == [0, 0, 0]).all(axis=2))] = [0, 0, 0]
+    # The masks are read and combined like datm_png_create.py --source raw does, so that both
+    # generators select the same segments of a frame
+    if sat_cache:
+        label = load_frame_sats(PRE_SRC_FOLDER, myfile)
+        img_mask = def_mask = None
+        road_sat, def_sat = label.road, label.defect
+    else:
+        _, mask, dmask = read_frame(PRE_SRC_FOLDER, myfile, image=False)
+        label = build_label_mask(mask, dmask)
+        img_mask, def_mask = unpack_masks(label)
+        road_sat = def_sat = None
 
-    # Make masks greyscale
-    img_mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
-    def_mask = cv2.cvtColor(dmask, cv2.COLOR_BGR2GRAY)
+    if labels == "multiclass":
+        # Class histograms of all segments at once from the label mask, or from the cached tables
+        selected = select_class_segments(label, SEG_WH, THR_IMAGE, CLASSES, class_thr, rng, sample=(output != "index"))
+        img = read_image(PRE_SRC_FOLDER, myfile) if selected and output != "index" else None
+        return class_segments_output(myfile, img, selected, output, PNG_FOLDER)
 
     # Now we compile the list of all segments
-    segs = seg_preparse_image(img_mask, SEG_WH, THR_IMAGE)
+    segs = seg_preparse_image(img_mask, SEG_WH, THR_IMAGE, road_sat)
 
     # We now need to determine which segments contain defects and which do not
-    # So we create more lists
-    segs_no_def = []
-    segs_yes_def = []
-    for seg in segs:
-        if seg_get_nonblack_pixel_percentage(def_mask, seg) >= THR_DEFECT:
-            segs_yes_def.append(seg)
-        else:
-            segs_no_def.append(seg)
+    # All segments are scored at once from a summed-area table of the defect mask
+    occ = seg_occupancy(def_mask, segs, def_sat)
+    is_def = occ >= THR_DEFECT
+    segs_no_def = [seg for seg, d in zip(segs, is_def) if not d]
+    segs_yes_def = [seg for seg, d in zip(segs, is_def) if d]
+
+    if output == "index":
+        # All segments are listed with their fractions, sampling is left to the user of the index
+        road = seg_occupancy(img_mask, segs, road_sat)
+        rows = [(seg, r, d, "defect_1" if isd else "defect_0") for seg, r, d, isd in zip(segs, road, occ, is_def)]
+        return (len(segs_yes_def), len(segs_no_def)), (rows, None)
 
     # Now that we know where the defects are, we can write them out to the folders
     num_defects = len(segs_yes_def)
+    tiles = []
+    img = read_image(PRE_SRC_FOLDER, myfile) if num_defects else None
 
     # Store defects
     for k in range(num_defects):
         px, py, pw, ph = segs_yes_def[k]
-        now_seg = img[py:py + pw, px:px + pw]
-        cv2.imwrite(PNG_FOLDER + os.sep + "defect_1" + os.sep
-                    + myfile + ("_%04d" % k) + ".png", now_seg)
+        now_seg = img[py:py + ph, px:px + pw]
+        tiles.append(("defect_1", k, segs_yes_def[k], now_seg))
 
     # Store random non-defects
     for k in range(num_defects):
-        i = random.choice(range(len(segs_no_def)))
+        i = rng.choice(range(len(segs_no_def)))
         px, py, pw, ph = segs_no_def[i]
-        now_seg = img[py:py + pw, px:px + pw]
-        cv2.imwrite(PNG_FOLDER + os.sep + "defect_0" + os.sep
-                    + myfile + ("_%04d" % k) + ".png", now_seg)
\ No newline at end of file
+        now_seg = img[py:py + ph, px:px + pw]
+        tiles.append(("defect_0", k, segs_no_def[i], now_seg))
+
+    if output == "shards":
+        return (num_defects, num_defects), (tiles, None)
+
+    return (num_defects, num_defects), (write_png_tiles(PNG_FOLDER, myfile, tiles), None)
+
+##### SCRIPT BEGINS HERE
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Cut annotated frames into defect_0/defect_1 PNG segments")
+    add_dataset_arguments(parser)
+    parser.add_argument("--sat-cache", action="store_true",
+                        help="select the segments from the cached mask statistics of the frames (see datm_satcache.py)")
+    args = parser.parse_args()
+
+    # Files for prescreening
+    all_prescr_files = os.listdir(PRE_SRC_FOLDER)
+
+    files_with_defects_noext = []
+    for fil in sorted(all_prescr_files):
+        if DEFECT_MASK in fil:
+            files_with_defects_noext.append(fil.split(".")[0])
+
+    # Now we start processing
+    class_thr = parse_class_thresholds(args.class_thr, CLASSES, THR_DEFECT)
+    func = partial(process_frame, output=args.output, labels=args.labels, class_thr=class_thr,
+                   sat_cache=args.sat_cache)
+    params = {"script": "datm_png_create_v2", "seg_wh": list(SEG_WH), "thr_image": THR_IMAGE,
+              "thr_defect": THR_DEFECT, "class_thr": list(class_thr)}
+    write_dataset(func, files_with_defects_noext, args, PNG_FOLDER, params, frame_inputs)
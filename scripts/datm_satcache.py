@@ -0,0 +1,78 @@
+# Cache of the mask statistics of annotated frames, for fast sweeps over SEG_WH and the thresholds
+#
+# For each frame, <frame>.sat.npz next to the sources keeps the combined label mask (see build_label_mask
+# in datm_tiles.py) along with the signatures of the mask files it was made from. The compressed mask is a
+# small fraction of the size of the sources. The summed-area tables of the road, the defects and each defect
+# class, about 4 bytes per pixel each, are built from it on load. Any tile size and threshold can then be
+# evaluated from the cache alone; the JPEG and the mask PNGs are not decoded.
+# A stale or missing cache entry is built again from the masks when the frame is loaded.
+
+import os
+import json
+
+import numpy as np
+
+from datm_tiles import CUT_MASK_V1, CUT_MASK_V2, DEFECT_MASK, LABEL_ROAD, read_frame, build_label_mask, \
+    nonzero_sat, seg_grid, seg_occupancy
+from datm_manifest import input_signature
+
+SAT_CACHE_EXT = ".sat.npz"
+
+
+# Summed-area tables of a label mask. road and defect are the tables of the non-ignored and the defect
+# pixels; the tables of single classes are made when first asked for
+class FrameSATs:
+
+    def __init__(self, label):
+        self.label = label
+        self.shape = label.shape
+        self.road = nonzero_sat(label)
+        self.defect = nonzero_sat(label > LABEL_ROAD)
+        self.codes = set(int(c) for c in np.nonzero(np.bincount(label.ravel(), minlength=256))[0])
+        self._classes = {}
+
+    # Table of one class code, or None if the frame has no pixels of it
+    def class_sat(self, code):
+        if code not in self.codes:
+            return None
+        if code not in self._classes:
+            self._classes[code] = nonzero_sat(self.label == code)
+        return self._classes[code]
+
+    # Same as seg_class_fractions() in datm_tiles.py for the label mask
+    def seg_class_fractions(self, segwh, classes):
+        h, w = self.shape
+        rects = seg_grid(h, w, segwh)
+        road = seg_occupancy(None, rects, sat=self.road)
+        fractions = np.zeros((len(rects), len(classes)), np.float64)
+        for i, (code, name) in enumerate(classes):
+            sat = self.class_sat(code)
+            if sat is not None:
+                fractions[:, i] = seg_occupancy(None, rects, sat=sat)
+        return rects, road, fractions
+
+
+def _mask_inputs(src_folder, name):
+    return [src_folder + os.sep + name + ext for ext in (CUT_MASK_V1, CUT_MASK_V2, DEFECT_MASK)]
+
+
+# Tables of a frame from the cache in cache_folder (default: next to the sources), which is
+# (re)built from the masks if needed
+def load_frame_sats(src_folder, name, cache_folder=None):
+    path = (cache_folder or src_folder) + os.sep + name + SAT_CACHE_EXT
+    inputs = json.dumps(input_signature(_mask_inputs(src_folder, name)), sort_keys=True)
+
+    if os.path.isfile(path):
+        with np.load(path) as data:
+            if str(data["inputs"]) == inputs:
+                return FrameSATs(data["label"])
+
+    img, mask, dmask = read_frame(src_folder, name, image=False)
+    label = build_label_mask(mask, dmask)
+
+    # Written under a temporary name first, so that an interrupted run does not leave a broken cache
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(f, label=label, inputs=np.array(inputs))
+    os.replace(path + ".tmp", path)
+
+    return FrameSATs(label)
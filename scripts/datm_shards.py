@@ -0,0 +1,116 @@
+# Sharded tile output for the dataset scripts (datm_png_create*.py --output shards)
+#
+# Instead of one PNG per segment, the segments are stacked into shard files shard_NNNNN.npy of shape
+# (N, h, w, C) with up to shard_size segments each. Every segment has a row in shards_index.csv:
+# shard, offset, frame, x, y, w, h, label. The stored arrays are the same that cv2.imread() returns
+# for the corresponding PNG file.
+
+import os
+import csv
+
+import numpy as np
+
+SHARD_INDEX = "shards_index.csv"
+SHARD_SIZE = 4096  # Segments per shard
+
+INDEX_FIELDS = ["shard", "offset", "frame", "x", "y", "w", "h", "label"]
+
+
+class TileShardWriter:
+
+    def __init__(self, folder, shard_size=SHARD_SIZE):
+        self.folder = folder
+        self.shard_size = shard_size
+        self.num_shards = 0
+        self.num_tiles = 0
+        self._tiles = []
+        self._rows = []
+        self._index_file = open(folder + os.sep + SHARD_INDEX, "w", newline="")
+        self._index = csv.writer(self._index_file)
+        self._index.writerow(INDEX_FIELDS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, tile, frame, x, y, w, h, label):
+        self._tiles.append(tile)
+        self._rows.append([frame, x, y, w, h, label])
+        if len(self._tiles) >= self.shard_size:
+            self.flush()
+
+    # Add the segments of a frame as produced by process_frame(): (label, k, (x, y, w, h), tile)
+    def add_frame(self, frame, tiles):
+        for label, k, (x, y, w, h), tile in tiles:
+            self.add(tile, frame, x, y, w, h, label)
+
+    # Write out the buffered segments as a (possibly partial) shard
+    def flush(self):
+        if not self._tiles:
+            return
+        name = "shard_%05d.npy" % self.num_shards
+        np.save(self.folder + os.sep + name, np.stack(self._tiles))
+        for offset, row in enumerate(self._rows):
+            self._index.writerow([name, offset] + row)
+        self._index_file.flush()
+        self.num_shards += 1
+        self.num_tiles += len(self._tiles)
+        self._tiles = []
+        self._rows = []
+
+    def close(self):
+        if self._index_file.closed:
+            return
+        self.flush()
+        self._index_file.close()
+
+
+# Reads the segments written by TileShardWriter. Indexing returns (tile, index row).
+# Iteration goes through the shards sequentially, loading each shard once; sample() draws segments
+# in random order from memory-mapped shards.
+class TileShardReader:
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.index = []
+        with open(folder + os.sep + SHARD_INDEX, "r", newline="") as f:
+            for row in csv.DictReader(f):
+                for k in ("offset", "x", "y", "w", "h"):
+                    row[k] = int(row[k])
+                self.index.append(row)
+        self._mapped = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def _shard(self, name):
+        if name not in self._mapped:
+            self._mapped[name] = np.load(self.folder + os.sep + name, mmap_mode="r")
+        return self._mapped[name]
+
+    def __getitem__(self, i):
+        row = self.index[i]
+        return np.array(self._shard(row["shard"])[row["offset"]]), row
+
+    def __iter__(self):
+        shard_name, shard = None, None
+        for row in self.index:
+            if row["shard"] != shard_name:
+                shard_name = row["shard"]
+                shard = np.load(self.folder + os.sep + shard_name)
+            yield shard[row["offset"]], row
+
+    # Up to n segments (all by default) in random order, without repetition
+    def sample(self, n=None, seed=None):
+        order = np.random.RandomState(seed).permutation(len(self.index))
+        for i in order[:n]:
+            yield self[int(i)]
+
+    # Number of segments per label
+    def label_counts(self):
+        counts = {}
+        for row in self.index:
+            counts[row["label"]] = counts.get(row["label"], 0) + 1
+        return counts
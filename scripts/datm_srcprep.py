@@ -1,17 +1,21 @@
 # Prepare source files for segment extraction
 # NB! LOTS of disk space required
-import cv2
+# To cut segments without the intermediate files, use datm_png_create.py --source raw instead
+#
+# With --format chunked, the arrays are stored tile-chunked (see datm_chunks.py) so that
+# datm_png_create.py --source chunked reads only the parts of the images it cuts segments from
+#
+# Reruns only prepare the frames that are new or have changed, and continue an interrupted run
+# (see datm_manifest.py); --clean prepares everything again.
 import numpy as np
 import os
 from tqdm import tqdm
-import shutil
-import time
+import argparse
 
-# Some file naming conventions
-ORIG_IMG = ".jpg"
-CUT_MASK_V1 = ".cut.mask.png"
-CUT_MASK_V2 = ".cut.mask_v2.png"
-DEFECT_MASK = ".defect.mask.png"
+from datm_tiles import ORIG_IMG, CUT_MASK_V1, CUT_MASK_V2, DEFECT_MASK, read_frame, build_label_mask, \
+    add_manifest_arguments
+from datm_chunks import CHUNK_EXT, CHUNK_WH, write_chunked, write_index
+from datm_manifest import DatasetManifest, input_signature
 
 # Saving
 SAVE_IMG = ".img.npy"
@@ -19,59 +23,66 @@ COMB_MASK = ".masks.npy"
 
 # Path to where the images with .defect.mask.png and .cut.mask_v2.png are stored
 # NB! DO NOT, I repeat, DO NOT choose POST_SRC_FOLDER the same as PRE_SRC_FOLDER
-# This is because it is CLEARED of ALL FILES on every run
+# This is because it is CLEARED of ALL FILES on a clean run
 # NEVER choose POST_SRC_FOLDER as folder that already contains some data, otherwise you will lose it!
 PRE_SRC_FOLDER = "C:\\Data\\ReachU-3DGIS\\defect-detection-ext-paper\\20190414_083725_LD5"
 POST_SRC_FOLDER = "C:\\Data\\ReachU-3DGIS\\defect-detection-ext-paper\\20190414_083725_LD5_PREPPED_SRC" # NEW FOLDER!
 
-# Create the new dir as needed
-if os.path.exists(POST_SRC_FOLDER):
-    shutil.rmtree(POST_SRC_FOLDER)
-    os.makedirs(POST_SRC_FOLDER)
-else:
-    os.makedirs(POST_SRC_FOLDER)
+parser = argparse.ArgumentParser(description="Prepare the annotated frames for segment extraction")
+parser.add_argument("--format", choices=["npy", "chunked"], default="npy",
+                    help="plain .npy arrays (default) or tile-chunked memory-mappable arrays")
+parser.add_argument("--chunk", type=int, nargs=2, default=list(CHUNK_WH), metavar=("W", "H"),
+                    help="chunk size for --format chunked")
+add_manifest_arguments(parser)
+args = parser.parse_args()
+
+# Create the new dir as needed, or continue with the existing one if it was prepared the same way
+manifest = DatasetManifest(POST_SRC_FOLDER, {"script": "datm_srcprep", "format": args.format, "chunk": args.chunk},
+                           args.hash)
+if args.clean or not manifest.matches():
+    manifest.reset()
 
 # Get list of all images from the pre_src
 all_presrc_files = os.listdir(PRE_SRC_FOLDER)
 
 # Go through all the files checking if we have detected a .defect.mask.png file
 # If detected, prep the file for saving along with the original image. For speed, files are saved as NPY arrays
-
-# Format for masks: black = ignore, red = defect, green = no defect (according to supplied annotation)
+frames = sorted(f.split(".")[0] for f in all_presrc_files if DEFECT_MASK in f)
+
+# Skip the frames prepared before from the same files, remove the ones that changed or are gone
+signatures = {name: input_signature([PRE_SRC_FOLDER + os.sep + name + ext
+                                     for ext in (ORIG_IMG, CUT_MASK_V1, CUT_MASK_V2, DEFECT_MASK)], args.hash)
+              for name in frames}
+todo = [name for name in frames if not manifest.is_current(name, signatures[name])]
+todo_set = set(todo)
+for name in manifest.frames():
+    if name not in signatures or name in todo_set:
+        manifest.remove(name)
+print(str(len(frames) - len(todo)) + " frames up to date, " + str(len(todo)) + " to prepare")
+
+# Format for masks: single channel, 0 = ignore, 1 = no defect (according to supplied annotation),
+# defects have the grayscale value of their class (see build_label_mask in datm_tiles.py)
 
 # Let's go.
-for n in tqdm(range(len(all_presrc_files))):
-    # File name
-    myfile = all_presrc_files[n]
-
-    # Found it
-    if DEFECT_MASK in myfile:
-        myfile_no_ext = myfile.split(".")[0]
-
-        # Load the original image
-        img = cv2.imread(PRE_SRC_FOLDER + os.sep + myfile_no_ext + ORIG_IMG)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+for myfile_no_ext in tqdm(todo):
 
-        # Check which mask to load
-        mask = None
-        if os.path.isfile(PRE_SRC_FOLDER + os.sep + myfile_no_ext + CUT_MASK_V2):
-            mask = cv2.imread(PRE_SRC_FOLDER + os.sep + myfile_no_ext + CUT_MASK_V2)
-        else:
-            mask = cv2.imread(PRE_SRC_FOLDER + os.sep + myfile_no_ext + CUT_MASK_V1)
+    # Load the original image and the masks
+    img, mask, dmask = read_frame(PRE_SRC_FOLDER, myfile_no_ext)
 
-        # Load the defect mask
-        dmask = cv2.imread(PRE_SRC_FOLDER + os.sep + myfile)
+    # Create a new mask with colors
+    nmask = build_label_mask(mask, dmask)
 
-        # First, clip defect mask to actual mask
-        dmask[np.where((mask == [0, 0, 0]).all(axis=2))] = [0, 0, 0]
-
-        # Now, create a new mask with colors
-        nmask = np.zeros(dmask.shape, np.uint8)
-
-        # Fill original mask first
-        nmask[np.where((mask == [255, 255, 255]).all(axis=2))] = [0, 255, 0]
-        nmask[np.where((dmask == [255, 255, 255]).all(axis=2))] = [255, 0, 0]
-
-        # Save NPY arrays
+    # Save NPY arrays
+    if args.format == "chunked":
+        chunks = {"img": write_chunked(POST_SRC_FOLDER + os.sep + myfile_no_ext + ".img" + CHUNK_EXT, img, args.chunk),
+                  "masks": write_chunked(POST_SRC_FOLDER + os.sep + myfile_no_ext + ".masks" + CHUNK_EXT, nmask,
+                                         args.chunk)}
+        manifest.record(myfile_no_ext, signatures[myfile_no_ext], [c["file"] for c in chunks.values()], chunks=chunks)
+    else:
         np.save(POST_SRC_FOLDER + os.sep + myfile_no_ext + SAVE_IMG, img)
-        np.save(POST_SRC_FOLDER + os.sep + myfile_no_ext + COMB_MASK, nmask)
\ No newline at end of file
+        np.save(POST_SRC_FOLDER + os.sep + myfile_no_ext + COMB_MASK, nmask)
+        manifest.record(myfile_no_ext, signatures[myfile_no_ext], [myfile_no_ext + SAVE_IMG, myfile_no_ext + COMB_MASK])
+
+# The chunk index covers all frames
+if args.format == "chunked":
+    write_index(POST_SRC_FOLDER, {name: manifest.entry(name)["chunks"] for name in frames})
@@ -0,0 +1,76 @@
+# Sweep over segment sizes and thresholds: how many segments the dataset scripts would produce
+# for each combination, computed from the cached mask statistics of the frames (see datm_satcache.py)
+#
+#   python datm_sweep.py --seg 224 224 --seg 160 160 --thr-image 1.0 0.9 --thr-defect 0.05 0.1
+#
+# Only the masks are decoded, and only the first time a frame is swept (or after its masks change).
+# The chosen variant can then be built with datm_png_create_v2.py --sat-cache, which decodes the
+# images of the frames that have segments to write.
+
+import os
+import argparse
+import itertools
+from functools import partial
+
+from datm_tiles import DEFECT_MASK, seg_preparse_image, seg_occupancy, read_class_defs, \
+    parse_class_thresholds, select_class_segments, dataset_labels, run_frames
+from datm_satcache import load_frame_sats
+
+# Path to where the images with .defect.mask.png and .cut.mask_v2.png are stored
+PRE_SRC_FOLDER = "C:\\Data\\ReachU-3DGIS\\defect-detection-ext-paper\\20190414_083725_LD5"
+
+# Defect classes for --labels multiclass
+CLASSES = read_class_defs()
+
+
+# Counts of one frame for all variants (seg_wh, thr_image, thr_defect), concatenated: the number of
+# segments passing thr_image followed by the number of segments per label of dataset_labels()
+# that would be written
+def sweep_frame(name, variants, labels="binary", class_thr=None):
+    sats = load_frame_sats(PRE_SRC_FOLDER, name)
+    counts = []
+    for seg_wh, thr_image, thr_defect in variants:
+        if labels == "multiclass":
+            thr = class_thr if class_thr is not None else parse_class_thresholds(None, CLASSES, thr_defect)
+            selected = select_class_segments(sats, seg_wh, thr_image, CLASSES, thr, None, sample=False)
+            per_class = [sum(1 for sel in selected if sel[0] == cls) for code, cls in CLASSES]
+            # As many segments without defects are drawn as there are with
+            counts += [len(selected)] + per_class + [sum(per_class)]
+        else:
+            segs = seg_preparse_image(None, seg_wh, thr_image, sats.road) or []
+            num_defects = int((seg_occupancy(None, segs, sats.defect) >= thr_defect).sum())
+            counts += [len(segs), num_defects, num_defects]
+    return tuple(counts)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Count the segments of dataset variants from the cached mask "
+                                                 "statistics of the frames")
+    parser.add_argument("--seg", type=int, nargs=2, action="append", metavar=("W", "H"),
+                        help="segment size, can be given several times (default: 224 224)")
+    parser.add_argument("--thr-image", type=float, nargs="+", default=[1.0], help="THR_IMAGE values")
+    parser.add_argument("--thr-defect", type=float, nargs="+", default=[0.05], help="THR_DEFECT values")
+    parser.add_argument("--labels", choices=["binary", "multiclass"], default="binary",
+                        help="defect_0/defect_1 by THR_DEFECT, counting every nonzero defect class as a defect, "
+                             "or the defect classes of defs/color_defs.csv")
+    parser.add_argument("--class-thr", nargs="+", default=None, metavar="THR",
+                        help="multiclass thresholds as in datm_png_create_v2.py (default: the THR_DEFECT values)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    args = parser.parse_args()
+
+    frames = sorted(f.split(".")[0] for f in os.listdir(PRE_SRC_FOLDER) if DEFECT_MASK in f)
+    variants = list(itertools.product([tuple(s) for s in args.seg or [(224, 224)]], args.thr_image,
+                                      args.thr_defect))
+    class_thr = parse_class_thresholds(args.class_thr, CLASSES, 0) if args.class_thr else None
+    labels = dataset_labels(args.labels)
+
+    per_worker = run_frames(partial(sweep_frame, variants=variants, labels=args.labels, class_thr=class_thr),
+                            frames, args.workers, desc="Sweeping")
+    totals = [sum(tot[i] for tot in per_worker.values()) for i in range(1, 1 + len(variants) * (1 + len(labels)))]
+
+    # One line per variant: segments passing THR_IMAGE, then the segments that would be written per label
+    print("seg_w\tseg_h\tthr_image\tthr_defect\tsegments\t" + "\t".join(labels))
+    for n, (seg_wh, thr_image, thr_defect) in enumerate(variants):
+        row = totals[n * (1 + len(labels)):(n + 1) * (1 + len(labels))]
+        print("\t".join(str(v) for v in list(seg_wh) + [thr_image, thr_defect] + row))
@@ -0,0 +1,136 @@
+# Tile index output for the dataset scripts (datm_png_create*.py --output index)
+#
+# Instead of cutting segments, every segment that passes THR_IMAGE is listed in one CSV file with its
+# frame, position, road and defect fractions, label and split. TileIndexDataset then cuts the crops on
+# the fly from the sources, so that a different sampling policy is only a filter over the index rows.
+
+import os
+import csv
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from datm_tiles import read_frame, build_label_mask
+
+TILE_INDEX = "tiles_index.csv"
+MULTILABELS = "multilabels.csv"  # Multi-hot class vectors of the segments in the multiclass mode
+VAL_FRACTION = 0.1  # Fraction of frames in the validation split
+
+INDEX_FIELDS = ["frame", "x", "y", "w", "h", "road", "defect", "label", "split"]
+
+
+# Split of a frame: whole frames go to one split, so that overlapping segments do not leak between them
+def frame_split(name, val_fraction=VAL_FRACTION):
+    return "val" if zlib.crc32(name.encode("utf-8")) % 10000 < val_fraction * 10000 else "train"
+
+
+class TileIndexWriter:
+
+    def __init__(self, folder, val_fraction=VAL_FRACTION):
+        self.val_fraction = val_fraction
+        self.num_tiles = 0
+        self._file = open(folder + os.sep + TILE_INDEX, "w", newline="")
+        self._index = csv.writer(self._file)
+        self._index.writerow(INDEX_FIELDS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Add the segments of a frame as produced by process_frame(): ((x, y, w, h), road, defect, label)
+    def add_frame(self, frame, rows):
+        split = frame_split(frame, self.val_fraction)
+        for (x, y, w, h), road, defect, label in rows:
+            self._index.writerow([frame, x, y, w, h, "%.4f" % road, "%.4f" % defect, label, split])
+        self.num_tiles += len(rows)
+
+    def close(self):
+        self._file.close()
+
+
+# Multi-hot class vectors of the written segments: frame, x, y, w, h, label and a 0/1 column per class
+class MultiLabelWriter(TileIndexWriter):
+
+    def __init__(self, folder, classes):
+        self.num_tiles = 0
+        self._file = open(folder + os.sep + MULTILABELS, "w", newline="")
+        self._index = csv.writer(self._file)
+        self._index.writerow(["frame", "x", "y", "w", "h", "label"] + [name for code, name in classes])
+
+    # Rows as produced by process_frame(): ((x, y, w, h), label, multi-hot)
+    def add_frame(self, frame, rows):
+        for (x, y, w, h), label, multi in rows:
+            self._index.writerow([frame, x, y, w, h, label] + [int(v) for v in multi])
+        self.num_tiles += len(rows)
+
+
+def read_tile_index(path):
+    rows = []
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            for k in ("x", "y", "w", "h"):
+                row[k] = int(row[k])
+            for k in ("road", "defect"):
+                row[k] = float(row[k])
+            rows.append(row)
+    return rows
+
+
+# Crops of the segments listed in a tile index, cut on the fly from the sources.
+# Items are (image crop, label crop, index row); the label crop is in the format of build_label_mask().
+# Frames are read from src_folder like datm_png_create.py --source does ("raw", "prepped" or "chunked"),
+# and the last cache_frames frames are kept in memory. Each worker process using the dataset has its own
+# cache, so segments should be handed out grouped by frame, as the index lists them.
+class TileIndexDataset:
+
+    def __init__(self, rows, src_folder, source="raw", cache_frames=4):
+        self.rows = rows
+        self.src_folder = src_folder
+        self.source = source
+        self.cache_frames = cache_frames
+        self._cache = OrderedDict()
+
+    @classmethod
+    def from_csv(cls, path, src_folder, source="raw", cache_frames=4):
+        return cls(read_tile_index(path), src_folder, source, cache_frames)
+
+    # New dataset with the rows for which func(row) is true, e.g. lambda r: r["split"] == "train"
+    def filter(self, func):
+        return TileIndexDataset([r for r in self.rows if func(r)], self.src_folder, self.source, self.cache_frames)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _load(self, frame):
+        if self.source == "raw":
+            img, mask, dmask = read_frame(self.src_folder, frame)
+            return img, build_label_mask(mask, dmask)
+        elif self.source == "chunked":
+            from datm_chunks import open_chunked_frame
+            arrs = open_chunked_frame(self.src_folder, frame)
+            return arrs["img"], arrs["masks"]
+        else:
+            return (np.load(self.src_folder + os.sep + frame + ".img.npy", mmap_mode="r"),
+                    np.load(self.src_folder + os.sep + frame + ".masks.npy", mmap_mode="r"))
+
+    def frame(self, frame):
+        if frame in self._cache:
+            self._cache.move_to_end(frame)
+        else:
+            self._cache[frame] = self._load(frame)
+            if len(self._cache) > self.cache_frames:
+                self._cache.popitem(last=False)
+        return self._cache[frame]
+
+    def __getitem__(self, i):
+        row = self.rows[i]
+        img, label = self.frame(row["frame"])
+        x, y, w, h = row["x"], row["y"], row["w"], row["h"]
+        return np.array(img[y:y + h, x:x + w]), np.array(label[y:y + h, x:x + w]), row
+
+    def __iter__(self):
+        for i in range(len(self.rows)):
+            yield self[i]
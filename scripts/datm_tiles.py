@@ -0,0 +1,459 @@
+# Tiling helpers shared by the dataset scripts (datm_png_create.py, datm_png_create_v2.py, ...)
+#
+# Tiles ("segments") are described as (x, y, w, h) rectangles. All tiles of a frame are scored at
+# once from a summed-area table of the mask instead of counting pixels tile by tile.
+
+import os
+import csv
+import random
+import zlib
+from multiprocessing import Pool
+
+import numpy as np
+import cv2
+from tqdm import tqdm
+
+# Base seed for the nondefect segment selection
+SEED = 2323
+
+# Some file naming conventions
+ORIG_IMG = ".jpg"
+CUT_MASK_V1 = ".cut.mask.png"
+CUT_MASK_V2 = ".cut.mask_v2.png"
+DEFECT_MASK = ".defect.mask.png"
+
+# Single channel label codes of the combined mask. Defect pixels keep the grayscale value of
+# their class (COLOR_GSCALE_MAPPING in defs/color_defs.csv), which are all above these
+LABEL_IGNORE = 0
+LABEL_ROAD = 1
+
+# Defect class definitions of the annotation tool
+COLOR_DEFS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "defs", "color_defs.csv")
+
+# Label of the segments without defects in the multiclass mode
+NO_DEFECT = "no_defect"
+
+
+# Load the original image of an annotated frame (RGB)
+def read_image(src_folder, name):
+    img = cv2.imread(src_folder + os.sep + name + ORIG_IMG)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+# Load the original image (RGB), the cut mask and the defect mask (both grayscale) of an annotated frame.
+# The image is not decoded (None is returned for it) if only the masks are needed
+def read_frame(src_folder, name, image=True):
+    img = read_image(src_folder, name) if image else None
+
+    # Check which mask to load
+    if os.path.isfile(src_folder + os.sep + name + CUT_MASK_V2):
+        mask = cv2.imread(src_folder + os.sep + name + CUT_MASK_V2, cv2.IMREAD_GRAYSCALE)
+    else:
+        mask = cv2.imread(src_folder + os.sep + name + CUT_MASK_V1, cv2.IMREAD_GRAYSCALE)
+
+    dmask = cv2.imread(src_folder + os.sep + name + DEFECT_MASK, cv2.IMREAD_GRAYSCALE)
+
+    return img, mask, dmask
+
+
+# Combined single channel mask as prepped by datm_srcprep.py
+# Format for masks: LABEL_IGNORE, LABEL_ROAD = no defect (according to supplied annotation), else defect class
+def build_label_mask(mask, dmask):
+    label = np.zeros(mask.shape, np.uint8)
+
+    # Fill original mask first
+    road = mask == 255
+    label[road] = LABEL_ROAD
+
+    # Defects keep their class, clipped to the road: values of the mask other than 0 and 255 (anti-aliased or
+    # resampled PNGs) are not road, and neither are the defects on them
+    defects = (dmask != 0) & road
+    label[defects] = dmask[defects]
+
+    return label
+
+
+# This returns the original masks: road (including defects) and defects, as 0/255 grayscale images
+def unpack_masks(orig_mask):
+
+    # Masks prepped before the single channel encoding: black = ignore, red = defect, green = no defect
+    if orig_mask.ndim == 3:
+        return unpack_masks_rgb(orig_mask)
+
+    img_mask = (orig_mask != LABEL_IGNORE).view(np.uint8) * np.uint8(255)
+    def_mask = (orig_mask > LABEL_ROAD).view(np.uint8) * np.uint8(255)
+
+    return (img_mask, def_mask)
+
+
+def unpack_masks_rgb(orig_mask):
+    img_mask = np.zeros(orig_mask.shape, np.uint8)
+    def_mask = np.zeros(orig_mask.shape, np.uint8)
+
+    # Perhaps this can be done more efficiently, but it's still quite fast, so no problem
+    img_mask[np.where((orig_mask == [255, 0, 0]).all(axis=2) |
+                      (orig_mask == [0,255,0]).all(axis=2))] = [255, 255, 255]
+    def_mask[np.where((orig_mask == [255, 0, 0]).all(axis=2))] = [255, 255, 255]
+
+    # Masks must be grayscale as well
+    img_mask = cv2.cvtColor(img_mask, cv2.COLOR_BGR2GRAY)
+    def_mask = cv2.cvtColor(def_mask, cv2.COLOR_BGR2GRAY)
+
+    return (img_mask, def_mask)
+
+
+# All segment rectangles of a (h, w) frame as an (N, 4) int array of (x, y, w, h)
+def seg_grid(h, w, segwh):
+
+    seg_width, seg_height = segwh
+
+    # Number of segments per line and row
+    numSegsX = w // seg_width
+    numSegsY = h // seg_height
+
+    # Segmentation is done in four steps:
+    # 1. Top to bottom, left to right
+    # 2. Rightmost boundary: take all segments from the right-end pixel along the vertical (top to bottom)
+    # 3. Bottommost boundary: take all segments from the bottom-end pixel along the horizontal (left to right)
+    # 4. Final segment: the last segment located in the bottom right.
+    # Unless masked, these regions will be overrepresented slightly.
+    xs = np.arange(numSegsX) * seg_width
+    ys = np.arange(numSegsY) * seg_height
+
+    gx, gy = np.meshgrid(xs, ys)
+    step1 = np.stack([gx.ravel(), gy.ravel()], axis=1)
+    step2 = np.stack([np.full(numSegsY, w - seg_width), ys], axis=1)
+    step3 = np.stack([xs, np.full(numSegsX, h - seg_height)], axis=1)
+    step4 = np.array([[w - seg_width, h - seg_height]])
+
+    xy = np.concatenate([step1, step2, step3, step4]).astype(np.int64)
+    wh = np.tile(np.array([[seg_width, seg_height]], np.int64), (len(xy), 1))
+    return np.concatenate([xy, wh], axis=1)
+
+
+# Summed-area table of the nonzero pixels of a mask, shape (h+1, w+1)
+def nonzero_sat(mask):
+    return cv2.integral((mask > 0).astype(np.uint8), sdepth=cv2.CV_32S)
+
+
+# Pixel sums over many rectangles at once from a summed-area table
+def sat_rect_sums(sat, rects):
+    rects = np.asarray(rects, np.int64).reshape(-1, 4)
+    x0, y0 = rects[:, 0], rects[:, 1]
+    x1, y1 = x0 + rects[:, 2], y0 + rects[:, 3]
+    return sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+
+
+# Fraction of nonblack pixels in each of the given rectangles. Either a mask or its
+# summed-area table (see nonzero_sat) can be given, the latter when it is reused
+def seg_occupancy(mask, rects, sat=None):
+    rects = np.asarray(rects, np.int64).reshape(-1, 4)
+    if sat is None:
+        sat = nonzero_sat(mask)
+    return sat_rect_sums(sat, rects) / (rects[:, 2] * rects[:, 3]).astype(np.float64)
+
+
+# Histograms of the label codes in all segments of seg_grid(), as an (N, 256) array
+def seg_label_histograms(label, segwh):
+    seg_width, seg_height = segwh
+    h, w = label.shape
+    nx, ny = w // seg_width, h // seg_height
+
+    # The four steps of seg_grid(): the regular grid, the rightmost and bottommost boundaries and the
+    # final segment. Within each of these the segments do not overlap
+    parts = [label[:ny * seg_height, :nx * seg_width],
+             label[:ny * seg_height, w - seg_width:],
+             label[h - seg_height:, :nx * seg_width],
+             label[h - seg_height:, w - seg_width:]]
+    return np.concatenate([_block_histograms(part, segwh) for part in parts])
+
+
+# Histograms of non-overlapping blocks, counted at once over (block id * 256 + label code)
+def _block_histograms(region, segwh):
+    seg_width, seg_height = segwh
+    ny, nx = region.shape[0] // seg_height, region.shape[1] // seg_width
+    by = np.repeat(np.arange(ny, dtype=np.int32), seg_height)
+    bx = np.repeat(np.arange(nx, dtype=np.int32), seg_width)
+    codes = (by[:, None] * nx + bx[None, :]) * 256 + region
+    return np.bincount(codes.ravel(), minlength=ny * nx * 256).reshape(ny * nx, 256)
+
+
+# Class codes and names (COLOR_GSCALE_MAPPING, COLOR_NAME_EN) from defs/color_defs.csv. Names are
+# made usable as folder names
+def read_class_defs(path=COLOR_DEFS):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return [(int(row["COLOR_GSCALE_MAPPING"]), row["COLOR_NAME_EN"].strip().replace(" ", "_"))
+                for row in csv.DictReader(f, delimiter=";")]
+
+
+# Per class thresholds from command line entries: a number sets all classes, CODE=THR or NAME=THR one class
+def parse_class_thresholds(entries, classes, default):
+    thr = np.full(len(classes), default, np.float64)
+    for entry in entries or []:
+        if "=" in entry:
+            key, val = entry.split("=", 1)
+            idx = [i for i, (code, name) in enumerate(classes) if key in (str(code), name)]
+            if not idx:
+                raise ValueError("Unknown defect class " + key)
+            thr[idx] = float(val)
+        else:
+            thr[:] = float(entry)
+    return thr
+
+
+# Segments of seg_grid() with their fraction of non-ignored pixels and an (N, len(classes)) array of
+# class fractions, from a single channel label mask (see build_label_mask)
+def seg_class_fractions(label, segwh, classes):
+    h, w = label.shape
+    hist = seg_label_histograms(label, segwh)
+    area = float(segwh[0] * segwh[1])
+    road = (area - hist[:, LABEL_IGNORE]) / area
+    fractions = hist[:, [code for code, name in classes]] / area
+    return seg_grid(h, w, segwh), road, fractions
+
+
+# Segment selection for the multiclass mode, from a single channel label mask (see build_label_mask)
+# or its summed-area tables (FrameSATs in datm_satcache.py).
+# Segments with at least thr_image of non-ignored pixels are considered. A segment has every class
+# whose fraction reaches its threshold (multi-hot vector) and is labelled with the largest of these.
+# All segments with defects are taken and as many randomly drawn ones without (NO_DEFECT), or with
+# sample=False, all of them. Returns [(label, k, (x, y, w, h), road, defect, multi-hot)]
+def select_class_segments(label, segwh, thr_image, classes, thresholds, rng, sample=True):
+    seg_width, seg_height = segwh
+    h, w = label.shape
+    if seg_width > w or seg_height > h:
+        print("Segment size is larger than the image: cannot proceed")
+        return []
+
+    if isinstance(label, np.ndarray):
+        rects, road, fractions = seg_class_fractions(label, segwh, classes)
+    else:
+        rects, road, fractions = label.seg_class_fractions(segwh, classes)
+    defect = fractions.sum(axis=1)
+
+    multi = fractions >= thresholds
+    best = np.where(multi.any(axis=1), np.argmax(np.where(multi, fractions, -1.0), axis=1), -1)
+
+    keep = np.nonzero(road >= thr_image)[0]
+    pos = keep[best[keep] >= 0]
+    neg = keep[best[keep] < 0]
+    if sample:
+        neg = [neg[rng.choice(range(len(neg)))] for k in range(len(pos))]
+
+    selected = []
+    counters = {}
+    for i in list(pos) + list(neg):
+        name = classes[best[i]][1] if best[i] >= 0 else NO_DEFECT
+        k = counters.get(name, 0)
+        counters[name] = k + 1
+        selected.append((name, k, tuple(int(v) for v in rects[i]), float(road[i]), float(defect[i]), multi[i]))
+    return selected
+
+
+# Return value of process_frame() in the multiclass mode for the segments from select_class_segments():
+# the segments are written as PNG files into folder or returned, along with their multi-hot vectors
+def class_segments_output(name, img, selected, output, folder):
+    counts = tuple(sum(1 for sel in selected if sel[0] == label) for label in dataset_labels("multiclass"))
+    multi = [(seg, label, vec) for label, k, seg, road, defect, vec in selected]
+
+    if output == "index":
+        return counts, ([(seg, road, defect, label) for label, k, seg, road, defect, vec in selected], multi)
+
+    tiles = [(label, k, seg, img[seg[1]:seg[1] + seg[3], seg[0]:seg[0] + seg[2]])
+             for label, k, seg, road, defect, vec in selected]
+    if output == "shards":
+        return counts, (tiles, multi)
+
+    return counts, (write_png_tiles(folder, name, tiles), multi)
+
+
+# Percent of nonblack pixels in given rectangle
+def seg_get_nonblack_pixel_percentage(mask, ctuple):
+    x, y, w, h = ctuple
+    seg = mask[y:y + h, x:x + w]
+    return cv2.countNonZero(seg) / (w * h)
+
+
+# List of segments (x, y, w, h) whose fraction of nonblack mask pixels is at least thr.
+# The summed-area table of the mask (see nonzero_sat) can be given instead of it
+def seg_preparse_image(mask, segwh, thr, sat=None):
+
+    seg_width, seg_height = segwh
+    if sat is None:
+        sat = nonzero_sat(mask)
+    h, w = sat.shape[0] - 1, sat.shape[1] - 1
+    if seg_width > w or seg_height > h:
+        print("Segment size is larger than the image: cannot proceed")
+        return
+
+    rects = seg_grid(h, w, segwh)
+    keep = seg_occupancy(mask, rects, sat) >= thr
+
+    return [tuple(int(v) for v in r) for r in rects[keep]]
+
+
+# Random generator for one frame. It is seeded from the frame name only, so the segments drawn for
+# a frame do not depend on the processing order or on the number of worker processes
+def frame_rng(name, seed=SEED):
+    return random.Random(zlib.crc32(name.encode("utf-8")) ^ seed)
+
+
+def _run_frame(job):
+    func, name = job
+    return os.getpid(), name, func(name)
+
+
+# Run func(name) for every frame name, in a pool of worker processes if workers > 1.
+# func must be a module level function (or a functools.partial of one) so it can be sent to the
+# workers, and returns a tuple of counts that is summed up per worker. Returns {pid: [frames, *counts]}
+# If collect is given, func returns (counts, payload) instead and collect(name, payload) is called in
+# this process, in the order of names
+def run_frames(func, names, workers=1, desc=None, collect=None):
+    per_worker = {}
+
+    def account(pid, name, res):
+        if collect is not None:
+            res, payload = res
+            collect(name, payload)
+        tot = per_worker.setdefault(pid, [0] + [0] * len(res))
+        tot[0] += 1
+        for i, v in enumerate(res):
+            tot[i + 1] += v
+
+    jobs = [(func, name) for name in names]
+    if workers > 1:
+        with Pool(workers) as pool:
+            # Collected output must not depend on the number of workers, so it is kept in order
+            results = pool.imap(_run_frame, jobs) if collect is not None else pool.imap_unordered(_run_frame, jobs)
+            for pid, name, res in tqdm(results, total=len(jobs), desc=desc):
+                account(pid, name, res)
+    else:
+        for job in tqdm(jobs, desc=desc):
+            pid, name, res = _run_frame(job)
+            account(pid, name, res)
+
+    return per_worker
+
+
+# Write segments as produced by process_frame(), (label, k, (x, y, w, h), tile), as PNG files
+# into the label folders. Returns the written files relative to folder
+def write_png_tiles(folder, name, tiles):
+    files = []
+    for label, k, seg, tile in tiles:
+        files.append(label + os.sep + name + ("_%04d" % k) + ".png")
+        cv2.imwrite(folder + os.sep + files[-1], tile)
+    return files
+
+
+# Command line options shared by the dataset scripts
+def add_dataset_arguments(parser):
+    from datm_shards import SHARD_SIZE
+    from datm_tileindex import VAL_FRACTION
+
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--output", choices=["png", "shards", "index"], default="png",
+                        help="one PNG file per segment in a folder per label (default), shard files with "
+                             "an index (see datm_shards.py) or only an index of all segments (see datm_tileindex.py)")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="segments per shard file")
+    parser.add_argument("--val-fraction", type=float, default=VAL_FRACTION,
+                        help="fraction of frames in the validation split for --output index")
+    parser.add_argument("--labels", choices=["binary", "multiclass"], default="binary",
+                        help="defect_0/defect_1 by THR_DEFECT, counting every nonzero defect class as a defect "
+                             "(default), or the defect classes of defs/color_defs.csv and " + NO_DEFECT)
+    parser.add_argument("--class-thr", nargs="+", default=None, metavar="THR",
+                        help="multiclass thresholds: a fraction for all classes and/or CODE=THR or NAME=THR "
+                             "for single classes (default: THR_DEFECT)")
+    add_manifest_arguments(parser)
+
+
+# Options for the incremental rebuilds (see datm_manifest.py)
+def add_manifest_arguments(parser):
+    parser.add_argument("--clean", action="store_true",
+                        help="rebuild the output folder from scratch instead of updating changed frames only")
+    parser.add_argument("--hash", action="store_true",
+                        help="also compare input files by their MD5 hash, not only by modification time and size")
+
+
+# Labels of the segments in the order of the counts returned by process_frame()
+def dataset_labels(labels):
+    if labels == "multiclass":
+        return [name for code, name in read_class_defs()] + [NO_DEFECT]
+    return ["defect_1", "defect_0"]
+
+
+# Run func (a process_frame() of the dataset scripts) for the frames and write the results into folder
+# according to the options of add_dataset_arguments(). func returns (counts, (items, multi-hot rows)),
+# where items are the written PNG files, the segments or the index rows for the respective --output.
+#
+# The folder is updated incrementally: frames whose inputs (frame_inputs(name) gives their paths) and
+# params are unchanged since the last run are skipped, outputs of changed and removed frames are deleted.
+# Shards are always rebuilt from scratch.
+def write_dataset(func, frames, args, folder, params, frame_inputs):
+    from datm_shards import TileShardWriter
+    from datm_tileindex import TILE_INDEX, MULTILABELS, TileIndexWriter, MultiLabelWriter
+    from datm_manifest import DatasetManifest, input_signature
+
+    labels = dataset_labels(args.labels)
+    params = dict(params, output=args.output, labels=args.labels, val_fraction=args.val_fraction,
+                  shard_size=args.shard_size)
+    manifest = DatasetManifest(folder, params, args.hash)
+
+    if args.clean or args.output == "shards" or not manifest.matches():
+        print("Building " + folder + " from scratch")
+        manifest.reset()
+    if args.output == "png":
+        for label in labels:
+            os.makedirs(folder + os.sep + label, exist_ok=True)
+
+    # Frames to (re)process, and stale output to get rid of
+    signatures = {name: input_signature(frame_inputs(name), args.hash) for name in frames}
+    todo = [name for name in frames if not manifest.is_current(name, signatures[name])]
+    todo_set = set(todo)
+    stale = [name for name in manifest.frames() if name not in signatures or name in todo_set]
+    for name in stale:
+        manifest.remove(name)
+    print(str(len(frames) - len(todo)) + " frames up to date, " + str(len(todo)) + " to process, "
+          + str(len([name for name in stale if name not in signatures])) + " removed")
+
+    shards = TileShardWriter(folder, args.shard_size) if args.output == "shards" else None
+
+    def collect(name, payload):
+        items, multi = payload
+        if shards is not None:
+            shards.add_frame(name, items)
+            items = []
+        outputs = items if args.output == "png" else []
+        rows = items if args.output == "index" else None
+        if multi is not None:
+            multi = [(seg, label, [int(v) for v in vec]) for seg, label, vec in multi]
+        manifest.record(name, signatures[name], outputs, rows=rows, multilabels=multi)
+
+    try:
+        per_worker = run_frames(func, todo, args.workers, collect=collect)
+    finally:
+        if shards is not None:
+            shards.close()
+
+    # The index files cover all frames, so they are put together from the manifest
+    if shards is not None:
+        print(str(shards.num_tiles) + " segments written into " + str(shards.num_shards) + " shards")
+    if args.output == "index":
+        with TileIndexWriter(folder, args.val_fraction) as index:
+            for name in frames:
+                index.add_frame(name, manifest.entry(name)["rows"])
+        print(str(index.num_tiles) + " segments listed in " + folder + os.sep + TILE_INDEX)
+    if args.labels == "multiclass":
+        with MultiLabelWriter(folder, read_class_defs()) as multilabels:
+            for name in frames:
+                multilabels.add_frame(name, manifest.entry(name)["multilabels"])
+        print("Class vectors of " + str(multilabels.num_tiles) + " segments written into "
+              + folder + os.sep + MULTILABELS)
+    print_worker_summary(per_worker, [label + " segments" for label in labels])
+
+
+# Print the per worker totals returned by run_frames()
+def print_worker_summary(per_worker, count_names):
+    for n, pid in enumerate(sorted(per_worker)):
+        tot = per_worker[pid]
+        print("Worker " + str(n + 1) + " (pid " + str(pid) + "): " + str(tot[0]) + " frames, "
+              + ", ".join(str(v) + " " + cn for v, cn in zip(tot[1:], count_names)))
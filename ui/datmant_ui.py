@@ -244,6 +244,17 @@ class Ui_DATMantMainWindow(object):
         self.actionLog = QtWidgets.QAction(DATMantMainWindow)
         self.actionLog.setCheckable(True)
         self.actionLog.setObjectName("actionLog")
+        self.actionLog_to_file = QtWidgets.QAction(DATMantMainWindow)
+        self.actionLog_to_file.setCheckable(True)
+        self.actionLog_to_file.setObjectName("actionLog_to_file")
+        self.actionPerformance_tracing = QtWidgets.QAction(DATMantMainWindow)
+        self.actionPerformance_tracing.setCheckable(True)
+        self.actionPerformance_tracing.setObjectName("actionPerformance_tracing")
+        self.actionExport_performance_trace = QtWidgets.QAction(DATMantMainWindow)
+        self.actionExport_performance_trace.setObjectName("actionExport_performance_trace")
+        self.actionRecord_input_session = QtWidgets.QAction(DATMantMainWindow)
+        self.actionRecord_input_session.setCheckable(True)
+        self.actionRecord_input_session.setObjectName("actionRecord_input_session")
         self.actionRefresh_data_file = QtWidgets.QAction(DATMantMainWindow)
         self.actionRefresh_data_file.setObjectName("actionRefresh_data_file")
         self.actionRefresh_predictor = QtWidgets.QAction(DATMantMainWindow)
@@ -263,15 +274,30 @@ class Ui_DATMantMainWindow(object):
         self.actionProcess_original_mask.setObjectName("actionProcess_original_mask")
         self.actionAIMask = QtWidgets.QAction(DATMantMainWindow)
         self.actionAIMask.setObjectName("actionAIMask")
+        self.actionPredict_defects = QtWidgets.QAction(DATMantMainWindow)
+        self.actionPredict_defects.setCheckable(True)
+        self.actionPredict_defects.setObjectName("actionPredict_defects")
         self.actionColor_definitions = QtWidgets.QAction(DATMantMainWindow)
         self.actionColor_definitions.setObjectName("actionColor_definitions")
+        self.actionAnnotation_statistics = QtWidgets.QAction(DATMantMainWindow)
+        self.actionAnnotation_statistics.setObjectName("actionAnnotation_statistics")
+        self.actionMemory_usage = QtWidgets.QAction(DATMantMainWindow)
+        self.actionMemory_usage.setObjectName("actionMemory_usage")
         self.menuFile.addAction(self.actionSave_current_annotations)
         self.menuFile.addAction(self.actionReload_original_mask)
         self.menuView.addSeparator()
         self.menuView.addAction(self.actionColor_definitions)
+        self.menuView.addAction(self.actionAnnotation_statistics)
+        self.menuView.addAction(self.actionMemory_usage)
         self.menuView.addAction(self.actionLog)
+        self.menuView.addAction(self.actionLog_to_file)
+        self.menuView.addSeparator()
+        self.menuView.addAction(self.actionPerformance_tracing)
+        self.menuView.addAction(self.actionExport_performance_trace)
+        self.menuView.addAction(self.actionRecord_input_session)
         self.menuEdit.addAction(self.actionProcess_original_mask)
         self.menuEdit.addAction(self.actionAIMask)
+        self.menuEdit.addAction(self.actionPredict_defects)
         self.menubar.addAction(self.menuFile.menuAction())
         self.menubar.addAction(self.menuEdit.menuAction())
         self.menubar.addAction(self.menuView.menuAction())
@@ -304,6 +330,10 @@ class Ui_DATMantMainWindow(object):
         self.menuView.setTitle(_translate("DATMantMainWindow", "View"))
         self.menuEdit.setTitle(_translate("DATMantMainWindow", "Edit"))
         self.actionLog.setText(_translate("DATMantMainWindow", "Log"))
+        self.actionLog_to_file.setText(_translate("DATMantMainWindow", "Log to file"))
+        self.actionPerformance_tracing.setText(_translate("DATMantMainWindow", "Performance tracing"))
+        self.actionExport_performance_trace.setText(_translate("DATMantMainWindow", "Export performance trace..."))
+        self.actionRecord_input_session.setText(_translate("DATMantMainWindow", "Record input session..."))
         self.actionRefresh_data_file.setText(_translate("DATMantMainWindow", "Refresh data file"))
         self.actionRefresh_predictor.setText(_translate("DATMantMainWindow", "Refresh predictor"))
         self.actionSave_current_annotations.setText(_translate("DATMantMainWindow", "Save current annotations"))
@@ -311,5 +341,8 @@ class Ui_DATMantMainWindow(object):
         self.actionReload_original_mask.setText(_translate("DATMantMainWindow", "Reload original mask"))
         self.actionProcess_original_mask.setText(_translate("DATMantMainWindow", "Process original mask"))
         self.actionAIMask.setText(_translate("DATMantMainWindow", "Reload AUTO defect mask"))
+        self.actionPredict_defects.setText(_translate("DATMantMainWindow", "Predict defects in background"))
         self.actionColor_definitions.setText(_translate("DATMantMainWindow", "Color specifications"))
+        self.actionAnnotation_statistics.setText(_translate("DATMantMainWindow", "Annotation statistics"))
+        self.actionMemory_usage.setText(_translate("DATMantMainWindow", "Memory usage"))
 
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# Form implementation generated from reading ui file 'ui\summary_table.ui'
+#
+# Created by: PyQt5 UI code generator 5.9.2
+#
+# WARNING! All changes made in this file will be lost!
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+class Ui_SummaryTableUI(object):
+    def setupUi(self, SummaryTableUI):
+        SummaryTableUI.setObjectName("SummaryTableUI")
+        SummaryTableUI.resize(640, 400)
+        self.centralwidget = QtWidgets.QWidget(SummaryTableUI)
+        self.centralwidget.setObjectName("centralwidget")
+        self.verticalLayout = QtWidgets.QVBoxLayout(self.centralwidget)
+        self.verticalLayout.setObjectName("verticalLayout")
+        self.lblSummary = QtWidgets.QLabel(self.centralwidget)
+        self.lblSummary.setText("")
+        self.lblSummary.setWordWrap(True)
+        self.lblSummary.setObjectName("lblSummary")
+        self.verticalLayout.addWidget(self.lblSummary)
+        self.tabSummary = QtWidgets.QTableWidget(self.centralwidget)
+        self.tabSummary.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.tabSummary.setObjectName("tabSummary")
+        self.tabSummary.setColumnCount(0)
+        self.tabSummary.setRowCount(0)
+        self.tabSummary.setSortingEnabled(True)
+        self.verticalLayout.addWidget(self.tabSummary)
+        SummaryTableUI.setCentralWidget(self.centralwidget)
+        self.menubar = QtWidgets.QMenuBar(SummaryTableUI)
+        self.menubar.setGeometry(QtCore.QRect(0, 0, 640, 21))
+        self.menubar.setObjectName("menubar")
+        SummaryTableUI.setMenuBar(self.menubar)
+        self.statusbar = QtWidgets.QStatusBar(SummaryTableUI)
+        self.statusbar.setObjectName("statusbar")
+        SummaryTableUI.setStatusBar(self.statusbar)
+
+        self.retranslateUi(SummaryTableUI)
+        QtCore.QMetaObject.connectSlotsByName(SummaryTableUI)
+
+    def retranslateUi(self, SummaryTableUI):
+        _translate = QtCore.QCoreApplication.translate
+        SummaryTableUI.setWindowTitle(_translate("SummaryTableUI", "Summary"))
+
@@ -1,11 +1,23 @@
 import os.path
-import cv2
 import numpy as np
 import collections
-from qimage2ndarray import rgb_view, alpha_view, array2qimage, byte_view
-from PyQt5.QtCore import Qt, QRectF, pyqtSignal, QT_VERSION_STR, QPoint
+# PyQt5 bundles sip as PyQt5.sip from 5.11 on; the pinned environment (PyQt 5.9) has it standalone
+try:
+    from PyQt5 import sip
+except ImportError:
+    import sip
+from PyQt5.QtCore import Qt, QRect, QRectF, pyqtSignal, QT_VERSION_STR, QPoint, QPointF, QLineF, QTimer
 from PyQt5.QtGui import QImage, QPixmap, QPainterPath, QPainter, QColor, QPen
-from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene, QFileDialog, QApplication
+from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsItem, QFileDialog, QApplication
+from ui_lib.QtInputRecorder import (QtInputRecorder, EVENT_MOUSE_PRESS, EVENT_MOUSE_RELEASE, EVENT_MOUSE_MOVE,
+                                    EVENT_MOUSE_DOUBLE_CLICK, EVENT_KEY_PRESS, EVENT_KEY_RELEASE)
+
+# Timing spans are provided by the DATM tool; when the component is used on its own, they are no-ops
+try:
+    from lib.tracing import traced
+except ImportError:
+    def traced(name=None):
+        return lambda func: func
 
 __author__ = "Aleksei Tepljakov <alex@starspirals.net>"
 __title__ = "QTImageAnnotator"
@@ -30,6 +42,212 @@ MAX_CTRLZ_STATES = 20
 # For now, we stick to this solution.
 PIXMAP_CONV_BUG_ATOL = 2
 
+# QImage formats of uint8 arrays by number of channels, see ndarray_qimage()
+NDARRAY_QIMAGE_FORMATS = {1: QImage.Format_Grayscale8, 3: QImage.Format_RGB888, 4: QImage.Format_RGBA8888}
+
+
+# QImage sharing the memory of a C-contiguous uint8 array: (h, w) grayscale, (h, w, 3) RGB or (h, w, 4) RGBA.
+# Nothing is copied. Qt does not own the memory, so the returned QImage object keeps a reference to the
+# array (as its _array attribute): the memory is valid for as long as that object is, but not in copies of
+# it made on the C++ side, e.g. when it is passed by value to Qt. QPixmap.fromImage() makes a copy of the
+# pixels, so an image that is only turned into a pixmap need not be kept any longer than that. fmt
+# overrides the format, e.g. for (h, w, 4) arrays viewing an ARGB32 image
+def ndarray_qimage(arr, fmt=None):
+    channels = 1 if arr.ndim == 2 else arr.shape[2]
+    if arr.dtype != np.uint8 or arr.ndim not in (2, 3) or channels not in NDARRAY_QIMAGE_FORMATS:
+        raise ValueError("ndarray_qimage: expected a uint8 array of shape (h, w), (h, w, 3) or (h, w, 4).")
+    if not arr.flags.c_contiguous:
+        raise ValueError("ndarray_qimage: the array must be C-contiguous.")
+    h, w = arr.shape[:2]
+    img = QImage(sip.voidptr(arr.ctypes.data), w, h, arr.strides[0],
+                 NDARRAY_QIMAGE_FORMATS[channels] if fmt is None else fmt)
+    img._array = arr
+    return img
+
+
+# Format_Mono QImage of a 1-bit mask packed most significant bit first, in rows of bits.strides[0] bytes
+# that are a multiple of 4 (see lib/packedmask.py), drawn with colors[0] for the 0 bits and colors[1] for
+# the 1 bits. As with ndarray_qimage(), the memory is shared and the returned object keeps the array alive
+def bitmask_qimage(bits, width, colors):
+    if bits.dtype != np.uint8 or bits.ndim != 2 or not bits.flags.c_contiguous or bits.strides[0] % 4 or \
+            bits.shape[1] * 8 < width:
+        raise ValueError("bitmask_qimage: expected C-contiguous uint8 rows of packed bits padded to 32 bits.")
+    img = QImage(sip.voidptr(bits.ctypes.data), width, bits.shape[0], bits.strides[0], QImage.Format_Mono)
+    img.setColorTable([c.rgba() for c in colors])
+    img._array = bits
+    return img
+
+
+# Bytes taken by the pixels of a QImage or QPixmap
+def pixmap_bytes(pixmap):
+    if pixmap is None or pixmap.isNull():
+        return 0
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+# Read-only (h, w, 4) array viewing a 32-bit QImage. Unlike the qimage2ndarray views, it does not detach
+# (copy) an image that shares its memory with a pixmap, such as one from QPixmap.toImage()
+def const_view(img):
+    ptr = img.constBits()
+    ptr.setsize(img.bytesPerLine() * img.height())
+    rows = np.frombuffer(ptr, np.uint8).reshape(img.height(), img.bytesPerLine())
+    return rows[:, :4 * img.width()].reshape(img.height(), img.width(), 4)
+
+
+# Layer argument (QImage, QPixmap or uint8 array) as a QPixmap
+def layer_pixmap(layer):
+    if isinstance(layer, np.ndarray):
+        # The image (and with it a contiguous copy of a strided array) must outlive fromImage()
+        img = ndarray_qimage(np.ascontiguousarray(layer))
+        return QPixmap.fromImage(img)
+    if type(layer) is QPixmap:
+        return layer
+    if type(layer) is QImage:
+        return QPixmap.fromImage(layer)
+    raise RuntimeError("QtImageAnnotator: layers must be given as a QImage, QPixmap or numpy array.")
+
+
+# Read-only version of an array view, for exports that callers only read
+def read_only(arr):
+    arr.flags.writeable = False
+    return arr
+
+
+# Display refresh rate assumed when the screen does not report one, in Hz
+DEFAULT_REFRESH_RATE = 60.0
+
+
+# Mip levels are not made smaller than this along the longer side, in pixels
+MIP_MIN_SIZE = 256
+
+
+# Mip pyramid of a pixmap, for drawing it zoomed out: level k is the pixmap downscaled 2^k times by pixel
+# area averaging. Scaling a large pixmap down while drawing samples all of it on every repaint, and
+# aliases. The levels are made from the pixmap when first drawn, so only the zoom levels actually used
+# take memory. Parts of the pixmap changed afterwards are marked with update() and only those are
+# downscaled again, the next time a level is drawn
+class MipPixmap:
+
+    def __init__(self, pixmap):
+        self._pixmap = pixmap
+        self._levels = {}  # Level -> (array, QImage sharing its memory)
+        self._dirty = {}  # Level -> QRect of the pixmap changed since the level was last drawn
+        self.max_level = 0
+        while max(pixmap.width(), pixmap.height()) >> (self.max_level + 1) >= MIP_MIN_SIZE:
+            self.max_level += 1
+
+    def pixmap(self):
+        return self._pixmap
+
+    # Replace the pixmap by one of the same size that differs from it only within changed (a QRect)
+    def replace(self, pixmap, changed):
+        self._pixmap = pixmap
+        self.update(changed)
+
+    # Mark a part (QRect or QRectF in pixmap coordinates) of the pixmap as changed
+    def update(self, rect):
+        rect = rect.toAlignedRect() if isinstance(rect, QRectF) else rect
+        for k in self._dirty:
+            self._dirty[k] = self._dirty[k].united(rect)
+
+    # Level to draw at a scale (device pixels per pixmap pixel): the smallest one not scaled up
+    def levelFor(self, scale):
+        if scale > 0.5 or scale <= 0:
+            return 0
+        return min(int(np.floor(-np.log2(scale))), self.max_level)
+
+    # Level k > 0 as a QImage. It shares the memory of the pyramid and is only valid as long as the level
+    # is kept, i.e. while the pyramid is
+    def level(self, k):
+        if k not in self._levels:
+            arr, fmt = self._downscale(self._pixmap.rect(), k)
+            self._levels[k] = arr, ndarray_qimage(arr, fmt)
+            self._dirty[k] = QRect()
+        elif not self._dirty[k].isEmpty():
+            # Redo the changed area, widened to whole pixels of the level
+            f = 1 << k
+            d = self._dirty[k]
+            x0, y0 = (d.left() // f) * f, (d.top() // f) * f
+            x1, y1 = -(-(d.right() + 1) // f) * f, -(-(d.bottom() + 1) // f) * f
+            rect = QRect(x0, y0, x1 - x0, y1 - y0).intersected(self._pixmap.rect())
+            if not rect.isEmpty():
+                part, _ = self._downscale(rect, k)
+                self._levels[k][0][y0 // f:y0 // f + part.shape[0], x0 // f:x0 // f + part.shape[1]] = part
+            self._dirty[k] = QRect()
+        return self._levels[k][1]
+
+    # Part of the pixmap downscaled 2^k times, halving it k times by averaging 2 x 2 pixels: (array, QImage
+    # format). The part is extended to whole blocks of 2^k x 2^k pixels by repeating its last row and column,
+    # so that the result is the same whether the whole pixmap is downscaled or a part starting at a block
+    def _downscale(self, rect, k):
+        import cv2  # Not imported at startup
+        img = self._pixmap.toImage() if rect == self._pixmap.rect() else self._pixmap.copy(rect).toImage()
+        if img.depth() != 32:
+            img = img.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        f = 1 << k
+        arr = const_view(img)
+        h, w = arr.shape[:2]
+        if h % f or w % f:
+            arr = cv2.copyMakeBorder(arr, 0, -h % f, 0, -w % f, cv2.BORDER_REPLICATE)
+        for _ in range(k):
+            arr = cv2.resize(arr, (arr.shape[1] // 2, arr.shape[0] // 2), interpolation=cv2.INTER_AREA)
+        return arr, img.format()
+
+    # Bytes taken by the levels made so far
+    def nbytes(self):
+        return sum(arr.nbytes for arr, img in self._levels.values())
+
+    # Draw the pixmap at (0, 0) with the level matching the scale of the painter
+    def draw(self, painter):
+        k = self.levelFor(abs(painter.deviceTransform().m11()))
+        if k == 0:
+            painter.drawPixmap(QPointF(0, 0), self._pixmap)
+        else:
+            # The level is padded to whole blocks of 2^k pixels, so only the part covering the pixmap is drawn
+            level, f = self.level(k), 1 << k
+            w, h = self._pixmap.width(), self._pixmap.height()
+            painter.drawImage(QRectF(0, 0, w, h), level, QRectF(0, 0, w / f, h / f))
+
+
+# Scene item drawing the very pixmap object it is given, through its mip pyramid. A QGraphicsPixmapItem
+# keeps a shared copy instead, so that every QPainter opened on the original afterwards has to detach
+# (copy) the whole pixmap first
+class LivePixmapItem(QGraphicsItem):
+
+    def __init__(self, pixmap):
+        QGraphicsItem.__init__(self)
+        self._mip = MipPixmap(pixmap)
+
+    def pixmap(self):
+        return self._mip.pixmap()
+
+    # Set the pixmap. If it only differs from the current one within changed (a QRect), the mip
+    # levels made so far are kept and only that part of them is redone
+    def setPixmap(self, pixmap, changed=None):
+        if pixmap.size() != self.pixmap().size():
+            self.prepareGeometryChange()
+        if changed is not None and pixmap.size() == self.pixmap().size():
+            self._mip.replace(pixmap, changed)
+        else:
+            self._mip = MipPixmap(pixmap)
+        self.update()
+
+    # Bytes taken by the mip levels of the pixmap made so far
+    def mipBytes(self):
+        return self._mip.nbytes()
+
+    # The pixmap has been painted on within rect (in pixmap coordinates)
+    def updatePixmapRect(self, rect):
+        self._mip.update(rect)
+        self.update(QRectF(rect))
+
+    def boundingRect(self):
+        return QRectF(self.pixmap().rect())
+
+    def paint(self, painter, option, widget=None):
+        self._mip.draw(painter)
+
+
 # Reusable component for painting over an image for, e.g., masking purposes
 class QtImageAnnotator(QGraphicsView):
 
@@ -53,16 +271,21 @@ class QtImageAnnotator(QGraphicsView):
         self.scene = QGraphicsScene()
         self.setScene(self.scene)
 
+        # The image is drawn as the background of the view (see drawBackground), which is cached in viewport
+        # resolution, and the brush cursor over everything else (see drawForeground). Moving the cursor or
+        # panning then only redraws the layers above the image, and only where the cursor was and is
+        self.setCacheMode(QGraphicsView.CacheBackground)
+
         # Shape of the loaded image (height, width)
         self.shape = (None, None)
 
-        # Store a local handle to the scene's current image pixmap.
-        self._pixmapHandle = None  # This holds the image
+        # Store a local handle to the current image pixmap and the scene's layers.
+        self._imageMip = None  # This holds the image (as a MipPixmap), drawn as the background of the view
         self._helperHandle = None # This holds the "helper" overlay which is not directly manipulated by the user
         self._auxHelper = None  # Aux helper for various purpuses
         self._overlayHandle = None  # This is the overlay over which we are painting
-        self._cursorHandle = None  # This is the cursor that appears to assist with brush size
-        self._deleteCrossHandles = None # For showing that we've activated delete mode
+        self._cursorVisible = True  # The cursor that appears to assist with brush size
+        self._deleteCrossVisible = False  # For showing that we've activated delete mode
 
         # Helper display state
         self.showHelper = True
@@ -71,8 +294,10 @@ class QtImageAnnotator(QGraphicsView):
 
         self._overlay_stack = collections.deque(maxlen=MAX_CTRLZ_STATES)
 
-        # Offscreen mask, used to speed things up (but has an impact on painting speed)
+        # Offscreen mask, used to speed things up (but has an impact on painting speed). The QImage is
+        # painted on directly and shares the memory of _offscreen_array, which owns it (see ndarray_qimage)
         self._offscreen_mask = None
+        self._offscreen_array = None
         self._offscreen_mask_stack = collections.deque(maxlen=MAX_CTRLZ_STATES)
 
         # Needed for proper drawing
@@ -85,6 +310,14 @@ class QtImageAnnotator(QGraphicsView):
         # Pixmap that contains the mask and the corresponding painter
         self.mask_pixmap = None
 
+        # Brush stroke in progress: scene points waiting to be drawn, which are drawn together at most once
+        # per display refresh (see flushStroke), and the painters kept open on the masks until the stroke ends
+        self._stroke_points = []
+        self._stroke_painters = None
+        self._stroke_timer = QTimer(self)
+        self._stroke_timer.setSingleShot(True)
+        self._stroke_timer.timeout.connect(self.flushStroke)
+
         # Parameters of the brush and paint
         self.brush_diameter = 50
         self.MIN_BRUSH_DIAMETER = 1
@@ -131,34 +364,89 @@ class QtImageAnnotator(QGraphicsView):
         self.canZoom = True
         self.canPan = True
 
+        # Optional input recorder, see startRecording()
+        self.input_recorder = None
+
+    # Start recording mouse, wheel and key events (with scene coordinates) for later replay.
+    # The recording is written to path (if given) by stopRecording().
+    def startRecording(self, path=None, metadata=None):
+        self.input_recorder = QtInputRecorder(path)
+        if metadata:
+            self.input_recorder.metadata.update(metadata)
+        self.input_recorder.metadata["viewport"] = [self.viewport().width(), self.viewport().height()]
+        self.input_recorder.metadata["zoom_stack"] = [[r.x(), r.y(), r.width(), r.height()] for r in self.zoomStack]
+        if self.hasImage():
+            self.input_recorder.record_frame(self.shape)
+        return self.input_recorder
+
+    # Stop recording; returns the recorder and saves the recording if it has a path
+    def stopRecording(self):
+        recorder = self.input_recorder
+        self.input_recorder = None
+        if recorder is not None and recorder.path:
+            recorder.save()
+        return recorder
+
     def hasImage(self):
         """ Returns whether or not the scene contains an image pixmap.
         """
-        return self._pixmapHandle is not None
+        return self._imageMip is not None
 
-    # def paintEvent(self, event):
-    #     painter = QPainter(self)
-    #
-    #     if self._pixmapHandle is not None:
-    #         painter.drawPixmap(self.rect(), self._pixmapHandle)
-    #     if self._overlayHandle is not None:
-    #         print("This isn't implemented yet")
-    #     if self._cursorHandle is not None:
-    #         painter.drawEllipse(self.rect(), self._cursorHandle)
+    # Set the image pixmap (or None) drawn as the background, dropping the cached background
+    def _setImagePixmap(self, pixmap):
+        self._imageMip = MipPixmap(pixmap) if pixmap is not None else None
+        self.resetCachedContent()
+        self.viewport().update()
+
+    def drawBackground(self, painter, rect):
+        QGraphicsView.drawBackground(self, painter, rect)
+        if self._imageMip is not None:
+            self._imageMip.draw(painter)
+
+    def drawForeground(self, painter, rect):
+        if not self.hasImage() or not self._cursorVisible or self._lastCursorCoords is None:
+            return
+        x, y = self._lastCursorCoords
+        r = self.brush_diameter / 2
+        painter.setPen(QPen())
+        painter.setBrush(Qt.NoBrush)
+        painter.drawEllipse(QRectF(x - r, y - r, 2 * r, 2 * r))
+        if self._deleteCrossVisible:
+            c = self.brush_diameter / (2 * np.sqrt(2))
+            painter.drawLine(QLineF(x - c, y - c, x + c, y + c))
+            painter.drawLine(QLineF(x - c, y + c, x + c, y - c))
+
+    # Schedule a repaint of the part of the viewport the cursor is drawn on
+    def _updateCursorArea(self):
+        if self._lastCursorCoords is None:
+            return
+        x, y = self._lastCursorCoords
+        r = self.brush_diameter / 2 + 1  # Including the pen
+        rect = self.mapFromScene(QRectF(x - r, y - r, 2 * r, 2 * r)).boundingRect()
+        self.viewport().update(rect.adjusted(-2, -2, 2, 2))
+
+    def setCursorVisible(self, visible):
+        if visible != self._cursorVisible:
+            self._cursorVisible = visible
+            self._updateCursorArea()
+
+    def setDeleteCrossVisible(self, visible):
+        if visible != self._deleteCrossVisible:
+            self._deleteCrossVisible = visible
+            self._updateCursorArea()
 
     def clearImage(self):
-        """ Removes the current image pixmap from the scene if it exists.
+        """ Removes the current image pixmap if it exists.
         """
         if self.hasImage():
-            self.scene.removeItem(self._pixmapHandle)
-            self._pixmapHandle = None
+            self._setImagePixmap(None)
 
     def pixmap(self):
         """ Returns the scene's current image pixmap as a QPixmap, or else None if no image exists.
         :rtype: QPixmap | None
         """
         if self.hasImage():
-            return self._pixmapHandle.pixmap()
+            return self._imageMip.pixmap()
         return None
 
     def image(self):
@@ -166,12 +454,19 @@ class QtImageAnnotator(QGraphicsView):
         :rtype: QImage | None
         """
         if self.hasImage():
-            return self._pixmapHandle.pixmap().toImage()
+            return self._imageMip.pixmap().toImage()
         return None
 
+    # Set the offscreen mask to a (h, w) uint8 array, which the annotator then owns and paints on
+    def _setOffscreenMask(self, arr):
+        self._offscreen_array = arr
+        self._offscreen_mask = ndarray_qimage(arr)
+
     # Configure the annotator with data.
     # NB! Breaking change. Both IMAGE and MASK arguments from version 1.0b are
     # **assumed** to be numpy arrays!
+    # IMAGE, HELPER and AUX_HELPER can be given as QImage, QPixmap or numpy arrays; arrays are converted
+    # to pixmaps without intermediate copies. The MASK array is not modified, the annotator paints on a copy
     #
     # Named arguments:
     # helper = additional layer which helps with the annotation process, its display can be toggled
@@ -180,8 +475,11 @@ class QtImageAnnotator(QGraphicsView):
     # direct_mask_paint = to speed up multicolor mask export, it may be beneficial to draw directly
     #   on a hidden mask. Then, exporting it is super fast compared to converting the RGB mask to
     #   a grayscale one.
+    @traced("clearAndSetImageAndMask")
     def clearAndSetImageAndMask(self, image, mask, helper=None, aux_helper=None,
                                 process_gray2rgb=False, direct_mask_paint=False):
+        self.endStroke()
+
         # Clear the scene
         self.scene.clear()
 
@@ -189,7 +487,6 @@ class QtImageAnnotator(QGraphicsView):
         self.direct_mask_paint = direct_mask_paint
 
         # Clear handles
-        self._pixmapHandle = None
         self._helperHandle = None
         self._auxHelper = None
         self._overlayHandle = None
@@ -197,101 +494,67 @@ class QtImageAnnotator(QGraphicsView):
         # Clear UNDO stack
         self._overlay_stack = collections.deque(maxlen=MAX_CTRLZ_STATES)
 
-        # For compatibility, convert IMAGE to QImage, if needed
-        if type(image) is np.array:
-            image = array2qimage(image)
-
         # First we just set the image
-        if type(image) is QPixmap:
-            pixmap = image
-        elif type(image) is QImage:
-            pixmap = QPixmap.fromImage(image)
-        else:
-            raise RuntimeError("QtImageAnnotator.clearAndSetImageAndMask: Argument must be a QImage or QPixmap.")
+        pixmap = layer_pixmap(image)
 
         self.shape = pixmap.height(), pixmap.width()
 
-        self._pixmapHandle = self.scene.addPixmap(pixmap)
+        self._setImagePixmap(pixmap)
         self.setSceneRect(QRectF(pixmap.rect()))
 
         # Off-screen mask for direct drawing
         if direct_mask_paint:
-            # We need to convert the offscreen mask to QImage at this point
-            gray_mask = QImage(mask.data, mask.shape[1], mask.shape[0], mask.strides[0], QImage.Format_Grayscale8)
-            self._offscreen_mask = gray_mask.copy()
-            self._offscreen_mask_stack = collections.deque(maxlen=MAX_CTRLZ_STATES)
+            # Our own copy of the mask, painted on through the QImage sharing its memory
+            self._setOffscreenMask(np.array(mask, np.uint8, order="C"))
+        else:
+            self._offscreen_mask = None
+            self._offscreen_array = None
+        self._offscreen_mask_stack = collections.deque(maxlen=MAX_CTRLZ_STATES)
 
         # Now we add the helper, if present
-        if type(helper) is np.array:
-            helper = array2qimage(helper)
-
         if helper is not None:
-            if type(helper) is QPixmap:
-                pixmap = helper
-            elif type(helper) is QImage:
-                pixmap = QPixmap.fromImage(helper)
-            else:
-                raise RuntimeError("QtImageAnnotator.clearAndSetImageAndMask: Argument must be a QImage or QPixmap.")
-
-            # Add the helper layer
-            self._helperHandle = self.scene.addPixmap(pixmap)
-
-        if type(aux_helper) is np.array:
-            aux_helper = array2qimage(aux_helper)
+            self._helperHandle = LivePixmapItem(layer_pixmap(helper))
+            self.scene.addItem(self._helperHandle)
 
+        # Add the aux helper layer
         if aux_helper is not None:
-            if type(aux_helper) is QPixmap:
-                pixmap = aux_helper
-            elif type(aux_helper) is QImage:
-                pixmap = QPixmap.fromImage(aux_helper)
-            else:
-                raise RuntimeError("QtImageAnnotator.clearAndSetImageAndMask: Argument must be a QImage or QPixmap.")
-
-            # Add the aux helper layer
-            self._auxHelper = self.scene.addPixmap(pixmap)
+            self._auxHelper = LivePixmapItem(layer_pixmap(aux_helper))
+            self.scene.addItem(self._auxHelper)
 
         # If we are supplied a grayscale mask that we need to convert to RGB, we will do it here
         if process_gray2rgb:
             if self.d_gray2rgb:
                 # We assume mask is np array, grayscale and the conversion rules are set (otherwise cannot continue)
-                h, w = mask.shape
-                new_mask = np.zeros((h, w, 4), np.uint8)
+                # The RGBA overlay is looked up for all the grayscale values at once
+                lut = np.zeros((256, 4), np.uint8)
                 for gr, rgb in self.d_gray2rgb.items():
-                    col = QColor("#63" + rgb.split("#")[1]).getRgb()  # TODO: not elegant, need external function
-                    new_mask[mask == gr] = col
-                use_mask = array2qimage(new_mask)
+                    lut[gr] = QColor("#63" + rgb.split("#")[1]).getRgb()  # TODO: not elegant, need external function
+                pixmap = layer_pixmap(lut[mask])
             else:
                 raise RuntimeError("Cannot convert the provided grayscale mask to RGB without color specifications.")
         else:
-            use_mask = array2qimage(mask)
-
-        pixmap = QPixmap.fromImage(use_mask)
+            pixmap = layer_pixmap(mask)
 
         self.mask_pixmap = pixmap
-        self._overlayHandle = self.scene.addPixmap(self.mask_pixmap)
+        self._overlayHandle = LivePixmapItem(self.mask_pixmap)
+        self.scene.addItem(self._overlayHandle)
 
-        # Add brush cursor to top layer
-        self._cursorHandle = self.scene.addEllipse(0, 0, self.brush_diameter, self.brush_diameter)
-
-        # Add also X to the cursor for "delete" operation, and hide it by default only showing it when the
-        # either the global drawing mode is set to ERASE or when CTRL is held while drawing
-        self._deleteCrossHandles = (self.scene.addLine(0, 0, self.brush_diameter, self.brush_diameter),
-                                    self.scene.addLine(0, self.brush_diameter, self.brush_diameter, 0))
-
-        if self.current_painting_mode is not self.MODE_ERASE:
-            self._deleteCrossHandles[0].hide()
-            self._deleteCrossHandles[1].hide()
+        # The brush cursor is drawn on top (see drawForeground), with an X for the "delete" operation that is
+        # only shown when either the global drawing mode is set to ERASE or when CTRL is held while drawing
+        self._cursorVisible = True
+        self._deleteCrossVisible = self.current_painting_mode == self.MODE_ERASE
 
         self.updateViewer()
 
+        if self.input_recorder is not None:
+            self.input_recorder.record_frame(self.shape)
+
     # Clear everything
     def clearAll(self):
+        self.endStroke()
 
         self.shape = (None, None)
 
-        if self._pixmapHandle is not None:
-            self.scene.removeItem(self._pixmapHandle)
-
         if self._helperHandle is not None:
             self.scene.removeItem(self._helperHandle)
 
@@ -301,13 +564,14 @@ class QtImageAnnotator(QGraphicsView):
         if self._overlayHandle is not None:
             self.scene.removeItem(self._overlayHandle)
 
-        self._pixmapHandle = None
+        self._setImagePixmap(None)
         self._helperHandle = None
         self._auxHelper = None
         self._overlayHandle = None
 
         if self.direct_mask_paint:
             self._offscreen_mask = None
+            self._offscreen_array = None
             self._offscreen_mask_stack = collections.deque(maxlen=MAX_CTRLZ_STATES)
 
         self._overlay_stack = collections.deque(maxlen=MAX_CTRLZ_STATES)
@@ -319,38 +583,22 @@ class QtImageAnnotator(QGraphicsView):
         Raises a RuntimeError if the input image has type other than QImage or QPixmap.
         :type image: QImage | QPixmap | numpy.array
         """
-        if type(image) is np.array:
-            image = array2qimage(image)
-
-        if type(image) is QPixmap:
-            pixmap = image
-        elif type(image) is QImage:
-            pixmap = QPixmap.fromImage(image)
-        else:
-            raise RuntimeError("ImageViewer.setImage: Argument must be a QImage or QPixmap.")
-        if self.hasImage():
-            self._pixmapHandle.setPixmap(pixmap)
-        else:
-            self._pixmapHandle = self.scene.addPixmap(pixmap)
+        self.endStroke()
+        pixmap = layer_pixmap(image)
+        self._setImagePixmap(pixmap)
 
         self.setSceneRect(QRectF(pixmap.rect()))  # Set scene size to image size.
 
         # Add the mask layer
         self.mask_pixmap = QPixmap(pixmap.rect().width(), pixmap.rect().height())
         self.mask_pixmap.fill(QColor(0,0,0,0))
-        self._overlayHandle = self.scene.addPixmap(self.mask_pixmap)
-
-        # Add brush cursor to top layer
-        self._cursorHandle = self.scene.addEllipse(0,0,self.brush_diameter,self.brush_diameter)
+        self._overlayHandle = LivePixmapItem(self.mask_pixmap)
+        self.scene.addItem(self._overlayHandle)
 
-        # Add also X to the cursor for "delete" operation, and hide it by default only showing it when the
-        # either the global drawing mode is set to ERASE or when CTRL is held while drawing
-        self._deleteCrossHandles = (self.scene.addLine(0, 0, self.brush_diameter, self.brush_diameter),
-                                    self.scene.addLine(0, self.brush_diameter, self.brush_diameter, 0))
-
-        if self.current_painting_mode is not self.MODE_ERASE:
-            self._deleteCrossHandles[0].hide()
-            self._deleteCrossHandles[1].hide()
+        # The brush cursor is drawn on top (see drawForeground), with an X for the "delete" operation that is
+        # only shown when either the global drawing mode is set to ERASE or when CTRL is held while drawing
+        self._cursorVisible = True
+        self._deleteCrossVisible = self.current_painting_mode == self.MODE_ERASE
 
         self.updateViewer()
 
@@ -385,6 +633,8 @@ class QtImageAnnotator(QGraphicsView):
         self.updateViewer()
 
     def update_brush_diameter(self, change):
+        self._updateCursorArea()
+
         val = self.brush_diameter
         val += change
         if val > self.MAX_BRUSH_DIAMETER:
@@ -394,64 +644,48 @@ class QtImageAnnotator(QGraphicsView):
             val = self.MIN_BRUSH_DIAMETER
 
         self.brush_diameter = val
-
-        if self._lastCursorCoords is not None:
-            x, y = self._lastCursorCoords
-        else:
-            x, y = 0, 0
-
-        if self._cursorHandle is not None:
-            self._cursorHandle.setPos(x - self.brush_diameter / 2, y - self.brush_diameter / 2)
-            self._cursorHandle.setRect(0, 0, self.brush_diameter, self.brush_diameter)
-
-        if self._deleteCrossHandles is not None:
-            self._deleteCrossHandles[0].setLine(x - self.brush_diameter / (2 * np.sqrt(2)),
-                                                y - self.brush_diameter / (2 * np.sqrt(2)),
-                                                x + self.brush_diameter / (2 * np.sqrt(2)),
-                                                y + self.brush_diameter / (2 * np.sqrt(2)))
-            self._deleteCrossHandles[1].setLine(x - self.brush_diameter / (2 * np.sqrt(2)),
-                                                y + self.brush_diameter / (2 * np.sqrt(2)),
-                                                x + self.brush_diameter / (2 * np.sqrt(2)),
-                                                y - self.brush_diameter / (2 * np.sqrt(2)))
+        self._updateCursorArea()
 
     def update_cursor_location(self, event):
 
         scenePos = self.mapToScene(event.pos())
-        x, y = scenePos.x(), scenePos.y()
-
-        # Store the coordinates for other operations to use
-        self._lastCursorCoords = (x,y)
 
-        if self._cursorHandle is not None:
-            self._cursorHandle.setPos(x - self.brush_diameter/2, y - self.brush_diameter/2)
-
-        if self._deleteCrossHandles is not None:
-            self._deleteCrossHandles[0].setLine(x - self.brush_diameter / (2 * np.sqrt(2)),
-                                                y - self.brush_diameter / (2 * np.sqrt(2)),
-                                                x + self.brush_diameter / (2 * np.sqrt(2)),
-                                                y + self.brush_diameter / (2 * np.sqrt(2)))
-            self._deleteCrossHandles[1].setLine(x - self.brush_diameter / (2 * np.sqrt(2)),
-                                                y + self.brush_diameter / (2 * np.sqrt(2)),
-                                                x + self.brush_diameter / (2 * np.sqrt(2)),
-                                                y - self.brush_diameter / (2 * np.sqrt(2)))
+        # Store the coordinates for other operations to use. The cursor is hidden while panning
+        if self._cursorVisible:
+            self._updateCursorArea()
+        self._lastCursorCoords = (scenePos.x(), scenePos.y())
+        if self._cursorVisible:
+            self._updateCursorArea()
 
     def redraw_cursor(self):
-        if self._cursorHandle is not None:
-            self._cursorHandle.update()
-
-        if self._deleteCrossHandles is not None:
-            self._deleteCrossHandles[0].update()
-            self._deleteCrossHandles[1].update()
-
-
+        self._updateCursorArea()
+
+    # Painters of the current stroke on the overlay and, in direct mask paint mode, on the offscreen mask:
+    # (overlay, offscreen or None). They stay open until endStroke(), which must be called before the masks
+    # are read, copied or replaced
+    def _strokePainters(self):
+        if self._stroke_painters is None:
+            if self.direct_mask_paint and not self.d_rgb2gray:
+                raise RuntimeError("Cannot use direct mask painting since there is no color conversion rules set.")
+            self._stroke_painters = (QPainter(self.mask_pixmap),
+                                     QPainter(self._offscreen_mask) if self.direct_mask_paint else None)
+        for painter in self._stroke_painters:
+            if painter is not None:
+                painter.setCompositionMode(self.current_painting_mode)
+        return self._stroke_painters
+
+    # Time between display refreshes in ms
+    def _refreshInterval(self):
+        handle = self.window().windowHandle()
+        screen = handle.screen() if handle is not None else QApplication.primaryScreen()
+        rate = screen.refreshRate() if screen is not None else 0
+        return int(1000.0 / (rate if rate > 0 else DEFAULT_REFRESH_RATE))
 
     # Draws a single ellipse
     def fillMarker(self, event):
         scenePos = self.mapToScene(event.pos())
-        painter = QPainter(self.mask_pixmap)
-        painter.setCompositionMode(self.current_painting_mode)
-        painter.setPen(self.brush_fill_color)
-        painter.setBrush(self.brush_fill_color)
+        self.flushStroke()
+        overlay, offscreen = self._strokePainters()
 
         # Get the coordinates of where to draw
         a0 = scenePos.x() - self.brush_diameter/2
@@ -459,60 +693,86 @@ class QtImageAnnotator(QGraphicsView):
         r0 = self.brush_diameter
 
         # Finally, draw
-        painter.drawEllipse(a0, b0, r0, r0)
-
-        # TODO: With really large images, update is rather slow. Must somehow fix this.
-        # It seems that the way to approach hardcore optimization is to switch to OpenGL
-        # for all rendering purposes. This update will likely come much later in the tool's
-        # lifecycle.
-        self._overlayHandle.setPixmap(self.mask_pixmap)
+        overlay.setPen(self.brush_fill_color)
+        overlay.setBrush(self.brush_fill_color)
+        overlay.drawEllipse(a0, b0, r0, r0)
 
         # In case of direct mask paint mode, we need to paint on the mask as well
-        if self.direct_mask_paint:
-            if not self.d_rgb2gray:
-                raise RuntimeError("Cannot use direct mask painting since there is no color conversion rules set.")
-            painter = QPainter(self._offscreen_mask)
-            painter.setCompositionMode(self.current_painting_mode)
+        if offscreen is not None:
             tc = self.d_rgb2gray[self.brush_fill_color.name()]
-            painter.setPen(QColor(tc,tc,tc))
-            painter.setBrush(QColor(tc,tc,tc))
-            painter.drawEllipse(a0, b0, r0, r0)
+            offscreen.setPen(QColor(tc,tc,tc))
+            offscreen.setBrush(QColor(tc,tc,tc))
+            offscreen.drawEllipse(a0, b0, r0, r0)
 
+        # Only the painted area of the overlay needs to be redrawn
+        self._overlayHandle.updatePixmapRect(QRectF(a0 - 2, b0 - 2, r0 + 4, r0 + 4))
         self.lastPoint = scenePos
 
-    # Draws a line
+    # Draws a line from the last point right away
     def drawMarkerLine(self, event):
-        scenePos = self.mapToScene(event.pos())
-        painter = QPainter(self.mask_pixmap)
-        painter.setCompositionMode(self.current_painting_mode)
-        painter.setPen(QPen(self.brush_fill_color,
+        self.addStrokePoint(self.mapToScene(event.pos()))
+        self.flushStroke()
+
+    # Adds a point to the current stroke. Mice can report moves much more often than the display refreshes,
+    # so the points are only queued here and drawn together by flushStroke() at the next refresh
+    def addStrokePoint(self, scenePos):
+        self._stroke_points.append(scenePos)
+        if not self._stroke_timer.isActive():
+            self._stroke_timer.start(self._refreshInterval())
+
+    # Draws the queued points of the current stroke as line segments continuing from the last point
+    @traced("flushStroke")
+    def flushStroke(self):
+        self._stroke_timer.stop()
+        if not self._stroke_points:
+            return
+        points = [QPointF(self.lastPoint)] + self._stroke_points
+        self._stroke_points = []
+        lines = [QLineF(points[i], points[i + 1]) for i in range(len(points) - 1)]
+        overlay, offscreen = self._strokePainters()
+
+        overlay.setPen(QPen(self.brush_fill_color,
                             self.brush_diameter, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
-        painter.drawLine(self.lastPoint, scenePos)
-        self._overlayHandle.setPixmap(self.mask_pixmap)
+        overlay.drawLines(lines)
 
         # In case of direct mask paint mode, we need to paint on the mask as well
-        if self.direct_mask_paint:
-            if not self.d_rgb2gray:
-                raise RuntimeError("Cannot use direct mask painting since there is no color conversion rules set.")
-            painter = QPainter(self._offscreen_mask)
-            painter.setCompositionMode(self.current_painting_mode)
+        if offscreen is not None:
             tc = self.d_rgb2gray[self.brush_fill_color.name()]
-            painter.setPen(QPen(QColor(tc, tc, tc),
-                           self.brush_diameter, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
-            painter.drawLine(self.lastPoint, scenePos)
-
-        self.lastPoint = scenePos
+            offscreen.setPen(QPen(QColor(tc, tc, tc),
+                             self.brush_diameter, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+            offscreen.drawLines(lines)
+
+        # Only the area of the new segments needs to be redrawn
+        xs, ys = [p.x() for p in points], [p.y() for p in points]
+        r = self.brush_diameter / 2 + 2
+        self._overlayHandle.updatePixmapRect(QRectF(min(xs) - r, min(ys) - r, max(xs) - min(xs) + 2 * r,
+                                                    max(ys) - min(ys) + 2 * r))
+        self.lastPoint = points[-1]
+
+    # Finishes the current stroke: draws the queued points and closes the painters
+    def endStroke(self):
+        self.flushStroke()
+        if self._stroke_painters is not None:
+            for painter in self._stroke_painters:
+                if painter is not None:
+                    painter.end()
+            self._stroke_painters = None
 
     # Fills an area using the last stored cursor location
     # If optional argument remove_closed_contour is set to True, then
     # the closed contour over which the cursor is hovering will be erased
+    @traced("fillArea")
     def fillArea(self, remove_closed_contour=False, remove_only_current_color=True):
+        # Only needed when filling, repainting and exporting; not imported at startup
+        import cv2
+        from qimage2ndarray import rgb_view, alpha_view
+        self.endStroke()
 
         # Store previous state so we can go back to it
         self._overlay_stack.append(self.mask_pixmap.copy())
 
         if self.direct_mask_paint:
-            self._offscreen_mask_stack.append(self._offscreen_mask.copy())
+            self._offscreen_mask_stack.append(self._offscreen_array.copy())
 
         # We first convert the mask to a QImage and then to ndarray
         orig_mask = self.mask_pixmap.toImage().convertToFormat(QImage.Format_ARGB32)
@@ -554,38 +814,36 @@ class QtImageAnnotator(QGraphicsView):
         else:
             paintin = msk - msk1  # This is fill case
 
-        # Take original pixmap image: it has two components, RGB and ALPHA
-        new_img = np.dstack((rgb_view(orig_mask), alpha_view(orig_mask)))
-
-        # Fill the newly created area with current brush color
+        # Fill the newly created area with current brush color, or erase the contour. The original pixmap image
+        # (it has two components, RGB and ALPHA) is our own converted copy and is changed in place
         if not remove_closed_contour:
-            new_img[np.where((paintin==255))] = list(self.brush_fill_color.getRgb())
+            sel, rgba = paintin == 255, list(self.brush_fill_color.getRgb())
         else:
-            new_img[np.where((paintin==0))] = (0,0,0,0)  # Erase
-        new_qimg = array2qimage(new_img)
+            sel, rgba = paintin == 0, (0, 0, 0, 0)  # Erase
+        rgb_view(orig_mask)[sel] = rgba[:3]
+        alpha_view(orig_mask)[sel] = rgba[3]
 
         # In case of direct drawing, need to update the offscreen mask as well
         if self.direct_mask_paint:
-            omask = byte_view(self._offscreen_mask).copy()
-            omask = omask.reshape(omask.shape[:-1])
             if not remove_closed_contour:
-                tc = self.d_rgb2gray[self.brush_fill_color.name()]
-                omask[np.where((paintin==255))] = tc
+                self._offscreen_array[sel] = self.d_rgb2gray[self.brush_fill_color.name()]
             else:
-                omask[np.where((paintin==0))] = 0
-            self._offscreen_mask = QImage(omask.data, omask.shape[1], omask.shape[0], omask.strides[0],
-                                          QImage.Format_Grayscale8)
+                self._offscreen_array[sel] = 0
 
-        # Finally update the screen stuff
-        self.mask_pixmap = QPixmap.fromImage(new_qimg)
-        self._overlayHandle.setPixmap(self.mask_pixmap)
+        # Finally update the screen stuff; only the filled area of the zoomed out levels changes
+        self.mask_pixmap = QPixmap.fromImage(orig_mask)
+        self._overlayHandle.setPixmap(self.mask_pixmap, QRect(*cv2.boundingRect(sel.view(np.uint8))))
 
     # Repaint connected contour (disregarding color information) to the current paint color
+    @traced("repaintArea")
     def repaintArea(self):
+        import cv2
+        from qimage2ndarray import rgb_view, alpha_view
+        self.endStroke()
 
         self._overlay_stack.append(self.mask_pixmap.copy())
         if self.direct_mask_paint:
-            self._offscreen_mask_stack.append(self._offscreen_mask.copy())
+            self._offscreen_mask_stack.append(self._offscreen_array.copy())
         orig_mask = self.mask_pixmap.toImage().convertToFormat(QImage.Format_ARGB32)
         msk = alpha_view(orig_mask).copy()
         msk[np.where((msk>0))] = 255
@@ -595,20 +853,16 @@ class QtImageAnnotator(QGraphicsView):
         seed_point = (int(self.lastCursorLocation.x()), int(self.lastCursorLocation.y()))
         cv2.floodFill(msk1, the_mask, seed_point, 0, 0, 1)
         paintin = np.bitwise_xor(msk, msk1)
-        new_img = np.dstack((rgb_view(orig_mask), alpha_view(orig_mask)))
-        new_img[np.where((paintin == 0))] = list(self.brush_fill_color.getRgb())
-        new_qimg = array2qimage(new_img)
+        sel = paintin == 0
+        rgba = list(self.brush_fill_color.getRgb())
+        rgb_view(orig_mask)[sel] = rgba[:3]
+        alpha_view(orig_mask)[sel] = rgba[3]
 
         if self.direct_mask_paint:
-            omask = byte_view(self._offscreen_mask).copy()
-            omask = omask.reshape(omask.shape[:-1])
-            tc = self.d_rgb2gray[self.brush_fill_color.name()]
-            omask[np.where((paintin == 0))] = tc
-            self._offscreen_mask = QImage(omask.data, omask.shape[1], omask.shape[0], omask.strides[0],
-                                          QImage.Format_Grayscale8)
+            self._offscreen_array[sel] = self.d_rgb2gray[self.brush_fill_color.name()]
 
-        self.mask_pixmap = QPixmap.fromImage(new_qimg)
-        self._overlayHandle.setPixmap(self.mask_pixmap)
+        self.mask_pixmap = QPixmap.fromImage(orig_mask)
+        self._overlayHandle.setPixmap(self.mask_pixmap, QRect(*cv2.boundingRect(sel.view(np.uint8))))
 
 
     '''
@@ -619,14 +873,16 @@ class QtImageAnnotator(QGraphicsView):
 
     # Export the grayscale mask
     # This should always be used with direct mode, which supports up to 255 colors for the mask
+    @traced("export_rgb2gray_mask")
     def export_rgb2gray_mask(self):
+        self.endStroke()
         if self._overlayHandle is not None:
             if self.d_rgb2gray:
 
                 if self.direct_mask_paint:
-                    # Easy mode
-                    mask = byte_view(self._offscreen_mask).copy()
-                    mask = mask.reshape(mask.shape[:-1])
+                    # Easy mode: a copy of the offscreen mask. It is painted on further and replaced on undo,
+                    # so a view of it would not keep the exported state
+                    mask = self._offscreen_array.copy()
                 else:
                     # The hard way
                     # Split the image to rgb components
@@ -647,14 +903,37 @@ class QtImageAnnotator(QGraphicsView):
             raise RuntimeError("There is no RGB mask to export to grayscale.")
         return mask
 
-    # Export current mask WITHOUT alpha channel (mask types are determined by colors, not by alpha anyway)
+    # Export current mask WITHOUT alpha channel (mask types are determined by colors, not by alpha anyway).
+    # This is a read-only view of a converted copy of the mask that nothing else refers to
     def export_ndarray_noalpha(self):
+        from qimage2ndarray import rgb_view
+        self.endStroke()
         mask = self.mask_pixmap.toImage().convertToFormat(QImage.Format_ARGB32)
-        return rgb_view(mask).copy()
+        return read_only(rgb_view(mask))
 
     def export_ndarray(self):
+        from qimage2ndarray import rgb_view, alpha_view
+        self.endStroke()
         mask = self.mask_pixmap.toImage().convertToFormat(QImage.Format_ARGB32)
-        return np.dstack((rgb_view(mask).copy(), alpha_view(mask).copy()))
+        return np.dstack((rgb_view(mask), alpha_view(mask)))
+
+    # Memory taken by the layers and undo states of the current image: [(name, bytes)]. Pixmaps are counted
+    # at the depth they are stored in, mip levels only once made (see MipPixmap)
+    def memory_report(self):
+        report = []
+        if self.hasImage():
+            report += [("Image", pixmap_bytes(self._imageMip.pixmap())), ("Image mip levels", self._imageMip.nbytes())]
+        for name, item in [("Helper", self._helperHandle), ("Aux helper", self._auxHelper),
+                           ("Overlay", self._overlayHandle)]:
+            if item is not None:
+                report += [(name, pixmap_bytes(item.pixmap())), (name + " mip levels", item.mipBytes())]
+        if self._offscreen_array is not None:
+            report.append(("Offscreen mask", self._offscreen_array.nbytes))
+        report.append(("Overlay undo (" + str(len(self._overlay_stack)) + " states)",
+                       sum(pixmap_bytes(p) for p in self._overlay_stack)))
+        report.append(("Offscreen mask undo (" + str(len(self._offscreen_mask_stack)) + " states)",
+                       sum(a.nbytes for a in self._offscreen_mask_stack)))
+        return report
 
     '''
     **************
@@ -664,12 +943,15 @@ class QtImageAnnotator(QGraphicsView):
 
     def wheelEvent(self, event):
 
+        if self.input_recorder is not None:
+            self.input_recorder.record_wheel(self.mapToScene(event.pos()), event)
+
         if self.hasImage():
 
             self.redraw_cursor()
 
             # Depending on whether control is pressed, set brush diameter accordingly
-            if QApplication.keyboardModifiers() & Qt.ControlModifier:
+            if event.modifiers() & Qt.ControlModifier:
                 change = 1 if event.angleDelta().y() > 0 else -1
                 self.update_brush_diameter(change)
                 self.redraw_cursor()
@@ -679,6 +961,9 @@ class QtImageAnnotator(QGraphicsView):
 
     def mouseMoveEvent(self, event):
 
+        if self.input_recorder is not None:
+            self.input_recorder.record_mouse(EVENT_MOUSE_MOVE, self.mapToScene(event.pos()), event)
+
         if self.hasImage():
 
             # Make sure that the element has focus when the mouse moves,
@@ -697,7 +982,7 @@ class QtImageAnnotator(QGraphicsView):
 
             # Filling in the markers
             if event.buttons() == Qt.LeftButton:
-                self.drawMarkerLine(event)
+                self.addStrokePoint(self.mapToScene(event.pos()))
 
             # Store cursor location separately; needed for certain operations (like fill)
             self.lastCursorLocation = self.mapToScene(event.pos())
@@ -707,6 +992,9 @@ class QtImageAnnotator(QGraphicsView):
     # Keypress event handler
     def keyPressEvent(self, event):
 
+        if self.input_recorder is not None:
+            self.input_recorder.record_key(EVENT_KEY_PRESS, event)
+
         if self.hasImage():
 
             # Zoom in
@@ -743,7 +1031,7 @@ class QtImageAnnotator(QGraphicsView):
 
             # Erase closed contour under cursor with current paint color
             if event.key() == Qt.Key_X:
-                if QApplication.keyboardModifiers() & Qt.ControlModifier:
+                if event.modifiers() & Qt.ControlModifier:
                     try:
                         self.viewport().setCursor(Qt.BusyCursor)
                         self.fillArea(remove_closed_contour=True)
@@ -754,7 +1042,7 @@ class QtImageAnnotator(QGraphicsView):
 
             # Erase closed contour under cursor and any connected contour regardless of color
             if event.key() == Qt.Key_Q:
-                if QApplication.keyboardModifiers() & Qt.ControlModifier:
+                if event.modifiers() & Qt.ControlModifier:
                     try:
                         self.viewport().setCursor(Qt.BusyCursor)
                         self.fillArea(remove_closed_contour=True, remove_only_current_color=False)
@@ -768,12 +1056,10 @@ class QtImageAnnotator(QGraphicsView):
                 self.global_erase_override = not self.global_erase_override
                 if self.global_erase_override:
                     self.current_painting_mode = self.MODE_ERASE
-                    self._deleteCrossHandles[0].show()
-                    self._deleteCrossHandles[1].show()
+                    self.setDeleteCrossVisible(True)
                 else:
                     self.current_painting_mode = self.MODE_PAINT
-                    self._deleteCrossHandles[0].hide()
-                    self._deleteCrossHandles[1].hide()
+                    self.setDeleteCrossVisible(False)
 
             # Temporarily hide the overlay
             if event.key() == Qt.Key_H:
@@ -791,29 +1077,31 @@ class QtImageAnnotator(QGraphicsView):
 
             # Undo operations
             if event.key() == Qt.Key_Z:
-                if QApplication.keyboardModifiers() & Qt.ControlModifier:
+                if event.modifiers() & Qt.ControlModifier:
+                    self.endStroke()
                     if (len(self._overlay_stack) > 0):
                         self.mask_pixmap = self._overlay_stack.pop()
                         self._overlayHandle.setPixmap(self.mask_pixmap)
 
                     if self.direct_mask_paint:
                         if len(self._offscreen_mask_stack) > 0:
-                            self._offscreen_mask = self._offscreen_mask_stack.pop()
+                            self._setOffscreenMask(self._offscreen_mask_stack.pop())
 
             # When CONTROL is pressed, show the delete cross
             if event.key() == Qt.Key_Control and not self.global_erase_override:
-                self._deleteCrossHandles[0].show()
-                self._deleteCrossHandles[1].show()
+                self.setDeleteCrossVisible(True)
 
         QGraphicsView.keyPressEvent(self, event)
 
     def keyReleaseEvent(self, event):
 
+        if self.input_recorder is not None:
+            self.input_recorder.record_key(EVENT_KEY_RELEASE, event)
+
         if self.hasImage():
 
             if event.key() == Qt.Key_Control and not self.global_erase_override:
-                self._deleteCrossHandles[0].hide()
-                self._deleteCrossHandles[1].hide()
+                self.setDeleteCrossVisible(False)
 
             # Show the overlay again
             if event.key() == Qt.Key_H:
@@ -823,19 +1111,23 @@ class QtImageAnnotator(QGraphicsView):
 
     def mousePressEvent(self, event):
 
+        if self.input_recorder is not None:
+            self.input_recorder.record_mouse(EVENT_MOUSE_PRESS, self.mapToScene(event.pos()), event)
+
         if self.hasImage():
             """ Start drawing, panning with mouse, or zooming in
             """
             scenePos = self.mapToScene(event.pos())
             if event.button() == Qt.LeftButton:
 
+                self.endStroke()
                 self._overlay_stack.append(self.mask_pixmap.copy())
                 if self.direct_mask_paint:
-                    self._offscreen_mask_stack.append(self._offscreen_mask.copy())
+                    self._offscreen_mask_stack.append(self._offscreen_array.copy())
 
                 # If ALT is held, replace color
                 repaint_was_active = False
-                if QApplication.keyboardModifiers() & Qt.AltModifier:
+                if event.modifiers() & Qt.AltModifier:
                     try:
                         repaint_was_active = True
                         self.viewport().setCursor(Qt.BusyCursor)
@@ -846,12 +1138,12 @@ class QtImageAnnotator(QGraphicsView):
                     self.viewport().setCursor(Qt.ArrowCursor)
 
                 # If SHIFT is held, draw a line
-                if QApplication.keyboardModifiers() & Qt.ShiftModifier:
+                if event.modifiers() & Qt.ShiftModifier:
                     self.drawMarkerLine(event)
 
                 # If CONTROL is held, erase, but only if global erase override is not enabled
                 if not self.global_erase_override:
-                    if QApplication.keyboardModifiers() & Qt.ControlModifier:
+                    if event.modifiers() & Qt.ControlModifier:
                         self.current_painting_mode = self.MODE_ERASE
                     else:
                         self.current_painting_mode = self.MODE_PAINT
@@ -865,24 +1157,29 @@ class QtImageAnnotator(QGraphicsView):
                 if self.canPan:
                     self.__prevMousePos = event.pos()
                     self.viewport().setCursor(Qt.ClosedHandCursor)
-                self._cursorHandle.hide()
+                self.setCursorVisible(False)
                 self.middleMouseButtonPressed.emit(scenePos.x(), scenePos.y())
             elif event.button() == Qt.RightButton:
                 if self.canZoom:
                     self.setDragMode(QGraphicsView.RubberBandDrag)
-                self._cursorHandle.hide()
+                self.setCursorVisible(False)
                 self.rightMouseButtonPressed.emit(scenePos.x(), scenePos.y())
         QGraphicsView.mousePressEvent(self, event)
 
     def mouseReleaseEvent(self, event):
         """ Stop mouse pan or zoom mode (apply zoom if valid).
         """
+        if self.input_recorder is not None:
+            self.input_recorder.record_mouse(EVENT_MOUSE_RELEASE, self.mapToScene(event.pos()), event)
+
         if self.hasImage():
             QGraphicsView.mouseReleaseEvent(self, event)
             scenePos = self.mapToScene(event.pos())
-            if event.button() == Qt.MiddleButton:
+            if event.button() == Qt.LeftButton:
+                self.endStroke()
+            elif event.button() == Qt.MiddleButton:
                 self.viewport().setCursor(Qt.ArrowCursor)
-                self._cursorHandle.show()
+                self.setCursorVisible(True)
                 self.middleMouseButtonReleased.emit(scenePos.x(), scenePos.y())
             elif event.button() == Qt.RightButton:
                 if self.canZoom:
@@ -893,13 +1190,16 @@ class QtImageAnnotator(QGraphicsView):
                         self.zoomStack.append(selectionBBox)
                         self.updateViewer()
                 self.setDragMode(QGraphicsView.NoDrag)
-                self._cursorHandle.show()
+                self.setCursorVisible(True)
                 self.rightMouseButtonReleased.emit(scenePos.x(), scenePos.y())
         QGraphicsView.mouseReleaseEvent(self, event)
 
     def mouseDoubleClickEvent(self, event):
         """ Show entire image.
         """
+        if self.input_recorder is not None:
+            self.input_recorder.record_mouse(EVENT_MOUSE_DOUBLE_CLICK, self.mapToScene(event.pos()), event)
+
         if self.hasImage():
             scenePos = self.mapToScene(event.pos())
             if event.button() == Qt.MiddleButton:
@@ -0,0 +1,95 @@
+import json
+import time
+import numpy as np
+
+__author__ = "Aleksei Tepljakov <alex@starspirals.net>"
+__title__ = "QtInputRecorder"
+__version__ = '1.0.0'
+
+# Event types stored in a recording
+EVENT_FRAME = 0  # A new image/mask was set in the annotator
+EVENT_MOUSE_PRESS = 1
+EVENT_MOUSE_RELEASE = 2
+EVENT_MOUSE_MOVE = 3
+EVENT_MOUSE_DOUBLE_CLICK = 4
+EVENT_WHEEL = 5
+EVENT_KEY_PRESS = 6
+EVENT_KEY_RELEASE = 7
+
+EVENT_NAMES = {EVENT_FRAME: "frame",
+               EVENT_MOUSE_PRESS: "mouse_press",
+               EVENT_MOUSE_RELEASE: "mouse_release",
+               EVENT_MOUSE_MOVE: "mouse_move",
+               EVENT_MOUSE_DOUBLE_CLICK: "mouse_double_click",
+               EVENT_WHEEL: "wheel",
+               EVENT_KEY_PRESS: "key_press",
+               EVENT_KEY_RELEASE: "key_release"}
+
+# One record per event. Coordinates are scene (image) coordinates, so that a recording can be
+# replayed in a viewport of a different size. Qt enums are stored as plain integers.
+EVENT_DTYPE = np.dtype([("t", "<f8"),  # Seconds since the start of the recording
+                        ("type", "u1"),
+                        ("x", "<f4"),
+                        ("y", "<f4"),
+                        ("button", "<u4"),
+                        ("buttons", "<u4"),
+                        ("modifiers", "<u4"),
+                        ("key", "<i4"),  # Key code for key events, angle delta for wheel events
+                        ("auto_repeat", "u1")])
+
+RECORDING_FORMAT_VERSION = 1
+
+
+# Records the input events received by a QtImageAnnotator. The annotator calls the record_* methods
+# from its event handlers while recording is active; the recording is written with save() as a
+# compressed NumPy archive holding the event table and a JSON metadata string.
+class QtInputRecorder:
+
+    def __init__(self, path=None):
+        self.path = path
+        self.metadata = {}
+        self._events = []
+        self._t0 = time.perf_counter()
+
+    def __len__(self):
+        return len(self._events)
+
+    def _append(self, etype, x=0.0, y=0.0, button=0, buttons=0, modifiers=0, key=0, auto_repeat=0):
+        self._events.append((time.perf_counter() - self._t0, etype, x, y,
+                             int(button), int(buttons), int(modifiers), key, auto_repeat))
+
+    def record_frame(self, shape):
+        self._append(EVENT_FRAME, float(shape[1] or 0), float(shape[0] or 0))
+
+    def record_mouse(self, etype, scene_pos, event):
+        self._append(etype, scene_pos.x(), scene_pos.y(), event.button(), event.buttons(), event.modifiers())
+
+    def record_wheel(self, scene_pos, event):
+        self._append(EVENT_WHEEL, scene_pos.x(), scene_pos.y(), 0, event.buttons(), event.modifiers(),
+                     event.angleDelta().y())
+
+    def record_key(self, etype, event):
+        self._append(etype, 0.0, 0.0, 0, 0, event.modifiers(), event.key(), int(event.isAutoRepeat()))
+
+    def events(self):
+        return np.array(self._events, dtype=EVENT_DTYPE)
+
+    def save(self, path=None):
+        path = self.path if path is None else path
+        if not path.endswith(".npz"):
+            path += ".npz"
+        meta = dict(self.metadata)
+        meta["version"] = RECORDING_FORMAT_VERSION
+        meta["duration_s"] = time.perf_counter() - self._t0
+        np.savez_compressed(path, events=self.events(), metadata=np.array(json.dumps(meta)))
+        return path
+
+
+# Read a recording written by QtInputRecorder.save(): returns (events, metadata)
+def load_recording(path):
+    with np.load(path) as data:
+        events = data["events"]
+        metadata = json.loads(str(data["metadata"]))
+    if metadata.get("version", 0) > RECORDING_FORMAT_VERSION:
+        raise RuntimeError("Recording " + path + " was made with a newer version of QtInputRecorder.")
+    return events, metadata